@@ -5,6 +5,8 @@
 Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
 """
 
+import numpy as np
+
 # frontend_aliases: used as a reference for various names given to our receivers, and changing them to a standardized set of names
 frontend_aliases = {
     'P1': 'Prime Focus 1',
@@ -129,5 +131,108 @@ def PrepareFrontendInput(frontend):
     return(frontend)
 
 
+# Receiver names that span several receivers. These are only inferred when they cover more of a file's frequencies than any single receiver does.
+combined_receivers = ['Prime Focus All','Array All','Kband All','Unknown']
+
+# The lowest confidence at which an inferred frontend replaces "Unknown"
+frontend_inference_min_confidence = 0.5
+
+# The fraction of a headerless file's channels the receiver from its filename has to cover for the filename to be trusted
+filename_frontend_min_coverage = 0.9
+
+
+def receiver_interval_index(receiver_ranges=GBT_receiver_ranges):
+    """
+    Builds a sorted interval index of the receiver ranges
+
+    param receiver_ranges: dictionary of receiver to {'freq_min','freq_max'}, GBT_receiver_ranges by default
+    returns receivers: array of receiver names, sorted by freq_min
+    returns freq_min: array of the lower edge of each receiver in MHz
+    returns freq_max: array of the upper edge of each receiver in MHz
+    """
+    receivers = np.array(list(receiver_ranges.keys()))
+    freq_min = np.array([receiver_ranges[receiver]['freq_min'] for receiver in receivers])
+    freq_max = np.array([receiver_ranges[receiver]['freq_max'] for receiver in receivers])
+    order = np.argsort(freq_min,kind='stable')
+    return(receivers[order],freq_min[order],freq_max[order])
+
+
+def receiver_coverage(frequencies,receiver_ranges=GBT_receiver_ranges,buffer_factor=.1):
+    """
+    Checks, for every receiver at once, how much of a file's frequencies it covers and how much of its band the file spans
+
+    param frequencies: array of the frequencies in a file (values below 245 are taken to be GHz, as in FrequencyVerification)
+    param receiver_ranges: dictionary of receiver to {'freq_min','freq_max'}
+    param buffer_factor: as in FrequencyVerification, 1/10th of a receiver's range is allowed on either end
+    returns receivers: array of receiver names
+    returns coverage: fraction of the file's channels that fall in each receiver's (buffered) range
+    returns fill: fraction of each receiver's range spanned by the file's channels
+    """
+    frequencies = np.asarray(frequencies,dtype=np.float64)
+    frequencies = frequencies[np.isfinite(frequencies)]
+    frequencies = np.where(frequencies < 245.0,frequencies*1000.0,frequencies)
+    frequencies.sort()
+    receivers,freq_min,freq_max = receiver_interval_index(receiver_ranges)
+    if len(frequencies) == 0:
+        return(receivers,np.zeros(len(receivers)),np.zeros(len(receivers)))
+    freq_buffer = (freq_max-freq_min)*buffer_factor
+    # Counting the channels in each range is two binary searches on the sorted frequencies per receiver
+    inside = np.searchsorted(frequencies,freq_max+freq_buffer,side='right')-np.searchsorted(frequencies,freq_min-freq_buffer,side='left')
+    coverage = inside/len(frequencies)
+    overlap = np.clip(np.minimum(freq_max,frequencies[-1])-np.maximum(freq_min,frequencies[0]),0.0,None)
+    fill = overlap/(freq_max-freq_min)
+    return(receivers,coverage,fill)
+
+
+def infer_frontend(frequencies,receiver_ranges=GBT_receiver_ranges):
+    """
+    Picks the receiver that best matches a file's frequencies: the one covering the most channels, and among those the one
+    whose band the file fills best (so a 1200-1600 MHz file is RcvrArray1_2 rather than Rcvr1_2). A combined range such as
+    "Kband All" is only picked if it covers more of the channels than any single receiver does.
+
+    param frequencies: array of the frequencies in a file
+    param receiver_ranges: dictionary of receiver to {'freq_min','freq_max'}
+    returns frontend: the best-matching receiver name, or 'Unknown'
+    returns confidence: from 0 to 1, the fraction of channels the receiver covers times its share of the match
+    (coverage times fill) among all the single receivers that cover any of the channels
+    """
+    receivers,coverage,fill = receiver_coverage(frequencies,receiver_ranges)
+    score = coverage*fill
+    single = ~np.isin(receivers,combined_receivers) & (coverage > 0)
+    combined = np.isin(receivers,combined_receivers) & (coverage > 0) & (receivers != 'Unknown')
+    candidates = single
+    if np.any(combined) and (not np.any(single) or coverage[combined].max() > coverage[single].max()):
+        candidates = combined
+    if not np.any(candidates):
+        return('Unknown',0.0)
+    index = np.flatnonzero(candidates)
+    best = index[np.lexsort((-fill[index],-coverage[index]))[0]]
+    total_score = score[index].sum()
+    share = score[best]/total_score if total_score > 0 else 1.0/len(index)
+    return(str(receivers[best]),float(coverage[best]*share))
+
+
+def choose_frontend(frontend,frequencies,from_filename=False):
+    """
+    Decides whether to keep the frontend a file was labeled with or to use one inferred from its frequencies.
+    "Unknown" is replaced if the inference is confident enough, and a frontend taken from a headerless file's name is
+    replaced if it doesn't actually cover the file's frequencies.
 
-        
+    param frontend: the verified frontend name (from FrontendVerification)
+    param frequencies: array of the frequencies in the file
+    param from_filename: whether frontend came from the filename of a headerless file
+    returns frontend: the frontend to use
+    returns confidence: the confidence of the inference, or None if the given frontend was kept without inferring
+    """
+    if frontend != 'Unknown' and not from_filename:
+        return(frontend,None)
+    # Some verified names, such as the combined receivers, have no range of their own, so they can only be checked by inferring
+    frontend_range = GBT_receiver_ranges.get(frontend)
+    if frontend_range is not None:
+        receivers,coverage,_ = receiver_coverage(frequencies,{frontend: frontend_range})
+        if coverage[0] >= filename_frontend_min_coverage:
+            return(frontend,None)
+    inferred,confidence = infer_frontend(frequencies)
+    if inferred != 'Unknown' and (confidence >= frontend_inference_min_confidence or frontend != 'Unknown'):
+        return(inferred,confidence)
+    return(frontend,confidence)
@@ -15,6 +15,7 @@
 
 #Sidereal Time and Julian Date Calculator
 #Revision history: Justine Haupt, v1.0 (11/23/17)
+#Edited to work on NumPy arrays of MJD or datetime64 and return fractional hours; LST_calculator keeps the original interface.
 
 #Only valid for dates between 1901 and 2099. Accurate to within 1.1s.
 
@@ -24,64 +25,83 @@
 
 
 
-def LST_calculator(UTC_TD):
-    Long = -72.866      #Longitude of location in question (BMX LAT = 40.869 [40deg 52' 8"], BMX LONG = -72.866 [-72deg 51' 57"], Custer LONG = -72.435)
+import numpy as np
 
+# Longitude of location in question (BMX LAT = 40.869 [40deg 52' 8"], BMX LONG = -72.866 [-72deg 51' 57"], Custer LONG = -72.435)
+Long = -72.866
 
-    #Calculate longitude in DegHHMM format for edification of user:
-    hemisphere = 'W'
-    if Long > 0:        #if the number is positive it's in the Eastern hemisphere
-        hemisphere = 'E'
-    LongDeg = int(Long)
-    LongMin = (Long - int(Long))*60
-    LongSec = (LongMin - int(LongMin))*60
-    LongMin = int(LongMin)
-    LongSec = int(LongSec)
+# The zero point of MJD, and the MJD of the J2000 epoch (JD 2451545) that GMST is counted from
+MJD_epoch = np.datetime64('1858-11-17T00:00:00','us')
+J2000_MJD = 51544.5
+
+
+def MJD_from_datetime64(UTC_times):
+    """
+    Converts UTC times to MJD, keeping sub-second precision
+
+    param UTC_times: a numpy datetime64 (or array of them, or anything np.datetime64 accepts such as a datetime)
+    returns MJD: float MJD (array if given an array)
+    """
+    UTC_times = np.asarray(UTC_times,dtype='datetime64[us]')
+    return((UTC_times-MJD_epoch)/np.timedelta64(86400000000,'us'))
+
+
+def LST_from_MJD(MJD,longitude=Long):
+    """
+    Calculates the local sidereal time, in fractional hours, for an array of MJDs at once
+
+    param MJD: float MJD or array of MJDs (UTC)
+    param longitude: longitude in degrees, east positive
+    returns LST: fractional hours in [0, 24), same shape as MJD
+    """
+    MJD = np.asarray(MJD,dtype=np.float64)
+    #calculate the Greenwhich mean sidereal time (counted from J2000, which keeps the precision that JD - 2451545 would lose):
+    GMST = 18.697374558 + 24.06570982441908*(MJD - J2000_MJD)
+    #Convert to the local sidereal time by adding the longitude (in hours) to the GMST, and wrap to 24 hours
+    LST = np.mod(GMST + longitude/15.0,24.0)
+    return(LST)
 
-    #print '\n\n\nThe longitude is set to %sdeg, [%s %sdeg %s\' %s\"]' %(Long, hemisphere, LongDeg, LongMin, LongSec)
-    #TD = raw_input('\nEnter the UTC time and date as MMDDYY HHMM. (UTC = EST+5, EDT+4):\n')
-    TD = UTC_TD
 
+def LST_from_datetime64(UTC_times,longitude=Long):
+    """
+    Calculates the local sidereal time, in fractional hours, for an array of UTC times at once
 
-    #split TD into individual variables for month, day, etc. and convert to floats:
-    MM = float(TD[0:2])
-    DD = float(TD[2:4])
-    YY = float(TD[4:6])
-    YY = YY+2000
-    hh = float(TD[7:9])
-    mm = float(TD[9:11])
-
-    #convert mm to fractional time:
-    mm = mm/60
-
-    #reformat UTC time as fractional hours:
-    UT = hh+mm
-
-    #calculate the Julian date:
-    JD = (367*YY) - int((7*(YY+int((MM+9)/12)))/4) + int((275*MM)/9) + DD + 1721013.5 + (UT/24)
-    #print '\nJulian Date: JD%s' %(JD)
-
-    #calculate the Greenwhich mean sidereal time:
-    GMST = 18.697374558 + 24.06570982441908*(JD - 2451545)
-    GMST = GMST % 24    #use modulo operator to convert to 24 hours
-    GMSTmm = (GMST - int(GMST))*60          #convert fraction hours to minutes
-    GMSTss = (GMSTmm - int(GMSTmm))*60      #convert fractional minutes to seconds
-    GMSThh = int(GMST)
-    GMSTmm = int(GMSTmm)
-    GMSTss = int(GMSTss)
-    #print '\nGreenwhich Mean Sidereal Time: %s:%s:%s' %(GMSThh, GMSTmm, GMSTss)
-
-    #Convert to the local sidereal time by adding the longitude (in hours) from the GMST.
-    #(Hours = Degrees/15, Degrees = Hours*15)
-    Long = Long/15      #Convert longitude to hours
-    LST = GMST+Long     #Fraction LST. If negative we want to add 24...
-    if LST < 0:
-        LST = LST +24
-    LSTmm = (LST - int(LST))*60          #convert fraction hours to minutes
-    LSTss = (LSTmm - int(LSTmm))*60      #convert fractional minutes to seconds
-    LSThh = int(LST)
-    LSTmm = int(LSTmm)
-    LSTss = int(LSTss)
+    param UTC_times: a numpy datetime64 or array of them
+    param longitude: longitude in degrees, east positive
+    returns LST: fractional hours in [0, 24)
+    """
+    return(LST_from_MJD(MJD_from_datetime64(UTC_times),longitude))
+
+
+def hours_to_hms(hours):
+    """
+    Splits fractional hours into whole hours, whole minutes and fractional seconds
+
+    param hours: float or array of fractional hours
+    returns hh, mm, ss: whole hours, whole minutes, and seconds (with their fraction)
+    """
+    hours = np.asarray(hours,dtype=np.float64)
+    hh = np.floor(hours)
+    minutes = (hours-hh)*60.0
+    mm = np.floor(minutes)
+    ss = (minutes-mm)*60.0
+    return(hh.astype(np.int64),mm.astype(np.int64),ss)
+
+
+def LST_calculator(UTC_TD):
+    """
+    The original scalar interface: takes the UTC time and date as 'MMDDYY HHMM' (UTC = EST+5, EDT+4) and returns the LST as
+    whole hours, minutes and seconds. The work is done by LST_from_datetime64; use that directly for full precision or for arrays.
+    """
+    TD = UTC_TD
+    #split TD into individual variables for month, day, etc.:
+    MM = int(TD[0:2])
+    DD = int(TD[2:4])
+    YY = int(TD[4:6]) + 2000
+    hh = int(TD[7:9])
+    mm = int(TD[9:11])
+    UTC_time = np.datetime64(f"{YY:04d}-{MM:02d}-{DD:02d}T{hh:02d}:{mm:02d}")
+    LSThh,LSTmm,LSTss = hours_to_hms(LST_from_datetime64(UTC_time))
 
     #print '\nLocal Sidereal Time %s:%s:%s \n\n' %(LSThh, LSTmm, LSTss)
-    return(LSThh,LSTmm,LSTss)
\ No newline at end of file
+    return(int(LSThh),int(LSTmm),int(LSTss))
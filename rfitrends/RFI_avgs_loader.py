@@ -5,68 +5,125 @@
 Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
 """
 
-import csv
 import numpy as np
-import pymysql
-import math
-import rfitrends.fxns_output_process
-import sys
+import argparse
+import rfitrends.connection_manager
+import rfitrends.data_stream
+import rfitrends.column_cache
 
-def calculate_avgs_load_into_database(table_to_read,table_to_make):
+# The percentiles stored as low_percentile_intensity and high_percentile_intensity
+low_percentile = 2.75
+high_percentile = 97.5
+
+
+def sorted_group_percentile(intensity,starts,counts,percentile):
     """
-    Takes data from the main SQL database table, calculates the averages of that main table, 
-    and then creates an averaged table and loads it back into the SQL database
+    Calculates a percentile for every group at once, the same way np.percentile does (linear interpolation),
+    assuming the intensities inside each group are already sorted
+
+    param intensity: the intensities, sorted within each group
+    param starts: index of the first element of each group
+    param counts: number of elements in each group
+    param percentile: the percentile to calculate (0-100)
+    returns values: the percentile of each group
     """
+    position = (counts-1)*(percentile/100.0)
+    lower = np.floor(position).astype(np.intp)
+    upper = np.minimum(lower+1,counts-1)
+    fraction = position-lower
+    values = intensity[starts+lower]*(1.0-fraction)+intensity[starts+upper]*fraction
+    return(values)
 
-    cursor,_ = fxns_output_process.connect_to_database()
-
-    with open(table_to_read) as f:
-        reader=csv.reader(f)
-        cached_frequency = 0.00
-        cached_intensity = np.array([])
-        number_of_repeat_frequencies = 0
-        
-        for index,row in enumerate(reader):
-            #Row 0 is just both the frequency and intensity separated by a space. I'm splitting those two into frequency and intensity
-            frequency = float(row[0].split(" ")[0])
-            intensity = float(row[0].split(" ")[1])
-            print(frequency)
-            #math.isclose sees which list of frequencies are the same to 1e-9 (basically almost the same frequencies. We have multiple intensity values for each Frequency)
-            #We then calculate the max, min, etc statistics for those intensities of the same frequencies
-            if math.isclose(cached_frequency,frequency,rel_tol=1e-6) or (cached_frequency) == 0.00:
-                
-                cached_frequency = frequency 
-                cached_intensity = np.append(cached_intensity,intensity)
-                number_of_repeat_frequencies += 1
-
-            else: 
-                
-                average_intensity = np.average(cached_intensity)
-                max_intensity = np.max(cached_intensity)
-                min_intensity = np.min(cached_intensity)
-                median_intensity = np.median(cached_intensity)
-                low_percentile_intensity = np.percentile(cached_intensity,2.75)
-                high_percentile_intensity = np.percentile(cached_intensity,97.5)
-                print("progress: "+str((index*100.0)/14000000.0)+"%")
-
-                add_values = "INSERT INTO "+str(table_to_make)+" (Frequency,mean_intensity,max_intensity,min_intensity,median_intensity,low_percentile_intensity,high_percentile_intensity) VALUES (\""+f"{cached_frequency:.6f}"+"\",\""+str(average_intensity)+"\",\""+str(max_intensity)+"\",\""+str(min_intensity)+"\",\""+str(median_intensity)+"\",\""+str(low_percentile_intensity)+"\",\""+str(high_percentile_intensity)+"\")"
-        
-                #creating SQL table of RFI_Avgs
-                cursor.execute(add_values)
-
-                cached_intensity = np.array([])
-                cached_frequency = frequency
-                number_of_repeat_frequencies = 0
-
-                cached_intensity = np.append(cached_intensity,intensity)
-                number_of_repeat_frequencies += 1
-
-	
 
-if __name__ == "__main__":
-    table_to_read = sys.argv[1]
-    table_to_make = sys.argv[2]
-    calculate_avgs_load_into_database(table_to_read,table_to_make)
+def frequency_group_statistics(frequency,intensity,starts):
+    """
+    Calculates the statistics for each group of repeated frequencies
+
+    param frequency: the frequencies, ordered
+    param intensity: the intensities of each group of the same frequency
+    param starts: index of the first element of each group
+    returns statistics: dictionary with a value per group for every column in data_stream.avgs_columns
+    """
+    counts = np.diff(np.append(starts,len(intensity)))
+    # Rows come ordered by exact frequency and then intensity, but a group can merge several nearly equal frequencies,
+    # so the intensities are sorted again within each group before the median and percentiles are looked up
+    group = np.repeat(np.arange(len(starts)),counts)
+    intensity = intensity[np.lexsort((intensity,group))]
+    statistics = {
+        "Frequency": frequency[starts],
+        "mean_intensity": np.add.reduceat(intensity,starts)/counts,
+        "max_intensity": np.maximum.reduceat(intensity,starts),
+        "min_intensity": np.minimum.reduceat(intensity,starts),
+        "median_intensity": sorted_group_percentile(intensity,starts,counts,50.0),
+        "low_percentile_intensity": sorted_group_percentile(intensity,starts,counts,low_percentile),
+        "high_percentile_intensity": sorted_group_percentile(intensity,starts,counts,high_percentile)
+    }
+    return(statistics)
+
+
+def stream_frequency_statistics(connection_manager,table_to_read,where=None,chunk_size=rfitrends.data_stream.default_chunk_size):
+    """
+    Streams the main table in order of frequency and intensity, and yields the statistics of each group of repeated frequencies
+
+    param connection_manager: An object that connects to the database for the user
+    param table_to_read: the main table from which we calculate statistics
+    param where: optional SQL condition to calculate the statistics on a subset of the table
+    param chunk_size: number of rows pulled from the server at a time
+    yields statistics: dictionary of statistic arrays for the complete frequency groups in each chunk
+    """
+    # Ordering by intensity as well means most groups arrive already sorted, which makes sorting them within each group cheap
+    chunks = rfitrends.data_stream.stream_main_table(connection_manager,table_to_read,order_by=("Frequency_MHz","Intensity_Jy"),where=where,chunk_size=chunk_size)
+    #Several intensity values exist for each frequency. Frequencies within 1e-6 of each other are treated as the same one.
+    for chunk,starts in rfitrends.data_stream.stream_complete_groups(chunks,"Frequency_MHz",rel_tol=1e-6):
+        yield frequency_group_statistics(chunk["Frequency_MHz"],chunk["Intensity_Jy"],starts)
 
 
+def statistics_to_rows(statistics):
+    """
+    Turns a dictionary of statistic arrays into rows ready for insertion into the avgs table
+
+    param statistics: dictionary of statistic arrays, as from frequency_group_statistics
+    returns rows: list of row lists in the order of data_stream.avgs_columns
+    """
+    # Frequency is stored with 6 decimals, as it always has been
+    frequencies = [f"{frequency:.6f}" for frequency in statistics["Frequency"]]
+    columns = [frequencies]+[statistics[column].tolist() for column in rfitrends.data_stream.avgs_columns[1:]]
+    rows = [list(row) for row in zip(*columns)]
+    return(rows)
+
+
+def calculate_avgs_load_into_database(connection_manager,table_to_read,table_to_make,where=None):
+    """
+    Takes data from the main SQL database table, calculates the averages of that main table,
+    and then creates an averaged table and loads it back into the SQL database
 
+    param connection_manager: An object that connects to the database for the user
+    param table_to_read: the main table from which we calculate statistics
+    param table_to_make: the table which will contain the statistics
+    param where: optional SQL condition to calculate the statistics on a subset of the table
+    returns total_frequencies: the number of rows written to table_to_make
+    """
+    total_frequencies = 0
+    for statistics in stream_frequency_statistics(connection_manager,table_to_read,where):
+        rows = statistics_to_rows(statistics)
+        #creating SQL table of RFI_Avgs
+        connection_manager.insert_rows(table_to_make,rfitrends.data_stream.avgs_columns,rows)
+        total_frequencies += len(rows)
+        print("progress: "+str(total_frequencies)+" frequencies loaded, up to "+f"{statistics['Frequency'][-1]:.6f}"+" MHz")
+    rfitrends.column_cache.bump_generation(connection_manager,[table_to_make])
+    return(total_frequencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calculates statistics for each frequency of an RFI table and loads them into a new table")
+    parser.add_argument("table_to_read",help="The table from which you want to calculate statistics (likely main_table from RFI_input_for_SQL.py)")
+    parser.add_argument("table_to_make",help="The table that will contain the statistics calculated")
+    parser.add_argument("IP_address",nargs='?',default= '192.33.116.22',help="The IP address to find the SQL database. Default is the GBO development server address. This would only work for employees.")
+    parser.add_argument("database",nargs='?',default='jskipper',help="The name of the SQL database. Default is jskipper, which would only work for employees.")
+    args = parser.parse_args()
+    connection_manager = rfitrends.connection_manager.connection_manager(args.IP_address,args.database)
+    calculate_avgs_load_into_database(connection_manager,args.table_to_read,args.table_to_make)
+
+
+if __name__ == "__main__":
+    main()
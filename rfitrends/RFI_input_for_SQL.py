@@ -6,12 +6,14 @@ Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
 import os
+import io
+import mmap
+import warnings
+import itertools
 import sys
 import copy
 import re
-import julian
 import datetime
 import rfitrends.LST_calculator
 import getpass
@@ -21,15 +23,21 @@ import rfitrends.connection_manager
 import argparse
 import math
 import rfitrends.Column_fixes
+import rfitrends.scan_store
+import rfitrends.scan_sources
+import rfitrends.schema_manager
+import rfitrends.column_cache
 import configparser
 from rfitrends.manage_missing_cols import manage_missing_cols
+from rfitrends.parsed_scan import parsed_scan,scan_header,missing_index,index_string
 import json
-import mysql
 import traceback
-from mysql import connector
 from decimal import *
-from pkg_resources import resource_filename,resource_exists,Requirement
-from tqdm import tqdm
+# mysql, tqdm and pkg_resources are only imported by the functions that use them, so that importing this module
+# (i.e. for rfitrends upload --help) stays fast
+
+# About how many bytes of a memory-mapped scan file are tokenized at a time (see parse_mapped_file)
+mapped_chunk_bytes = 16*1024*1024
 
 # Creating RaiseError classes (custom Error messages)
 # Even though the object does nothing, it will still allow 
@@ -47,6 +55,17 @@ class InvalidIntensity(Exception):
 class DuplicateValues(Exception):
     pass
 
+def read_config():
+    """
+    Reads rfitrends.conf from the installed package
+
+    returns config: the ConfigParser holding rfitrends.conf
+    """
+    from pkg_resources import resource_filename
+    config = configparser.ConfigParser()
+    config.read(resource_filename('rfitrends','rfitrends.conf'))
+    return(config)
+
 ########### File Gathering Functions ##########
 
 def gather_filepaths_to_process(path,files_to_process = "all"):
@@ -61,89 +80,277 @@ def gather_filepaths_to_process(path,files_to_process = "all"):
 
     filepaths = []
     if files_to_process == "all":
-    # making a list of all of the .txt files in the directory so I can just cycle through each full path:
-        for filename in os.listdir(path):
-            if filename.endswith(".txt") and filename != "URLs.txt" and (filename.startswith('AGBT') or filename.startswith('TRFI') or filename.startswith('TGBT')):# If the files are ones we are actually interested in
-                filepaths.append(os.path.join(path,filename))
-                continue
+    # making a list of all of the .txt files (compressed or not, and in tar archives) in the directory so I can just cycle through each full path:
+        wanted = rfitrends.scan_sources.is_scan_file
     else: 
-        # For each file in the path given
-        for filename in os.listdir(path):
-            # If there is any element from files_to_process contained in the current filename, it is a file to process. I.E. if "TRFI_052819_L1" is 
-            # An element in files_to_process, and filename is "TRFI_052819_L1_rfiscan1_s0001_f001_Linr_az357_el045.txt" then it will be included as a file to process
-            if any(RFI_file in filename for RFI_file in files_to_process):
-                filepaths.append(os.path.join(path,filename))
+        # If there is any element from files_to_process contained in the current filename, it is a file to process. I.E. if "TRFI_052819_L1" is 
+        # An element in files_to_process, and filename is "TRFI_052819_L1_rfiscan1_s0001_f001_Linr_az357_el045.txt" then it will be included as a file to process
+        def wanted(filename):
+            return(any(RFI_file in filename for RFI_file in files_to_process))
+    # For each file in the path given
+    for filename in os.listdir(path):
+        if rfitrends.scan_sources.is_tar_archive(filename):
+            # The scans in an archive are listed without extracting it
+            filepaths += rfitrends.scan_sources.archive_sources(os.path.join(path,filename),wanted)
+        elif wanted(filename):# If the files are ones we are actually interested in
+            filepaths.append(os.path.join(path,filename))
     return(filepaths)
 
 
 ########### Singular File processing functions ##############
 
 
-# Use this function to read in a particular file and return a dictionary with all header values and lists of the data
-def read_file(filepath,main_database,dirty_database, connection_manager):
+def parse_file(filepath):
     """
-    Goes through each file, line by line, processes and cleans the data, then loads it into a dictionary with a marker for the corresponding database
-    to which it belongs. 
+    Reads a file's header (or extrapolates one from its filename), then reads all of its data lines at once into a parsed_scan, 
+    marking which channels belong in the dirty table. Nothing here touches the database. 
 
-    param main_database: the primary database to which the person wants their clean data to go
-    param dirty_database: the secondary database to which the person wans their "dirty," or nonsensical data to go
-    param connection_manager: An object that connects to the database for the user. 
-    returns formatted_RFI_file: The dictionary with all of the data formatted and organized. 
-    returns all_file_info: contains all information, not just header
+    param filepath: the path to the file, which may be gzip, bzip2 or xz compressed, or path::member for a scan in a tar archive
+    returns scan: the parsed_scan holding the file's header and channels
     """
-    
-    # Open the file
-    f = open(filepath, 'r')
-    # Data is a dictionary containing column values that will be added to the dictionary later:
-    data = {}
-    # Database is which database (dirty or clean) to which the given line should be assigned
-    database = []
+    # Plain files are memory-mapped and their numbers read straight from the mapping. Compressed files and archive members,
+    # And anything the mapped path can't handle, are read as a stream of lines
+    if rfitrends.scan_sources.is_plain_file(filepath):
+        scan = parse_mapped_file(filepath)
+        if scan is not None:
+            return(scan)
+    with rfitrends.scan_sources.open_scan(filepath) as (stream,modification_time):
+        return(parse_stream(filepath,stream,modification_time))
+
+
+def parse_mapped_file(filepath,chunk_bytes=mapped_chunk_bytes):
+    """
+    Parses a plain scan file by memory-mapping it: the end of the header is found with a byte search, and the data is tokenized
+    straight from the mapping into NumPy arrays, without making a string for every line. The file's pages come from the page cache, 
+    so reading the same file again (i.e. after a failed upload) costs nothing more. 
+
+    param filepath: the path to a plain (uncompressed) scan file
+    param chunk_bytes: about how many bytes of data are tokenized at a time, which bounds the memory used on top of the arrays
+    returns scan: the parsed_scan, or None if the file has to be parsed line by line instead (see read_mapped_columns)
+    """
+    with open(filepath,'rb') as f:
+        # An empty file can't be mapped, the line by line path reports it
+        if os.fstat(f.fileno()).st_size == 0:
+            return(None)
+        with mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) as mapped:
+            has_header = mapped[:1] == b'#'
+            if has_header:
+                data_start = mapped_data_start(mapped)
+                if data_start is None:
+                    return(None)
+                try:
+                    header_text = mapped[:data_start].decode()
+                except UnicodeDecodeError:
+                    return(None)
+                # The header is only a few lines, so it goes through process_header as text
+                all_file_info = process_header(io.StringIO(header_text))
+            else:
+                data_start = 0
+                all_file_info = extrapolate_header(filepath)
+            columns = read_mapped_columns(mapped,data_start,all_file_info['Column names'],chunk_bytes)
+    if columns is None:
+        return(None)
+    return(build_scan(filepath,all_file_info,columns,has_header))
+
+
+def mapped_data_start(mapped):
+    """
+    Finds where the data starts in a mapped file with a header, the same way process_header does: after the line following the DATA line
 
+    param mapped: the mapped file
+    returns position: the byte offset of the first data line, or None if the header doesn't end the way process_header expects
+    """
+    position = 0
+    while position < len(mapped):
+        # Every header line starts with #, so if we get past them without finding the DATA line, this isn't a header we know
+        if mapped[position:position+1] != b'#':
+            return(None)
+        line_end = mapped.find(b'\n',position)
+        if line_end == -1:
+            return(None)
+        line = mapped[position:line_end]
+        if (b'DATA' in line or b'Data' in line) and not (b'HEADER' in line or b'Header' in line):
+            # The next line holds the column names
+            column_line_end = mapped.find(b'\n',line_end+1)
+            return(len(mapped) if column_line_end == -1 else column_line_end+1)
+        position = line_end+1
+    return(None)
+
+
+def read_mapped_columns(mapped,start,column_names,chunk_bytes=mapped_chunk_bytes):
+    """
+    Tokenizes the data lines of a mapped file into columns. NumPy's tokenizer needs a bytes object, so the mapping is read in slices 
+    of about chunk_bytes that end at a line break, each turned straight into numbers without splitting it into lines.
+
+    param mapped: the mapped file
+    param start: the byte offset of the first data line
+    param column_names: the names of the columns contained in this file
+    param chunk_bytes: about how many bytes are tokenized at a time
+    returns columns: dictionary of the standardized column name to an array of its values, or None if a line has the wrong number
+    of values or a value that isn't a number. read_data_columns then parses the file line by line, which reports the bad line as it always has
+    """
+    fixed_column_names = fix_column_names(column_names)
+    pieces = []
+    position = start
+    with warnings.catch_warnings():
+        # NumPy only warns when it stops at something that isn't a number
+        warnings.simplefilter("error",DeprecationWarning)
+        while position < len(mapped):
+            end = min(position+chunk_bytes,len(mapped))
+            if end < len(mapped):
+                # Each slice ends at a line break, so no number is split between two slices
+                line_end = mapped.rfind(b'\n',position,end)
+                if line_end == -1:
+                    line_end = mapped.find(b'\n',end)
+                end = len(mapped) if line_end == -1 else line_end+1
+            chunk = mapped[position:end]
+            # Every line has to have a value for every column (or be blank, and skipped, as it always has been). Columns overlapping in a 
+            # Line (i.e. 1471.456800.000) would leave it a value short
+            counts = values_per_line(chunk)
+            if not np.all((counts == len(fixed_column_names)) | (counts == 0)):
+                return(None)
+            try:
+                values = np.fromstring(chunk,dtype=np.float64,sep=' ')
+            except (ValueError,DeprecationWarning):
+                return(None)
+            if values.size != counts.sum():
+                return(None)
+            pieces.append(values)
+            position = end
+    values = np.concatenate(pieces) if pieces else np.zeros(0)
+    values = values.reshape(-1,len(fixed_column_names))
+    return({column_name: values[:,index] for index,column_name in enumerate(fixed_column_names)})
+
+
+def parse_stream(filepath,stream,modification_time):
+    """
+    Parses a scan from a stream of its bytes, which is read once from start to end, so it can be decompressed as it is read
+
+    param filepath: the path the scan came from (see parse_file)
+    param stream: a binary stream of the scan with a peek method (see scan_sources.open_scan)
+    param modification_time: the unix time the scan was last modified, used for headerless files
+    returns scan: the parsed_scan holding the file's header and channels
+    """
     # If there's a # at the beginning of the first line, we know this file has a header and doesn't 
-    # Just jump straight into the data. 
-    if '#' in f.read(1):
+    # Just jump straight into the data. We only peek at it, so there's no need to go back to the start of the file
+    if stream.peek(1)[:1] == b'#':
         has_header = True
     else:
         has_header = False
-    # Since we read the first line, we want to reset the reader so it will reread the first line
-    # When parsing the header. 
-    f.seek(0)
+    f = io.TextIOWrapper(stream)
     # If it has a header, we want to process it, if it doesn't, we will extrapolate what info we can
     if has_header:
-        all_file_info,first_data_line = process_header(f)
+        all_file_info = process_header(f)
     else:
-        all_file_info = extrapolate_header(f.name)
-        # Get the first line
-        first_data_line = f.readline()
-        # Set the reader back to the first line
-        f.seek(0)
+        all_file_info = extrapolate_header(filepath,modification_time)
+    # The reader is now at the first data line, so the rest of the file is the data
+    columns = read_data_columns(f,all_file_info['Column names'])
+    return(build_scan(filepath,all_file_info,columns,has_header))
+
+
+def build_scan(filepath,all_file_info,columns,has_header):
+    """
+    Makes the parsed_scan of a file from its header and data columns, checking its frontend and which channels are out of its bounds
+
+    param filepath: the path the scan came from (see parse_file)
+    param all_file_info: the header dictionary made by process_header or extrapolate_header
+    param columns: dictionary of the standardized column name to an array of its values
+    param has_header: whether the file had a header
+    returns scan: the parsed_scan
+    """
     # Verifies that frontend given exists, otherwise labels it as Unknown. 
     all_file_info["frontend"] = rfitrends.GBT_receiver_specs.FrontendVerification(all_file_info["frontend"])
     # Pulls filename from full path to filename
-    all_file_info["filename"] = filepath.split("/")[-1]
-    
+    all_file_info["filename"] = rfitrends.scan_sources.scan_filename(filepath)
+
+    # Lines with a NaN intensity aren't useful for science, so they're dropped
+    valid = ~np.isnan(columns["Intensity_Jy"])
+    frequencies = columns["Frequency_MHz"][valid]
+    # A headerless file's frontend is only a guess from its filename, and "Unknown" gets the widest bounds and no caching tables,
+    # So in either case we check the guess against the frequencies actually in the file
+    if not has_header or all_file_info["frontend"] == 'Unknown':
+        frontend,confidence = rfitrends.GBT_receiver_specs.choose_frontend(all_file_info["frontend"],frequencies,from_filename=not has_header)
+        if confidence is not None:
+            print("Frontend inferred from the frequencies in the file as \""+frontend+"\" (was \""+all_file_info["frontend"]+"\") with a confidence of "+str(round(confidence,3)))
+        all_file_info["frontend"] = frontend
+    # Frequencies outside of the receiver's bounds go into the dirty table
+    frequencies,in_bounds = verify_frequencies(frequencies,all_file_info["frontend"])
+    header = scan_header.from_dict(all_file_info,has_header)
+    window = index_column(columns.get("Window"),valid)
+    channel = index_column(columns.get("Channel"),valid)
+    # Repeated frequencies within the file are averaged into one channel here
+    scan = parsed_scan.from_lines(header,frequencies,columns["Intensity_Jy"][valid],window,channel,dirty=~in_bounds,nan_lines=np.count_nonzero(~valid))
+    # Fill in missing columns if necessary (in other words, if we're missing a window or channel column, fill it with "NaN" values)
+    scan = manage_missing_cols(scan).getdata_entry()
+    return(scan)
+
+
+def index_column(values,valid):
+    # Window and channel numbers as integers, with missing_index where they aren't numbers
+    if values is None:
+        return(None)
+    values = values[valid]
+    return(np.where(np.isfinite(values),values,missing_index).astype(np.int32))
+
+
+def read_data_columns(file,column_names):
+    """
+    Reads every data line left in a file at once and splits it into columns
 
-    # Loop until we find the first valid data line, which we need to lookup the primary key:
-    last_pos = f.tell()
-    if first_data_line == '\n':
-        first_data_line = f.readline()
-    while True:
-        try:
-            first_data_entry = ReadFileLine_ColumnValues(has_header, first_data_line.strip().split(), all_file_info['Column names'], f.name)
-            first_data_entry["Frequency_MHz"] = FrequencyVerification(first_data_entry["Frequency_MHz"],all_file_info) 
-        except (InvalidIntensity,FreqOutsideRcvrBoundsError) as e:
-            # If the velocity is invalid or the Frequency is outside of bounds, then continue to read the next line:
-            last_pos = f.tell()
-            first_data_line = f.readline()
-            continue    
-        break
-    f.seek(last_pos)
-    
-    first_line_entry = dict(all_file_info)
-    first_line_entry.update(first_data_entry)
+    param file: the open file, positioned at the first data line
+    param column_names: the names of the columns contained in this file
+    returns columns: dictionary of the standardized column name to an array of its values
+    """
+    fixed_column_names = fix_column_names(column_names)
+    # Blank lines are skipped, as they always have been
+    rows = [line.split() for line in file if line.strip()]
+    # Unfortunately, we first have to check if the column names match the length of the column values. For example, if the columns overlapped with themselves anywhere, such as the frequency values bleeding into intensity values to make 1471.456800.000 which should be 
+    # something like 1471.456 for frequency and 800.000 for intensity or something (these are made up numbers for example only). 
+    if any(len(row) != len(fixed_column_names) for row in rows):
+        raise InvalidColumnValues("The number of column names and number of column values for this file is not equal. This is an invalid file.")
+    try:
+        values = np.array(rows,dtype=np.float64).reshape(len(rows),len(fixed_column_names))
+    except ValueError:
+        raise InvalidColumnValues("There is a value in this file that isn't a number. This is an invalid file.")
+    return({column_name: values[:,index] for index,column_name in enumerate(fixed_column_names)})
+
+
+def values_per_line(chunk):
+    """
+    Counts the whitespace-separated values on every line of a block of text, with array operations over its bytes
+
+    param chunk: bytes holding whole lines
+    returns counts: array of the number of values on each line
+    """
+    characters = np.frombuffer(chunk,dtype=np.uint8)
+    newlines = characters == ord('\n')
+    whitespace = newlines | (characters == ord(' ')) | (characters == ord('\t')) | (characters == ord('\r'))
+    # A value starts wherever a character that isn't whitespace follows whitespace (or the start of the block)
+    starts = ~whitespace
+    starts[1:] &= whitespace[:-1]
+    line_of = np.cumsum(newlines)-newlines
+    lines = int(newlines.sum())+(0 if chunk.endswith(b'\n') else 1)
+    return(np.bincount(line_of[starts],minlength=lines))
+
+
+def check_duplicate(scan,main_database,dirty_database,connection_manager):
+    """
+    Raises DuplicateValues if a file is already in the database: if the main table has a row with the same composite key as
+    one of the file's clean channels, or the dirty table has rows from a file of the same name
+
+    param scan: the parsed_scan of the file
+    param main_database: the primary database to which the person wants their clean data to go
+    param dirty_database: the secondary database to which the person wans their "dirty," or nonsensical data to go
+    param connection_manager: An object that connects to the database for the user. 
+    """
+    clean = np.flatnonzero(~scan.dirty)
+    # If there isn't a single good line, there is nothing to upload from this file
+    if len(clean) == 0:
+        raise InvalidColumnValues("There are no valid data lines in this file.")
+    first_line_entry = scan.header.column_values()
+    first_line_entry["Frequency_MHz"] = scan.frequency_string(clean[0])
     # Getting primary composite key from config file:
-    config = configparser.ConfigParser()
-    config.read(resource_filename('rfitrends',"rfitrends.conf"))
+    config = read_config()
     composite_keys = json.loads(config['Mandatory Fields']['primary_composite_key'])
     search_query_main = "SELECT * from "+main_database+" WHERE "
     search_query_dirty = "SELECT * from "+dirty_database+" WHERE filename = \'"+first_line_entry['filename']+"\'"
@@ -158,83 +365,162 @@ def read_file(filepath,main_database,dirty_database, connection_manager):
     if myresult_main or myresult_dirty:
         raise DuplicateValues
 
-    print("File does not exist in database. Reading in data. This can take a few minutes.")
-    # Going through each line in the file one by one:
-    for data_line in f:
-        # If it's just a new line, we skip the line
-        if data_line == '\n':
-            continue
-        # Read the data in the line and put it in our data_entry dictionary
-        try:
-            data_entry = ReadFileLine_ColumnValues(has_header, data_line.strip().split(), all_file_info['Column names'], f.name)
-        # If the data was flagged for invalid intensity, skip it. Not useful for science. 
-        except InvalidIntensity:
-            continue
-        # Verify that the frequency is a reasonable one
-        try:
-            data_entry["Frequency_MHz"] = FrequencyVerification(data_entry["Frequency_MHz"],all_file_info)
-            database.append(main_database)
-            database_value = main_database    
-        # If we do get frequencies outside of the bounds that we want, we put it into the dirty table. 
-        except FreqOutsideRcvrBoundsError:
-            database.append(dirty_database)
-            database_value = dirty_database
-        # Now that we have the database value (dirty or clean) we want to associate it with our data entry dictionary. 
-        data_entry["Database"] = database_value
-        # If data entry is already in data, we have a repeat value within a file. We just up the counts, avg the intensity, 
-        # And NaN out Window and Channel as they no longer have meaning since it is an average of 2 points
-        if data_entry["Frequency_MHz"] in data:
-            counts = float(data[data_entry["Frequency_MHz"]]["Counts"])
-            old_intensity = float(data[data_entry["Frequency_MHz"]]["Intensity_Jy"])
-            new_intensity = float(data_entry["Intensity_Jy"])
-            avg_intensity = (old_intensity*counts + new_intensity)/(counts+1)
-            data[data_entry["Frequency_MHz"]]["Window"] = "NaN"
-            data[data_entry["Frequency_MHz"]]["Channel"] = "NaN"
-            data[data_entry["Frequency_MHz"]]["Intensity"] = avg_intensity
-            data[data_entry["Frequency_MHz"]]["Counts"] += 1
-        # If it's not in there, then we know there's one data point with this frequency, the one we just found.
-        # So we append it to the data list and set counts to 1. 
+
+# Use this function to read in a particular file and return its header values and data
+def read_file(filepath,main_database,dirty_database, connection_manager,layout="wide",spool=None):
+    """
+    Parses a file and checks that it isn't already in the database
+
+    param main_database: the primary database to which the person wants their clean data to go
+    param dirty_database: the secondary database to which the person wans their "dirty," or nonsensical data to go
+    param connection_manager: An object that connects to the database for the user. 
+    param layout: how the main table is stored (see schema_manager.layouts)
+    param spool: optionally, a scan_spool (see scan_spool.py) to take the parsed file from, or to keep it in once parsed
+    returns scan: the parsed_scan holding the file's header and channels, with the channels for the dirty table marked
+    """
+    if spool is not None:
+        scan = spool.parse(filepath)
+    else:
+        scan = parse_file(filepath)
+    check_file(scan,main_database,dirty_database,connection_manager,layout)
+    return(scan)
+
+
+def check_file(scan,main_database,dirty_database,connection_manager,layout="wide"):
+    """
+    Raises DuplicateValues if a parsed file is already in the database. In the normalized layouts a file is a duplicate if its scan has already been stored
+    """
+    if layout == "wide":
+        check_duplicate(scan,main_database,dirty_database,connection_manager)
+    elif rfitrends.scan_store.scan_ids(connection_manager,main_database,scan.header.filename):
+        raise DuplicateValues
+
+
+def parse_tasks(filepaths):
+    """
+    Splits the files to parse into tasks for the parse workers: a task for each file, except that the scans from the same tar archive 
+    are one task, so the archive is only decompressed once
+
+    param filepaths: the files to parse, as given by gather_filepaths_to_process
+    returns tasks: a list of lists of files
+    """
+    tasks = []
+    previous_archive = None
+    for filepath in filepaths:
+        archive,member = rfitrends.scan_sources.split_source(filepath)
+        if member is not None and archive == previous_archive:
+            tasks[-1].append(filepath)
         else:
-            frequency_key = data_entry["Frequency_MHz"]
-            del data_entry["Frequency_MHz"]
-            data_entry['Counts'] = 1
-            data[frequency_key] = data_entry
-    # We have the header information in our all_file_info, time to add the data
-    all_file_info['Data'] = data
-    return(all_file_info)
+            tasks.append([filepath])
+        previous_archive = archive if member is not None else None
+    return(tasks)
+
+
+def parse_task(filepaths,spool=None):
+    """
+    Parses the files of one task (see parse_tasks). This runs in the parse workers, so decompressing happens there too.
+    A file that fails to parse, for whatever reason, only fails itself, so one bad file can't stop the upload.
+
+    param filepaths: the files of the task
+    param spool: optionally, a scan_spool to take parsed files from and keep them in
+    returns results: a list of (filepath, parsed_scan or None, the exception raised while parsing or None) in the order of filepaths
+    """
+    parsed = {}
+    archive,member = rfitrends.scan_sources.split_source(filepaths[0])
+    if member is None:
+        try:
+            parsed[filepaths[0]] = (spool.parse(filepaths[0]) if spool is not None else parse_file(filepaths[0]),None)
+        except Exception as error:
+            parsed[filepaths[0]] = (None,error)
+    else:
+        to_parse = []
+        for filepath in filepaths:
+            scan = spool.get(filepath) if spool is not None else None
+            if scan is not None:
+                parsed[filepath] = (scan,None)
+            else:
+                to_parse.append(filepath)
+        # The scans that weren't spooled are read from one pass through the archive
+        if to_parse:
+            members = [rfitrends.scan_sources.split_source(filepath)[1] for filepath in to_parse]
+            try:
+                for filepath,stream,modification_time in rfitrends.scan_sources.archive_scans(archive,members):
+                    try:
+                        scan = parse_stream(filepath,stream,modification_time)
+                    except Exception as error:
+                        parsed[filepath] = (None,error)
+                        continue
+                    if spool is not None:
+                        spool.put(filepath,scan)
+                    parsed[filepath] = (scan,None)
+            except Exception as error:
+                # An archive that can't be read any further fails the scans not yet read from it
+                for filepath in to_parse:
+                    parsed.setdefault(filepath,(None,error))
+    results = []
+    for filepath in filepaths:
+        scan,error = parsed.get(filepath,(None,InvalidColumnValues("This file could not be found in its archive.")))
+        results.append((filepath,scan,error))
+    return(results)
+
+
+def parse_files(filepaths,parse_workers=1,spool=None):
+    """
+    Parses files in order, with parse_workers processes parsing (and decompressing) the files ahead of the one being uploaded
+
+    param filepaths: the files to parse, as given by gather_filepaths_to_process
+    param parse_workers: the number of worker processes. With 1, files are parsed in this process as they're needed
+    param spool: optionally, a scan_spool to take parsed files from and keep them in
+    yields result: (filepath, parsed_scan or None, the exception raised while parsing or None) for every file, in order
+    """
+    tasks = parse_tasks(filepaths)
+    if parse_workers <= 1:
+        for task in tasks:
+            for result in parse_task(task,spool):
+                yield(result)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=parse_workers) as executor:
+        # Only a couple of tasks per worker are parsed ahead, so parsed files don't pile up in memory if the database is the slower part
+        pending = []
+        tasks = iter(tasks)
+        for task in itertools.islice(tasks,2*parse_workers):
+            pending.append(executor.submit(parse_task,task,spool))
+        while pending:
+            results = pending.pop(0).result()
+            for task in itertools.islice(tasks,1):
+                pending.append(executor.submit(parse_task,task,spool))
+            for result in results:
+                yield(result)
+
 
 def process_header(file):
     """
     Goes through the header of a given file, and extrapolates the information necessary. 
 
-    param file: the file confirmed to have a header from which we want information
+    param file: the file confirmed to have a header from which we want information. It is read up to the first data line
     returns header: a dictionary containing header information
     """
     f = file
     # Dict of header fields and values
     header = {}
-    previous_line_position = f.tell()
     # emulating a do while loop because it doesn't exist in Python
     line = f.readline()
     # Read the file
     while line:
         if 'HEADER' in line or 'Header' in line: 
             # Again emulating a do while loop
-            previous_line_position = f.tell()
             line = f.readline()
             continue
         elif 'DATA' in line or 'Data' in line: 
             # We know next line is column data. 
             # Read the next line
             column_line = f.readline()
-            # peak at data line so we can seek back to it. 
-            current_line = f.tell()
-            first_data_line = f.readline()
             # Assumes column names are separated by variable number of spaces/tabs
             column_entries = column_line.strip('#').split()
             header['Column names'] = column_entries
-            # We've reached data line, time to get out of the loop
-            f.seek(current_line)
+            # We've reached data line, time to get out of the loop. The file is left at the first data line without 
+            # Seeking back to it, since a decompressing stream can't seek
             break
         else:
             # We know this is a regular header line
@@ -249,38 +535,52 @@ def process_header(file):
 
         previous_header_entry = header_entry
         # Again emulating a do while loop
-        previous_line_position = f.tell()
         line = f.readline()
-    return(header,first_data_line)
+    return(header)
+
+
+def headerless_mjd(date):
+    """
+    Calculates the MJD headerless files are stored with: that of date plus 12 hours, rounded down to 0.001 days.
+    This is the arithmetic julian.to_jd did when these files were first uploaded, step by step in the same floating point order,
+    so the last digit comes out the same and rerunning over them still finds them in the database as duplicates.
+
+    param date: the (UTC) modification time of the file
+    returns mjd: Decimal MJD with 3 decimals
+    """
+    date = date + datetime.timedelta(hours=12)
+    # The Julian day number of the date, which is exact
+    julian_day_number = date.toordinal() + 1721425
+    jd = julian_day_number + (date.hour - 12) / 24 + date.minute / 1440 + date.second / 86400 + date.microsecond / 86400000000
+    mjd = Decimal(jd - 2400000.5).quantize(Decimal('0.001'),rounding=ROUND_DOWN)
+    return(mjd)
 
 
-def extrapolate_header(filepath):
+def extrapolate_header(filepath,modification_time=None):
     """
     Gleans as much information that would normally be in a header from a file that has been determined by the read_file function to not have a header 
     and populates it into that file's dictionary.
 
-    param filepath: The path to that particular file
+    param filepath: The path to that particular file (or path::member for a scan in a tar archive)
+    param modification_time: the unix time the file was last modified, read from filepath by default
 
     returns extrapolated_header: dict with extrapolated header information derived from file name
     """
     extrapolated_header = {}
     
     # Gleaning information from a file that does not contain a file header for information
-    filename = (filepath.split("/")[-1])# splitting filepath back down to just the filename    
+    filename = rfitrends.scan_sources.scan_filename(filepath)# splitting filepath back down to just the filename (without any compression suffix)
     extrapolated_header.update({"filename": filename})
     filename_temporary = re.split('[_.]',filename)#split the filename into the naming components (there's no header, so we have to glean info from the filename)
     filename = filename_temporary
 
     # Getting date from numbers in filename (this assumes MMDDYY, which is not always correct)
     # Sometimes people do DDMMYY, so any file without a header should be viewed with some suspicion. 
-    unix_timestamp = (os.path.getmtime(filepath))
+    unix_timestamp = os.path.getmtime(filepath) if modification_time is None else modification_time
     date = (datetime.datetime.utcfromtimestamp(unix_timestamp))
     extrapolated_header.update({"date": (date.strftime('%Y-%m-%d %H:%M:%S'))})# gleaning info from filename
     #Calculating MJD...
-    jd = julian.to_jd(date+ datetime.timedelta(hours=12),fmt='jd')
-    mjd = jd  - 2400000.5
-    mjd = Decimal(mjd).quantize(Decimal('0.001'),rounding=ROUND_DOWN)
-    extrapolated_header.update({"mjd": mjd})
+    extrapolated_header.update({"mjd": headerless_mjd(date)})
     # Getting Az and El from their location in the filename again, two numbers (this is pretty standard, so we can trust these values unlike dates)
     extrapolated_header.update({"azimuth (deg)":float(filename[7][2:])})
     extrapolated_header.update({"elevation (deg)":float(filename[8][2:])})
@@ -301,10 +601,7 @@ def extrapolate_header(filepath):
     extrapolated_header.update({"Channel": "NaN"})
     extrapolated_header.update({"backend": "NaN"})
     # View LST with suspicion
-    year_formatted = date.strftime('%Y')[2:]
-    utc_formatted = date.strftime('%m%d'+year_formatted+' %H%M')
-    LSThh,LSTmm,LSTss = rfitrends.LST_calculator.LST_calculator(utc_formatted)
-    LST = LSThh + LSTmm/60.0 + LSTss/3600.0
+    LST = float(rfitrends.LST_calculator.LST_from_datetime64(date))
     extrapolated_header.update({"lst (hrs)": LST})
 
     extrapolated_header.update({"polarization":filename[6]})
@@ -320,20 +617,13 @@ def extrapolate_header(filepath):
     return(extrapolated_header)
 
     
-def ReadFileLine_ColumnValues(has_header,line_value: list,column_names,filepath):
+def fix_column_names(column_names):
     """
-    Reads one line in a file that has been determined by the read_file function to be a row with data as opposed to header information
+    Streamlines a file's column names and checks the mandatory columns are among them
 
-    param has_header: boolean determining if the file has a header or not
-    param line_value: the parsed values containing the information for the particular line of this file 
     param column_names: the names of the columns contained in this file
-    param filepath: the path to this particular file
-    returns data_entry: This is a dictionary containing the column data
+    returns fixed_column_names: the standardized names, i.e. Frequency_MHz for "Frequency(MHz)"
     """
-    # Unfortunately, we first have to check if the column names match the length of the column values. For example, if the columns overlapped with themselves anywhere, such as the frequency values bleeding into intensity values to make 1471.456800.000 which should be 
-    # something like 1471.456 for frequency and 800.000 for intensity or something (these are made up numbers for example only). 
-    if len(column_names) != len(line_value):
-        raise InvalidColumnValues("The number of column names and number of column values for this file is not equal. This is an invalid file.")
     # Next we need to streamline the naming conventions for the columns:  
     # Sometimes it's labeled frequency, sometimes Frequency (MHz), sometimes Frequency (GHz)...etc  
     fixed_column_names = []
@@ -345,12 +635,29 @@ def ReadFileLine_ColumnValues(has_header,line_value: list,column_names,filepath)
             raise InvalidColumnValues("There is an unrecognized column name "+column_name+". Please check and reformat your file or add it to the list of column names in Column_fixes.py")
         fixed_column_names.append(fixed_column_name)
     # We also need to check that required columns in the configuration file exist somewhere in these columns, as they're needed for any science: 
-    config = configparser.ConfigParser()
-    config.read(resource_filename('rfitrends','rfitrends.conf'))
+    config = read_config()
     mandatory_columns = json.loads(config['Mandatory Fields']['mandatory_columns'])
     for mandatory_column in mandatory_columns:
         if mandatory_column not in fixed_column_names:
             raise InvalidColumnValues("One of the manditory columns listed in rfitrends.conf is not present in this file. This is required to continue processing this file.")
+    return(fixed_column_names)
+
+
+def ReadFileLine_ColumnValues(has_header,line_value: list,column_names,filepath):
+    """
+    Reads one line in a file that has been determined by the read_file function to be a row with data as opposed to header information
+
+    param has_header: boolean determining if the file has a header or not
+    param line_value: the parsed values containing the information for the particular line of this file 
+    param column_names: the names of the columns contained in this file
+    param filepath: the path to this particular file
+    returns data_entry: This is a dictionary containing the column data
+    """
+    # Unfortunately, we first have to check if the column names match the length of the column values. For example, if the columns overlapped with themselves anywhere, such as the frequency values bleeding into intensity values to make 1471.456800.000 which should be 
+    # something like 1471.456 for frequency and 800.000 for intensity or something (these are made up numbers for example only). 
+    if len(column_names) != len(line_value):
+        raise InvalidColumnValues("The number of column names and number of column values for this file is not equal. This is an invalid file.")
+    fixed_column_names = fix_column_names(column_names)
 
     # now that we know this is a correctly made line, we can get the data from the lines: 
     data_entry  = dict(zip(fixed_column_names,line_value))
@@ -406,9 +713,27 @@ def FrequencyVerification(frequency_value,header):
     return validated_frequency
 
 
+def verify_frequencies(frequencies,frontend):
+    """
+    Does what FrequencyVerification does for every frequency of a file at once
+
+    param frequencies: array of the frequencies in a file
+    param frontend: the verified frontend of the file
+    returns frequencies: the frequencies in MHz
+    returns in_bounds: array marking the frequencies inside the receiver's range (with the same buffer as FrequencyVerification)
+    """
+    # Makes the assumption that we're not observing below 245 MHz, as FrequencyVerification does
+    frequencies = np.where(frequencies < 245.0,frequencies*1000.0,frequencies)
+    freq_min = rfitrends.GBT_receiver_specs.GBT_receiver_ranges[frontend]['freq_min']
+    freq_max = rfitrends.GBT_receiver_specs.GBT_receiver_ranges[frontend]['freq_max']
+    freq_buffer = (freq_max - freq_min)* .1
+    in_bounds = (frequencies >= (freq_min - freq_buffer)) & (frequencies <= (freq_max + freq_buffer))
+    return(frequencies,in_bounds)
+
+
 ############ Functions that work to upload data to the database ####################
 
-def upload_files(filepaths,connection_manager,main_table,dirty_table):
+def upload_files(filepaths,connection_manager,main_table,dirty_table,occurrence_builder=None,layout="wide",spool=None,parse_workers=1,regrid_writer=None,quicklooks=None):
     """
     Uploads all the processed data into the appropriate tables for a given database 
 
@@ -417,22 +742,36 @@ def upload_files(filepaths,connection_manager,main_table,dirty_table):
     param unique_filenames: a list containing all the files that have been processed into the database
     param main_table : the table to put in your clean, primary dataset
     param dirty_table : if a problem is encountered, the data will be dumped into a less-organizable "dirty table"
+    param occurrence_builder : optionally, an occurrence_index_builder (see occurrence_index.py) to add each file's channels above the baseline to
+    param layout : how the main table is stored, one of schema_manager.layouts. "normalized" and "packed" store each file as one scan (see scan_store.py)
+    param spool : optionally, a scan_spool (see scan_spool.py), so files parsed by an earlier run aren't parsed again
+    param parse_workers : the number of processes reading, decompressing and parsing files ahead of the upload
+    param regrid_writer : optionally, a dynamic_spectrum_writer (see regrid.py) to append each file, regridded, to the dynamic spectrum of its receiver
+    param quicklooks : optionally, a quicklook_pool (see quicklook.py) to render an image and summary of each new file while it is uploaded
     """
+    import mysql.connector
+    from tqdm import tqdm
 
-    # Going through each file one by one: 
-    for filenum,filepath in enumerate(filepaths):
+    # Going through each file one by one, as the parse workers finish them: 
+    for filenum,(filepath,scan,parse_error) in enumerate(parse_files(filepaths,parse_workers,spool)):
         print("Extracting file "+str(filenum+1)+" of "+str(len(filepaths))+", filename: "+str(filepath))
-        filename = filepath.split("/")[-1] # Getting filename from last piece in file path
+        filename = rfitrends.scan_sources.scan_filename(filepath) # Getting filename from last piece in file path
         # if the filename has already been processed, skip it. This assumes the file has been processed if ANY part of the file has been processed. 
         # in other words, if you're halfway through processing a file with this script, kill the process, and restart, it will assume 
         # That the half-finished file has completely been processed and skip the file. 
 
+        if parse_error is not None and not isinstance(parse_error,InvalidColumnValues):
+            print("File could not be read ("+type(parse_error).__name__+": "+str(parse_error)+"). Dropping file.")
+            continue
         # Try reading the file's data and header
         try:
-            formatted_RFI_file = read_file(filepath,main_table,dirty_table,connection_manager)
+            if parse_error is not None:
+                raise parse_error
+            check_file(scan,main_table,dirty_table,connection_manager,layout)
         # Handling any problems along the way:
         except mysql.connector.Error as error:
             print("{}".format(error))
+            continue
         except InvalidColumnValues:
             print("Column values are invalid. Dropping file.")
             continue
@@ -440,23 +779,38 @@ def upload_files(filepaths,connection_manager,main_table,dirty_table):
             print("File already exists in database, moving on to next file.")
             continue
         print('File extracted. Uploading to database.')
-        print(str(len(formatted_RFI_file.get('Data')))+' lines to upload (labeled as \'it\' or \'iterations\' below)')
+        if quicklooks is not None:
+            # Handed to the quicklook workers before the upload starts, so they render while the rows are written
+            quicklooks.submit(filepath,scan)
+        if layout != "wide":
+            # The whole file goes in as one scan, so there is no line by line upload
+            upload_scan(scan,connection_manager,main_table,packed=layout == "packed")
+            if occurrence_builder is not None:
+                add_occurrences(occurrence_builder,scan)
+            if regrid_writer is not None:
+                regrid_writer.add(scan)
+            rfitrends.column_cache.bump_generation(connection_manager,[main_table,dirty_table])
+            print(str(filename)+" uploaded.")
+            continue
+        print(str(len(scan))+' lines to upload (labeled as \'it\' or \'iterations\' below)')
         print('iterations [time elapsed, iterations per second]')
+        header = scan.header
+        # The header columns are the same for every line of the file
+        header_values = header.column_values()
+        mjd = str(header.mjd)
+        # We have some receiver names that are too generic or specific for our receiver tables, so we're making that consistent
+        frontend_for_rcvr_table = rfitrends.GBT_receiver_specs.PrepareFrontendInput(header.frontend)
         # Try uploading that file's data to the appropriate main table
         # For each line of data, upload line to the main database
         dirty_filename_entered = False
-        for index,frequency_key in tqdm(enumerate(formatted_RFI_file.get("Data"))):#for each value in that multi-valued set
-            # The actual data entry
-            data_entry = formatted_RFI_file.get('Data')[frequency_key]
-            #print("Uploading line "+str(index)+" of "+str(len(formatted_RFI_file.get("Data")))+" for "+str(filename)+" ("+str(filenum+1)+" of "+str(len(filepaths))+")")
-            # We do this again in case this is a dirty table where frequency verification has failed
-            frequency_key = Decimal(frequency_key).quantize(Decimal('0.0001'),rounding=ROUND_DOWN)
-            # Fill in missing columns if necessary (in other words, if we're missing a window or channel column, fill it with "NaN" values)
-            data_entry = manage_missing_cols(data_entry).getdata_entry()
+        for index in tqdm(range(len(scan))):
+            frequency_key = scan.frequency_string(index)
+            table = dirty_table if scan.dirty[index] else main_table
+            intensity = float(scan.intensity[index])
             # Try executing query
             try:
-                connection_manager.add_main_values(data_entry,formatted_RFI_file,str(frequency_key))
-                if data_entry['Database'] == dirty_table and dirty_filename_entered == False:
+                connection_manager.add_main_values(table,header_values,frequency_key,intensity,index_string(scan.window[index]),index_string(scan.channel[index]),int(scan.counts[index]))
+                if scan.dirty[index] and dirty_filename_entered == False:
                     insert_dirty_filename = 'INSERT INTO Bad_files (filename) VALUES (\''+filename+'\');'
                     connection_manager.execute_command(insert_dirty_filename)
                     dirty_filename_entered = True
@@ -464,30 +818,28 @@ def upload_files(filepaths,connection_manager,main_table,dirty_table):
             # If we find a duplicate entry, we will up the counts and average the intensities
             except mysql.connector.errors.IntegrityError:
                 # Get intensity,filename, and counts from the line in the table that the line you're currently trying to upload conflicts with
-                responses = connection_manager.grab_values_for_avg_intensity(str(data_entry["Database"]),str(frequency_key),str(formatted_RFI_file.get("mjd")))
+                responses = connection_manager.grab_values_for_avg_intensity(table,frequency_key,mjd)
                 # For each conflicting value (there should only be one, but just in case we iterate through)
                 for response in responses:
                     # Calculating average intensity
                     current_counts = response[2]
                     old_intensity = float(response[0])
-                    new_intensity = float(data_entry["Intensity_Jy"])
+                    new_intensity = intensity
                     intensity_avg = (new_intensity+(old_intensity*float(current_counts)))/(float(current_counts)+1.0)
                     old_filename = response[1]
                     # If this file nas not already been labeled as a duplicate, then we need to insert that file's entry into the duplicate table
                     if old_filename != "Duplicate":
-                        connection_manager.insert_duplicate_data(str(frequency_key),str(old_intensity),str(old_filename))
+                        connection_manager.insert_duplicate_data(frequency_key,str(old_intensity),str(old_filename))
                     # We also need to update the intensity with the average of all the duplicate values, reset counts, set window and channel to nan, and 
                     # Set the filename to duplicate so everyone knows it's in the duplicate database
-                    connection_manager.update_avg_intensity(str(data_entry["Database"]),str(int(current_counts)+ 1),str(intensity_avg),str(frequency_key),str(formatted_RFI_file.get("mjd")))
+                    connection_manager.update_avg_intensity(table,str(int(current_counts)+ 1),str(intensity_avg),frequency_key,mjd)
                     # Finally, we need to put the current line being processed into the duplicate data catalog
-                    connection_manager.insert_duplicate_data(str(frequency_key),str(new_intensity),str(formatted_RFI_file.get("filename")))   
+                    connection_manager.insert_duplicate_data(frequency_key,str(new_intensity),str(header.filename))   
                 duplicate_entry = True
-            # We have some receiver names that are too generic or specific for our receiver tables, so we're making that consistent
-            frontend_for_rcvr_table = rfitrends.GBT_receiver_specs.PrepareFrontendInput(formatted_RFI_file.get("frontend"))
             # Putting composite key values into the receiver table, as long as it's not a duplicate line, and has
             # been deemed a clean line
-            if frontend_for_rcvr_table != 'Unknown' and not duplicate_entry and data_entry["Database"] != dirty_table:
-                update_caching_tables(frequency_key,data_entry,frontend_for_rcvr_table,connection_manager,formatted_RFI_file)
+            if frontend_for_rcvr_table != 'Unknown' and not duplicate_entry and not scan.dirty[index]:
+                update_caching_tables(frequency_key,frontend_for_rcvr_table,connection_manager,header)
         # If there's any other error we encounter not yet handled, print out the error, some other info, and gracefully exit. 
         """
         except mysql.connector.errors.IntegrityError as Error:
@@ -500,33 +852,81 @@ def upload_files(filepaths,connection_manager,main_table,dirty_table):
             sys.exit()
         """
 
+        if occurrence_builder is not None:
+            add_occurrences(occurrence_builder,scan)
+        if regrid_writer is not None:
+            regrid_writer.add(scan)
+        # The cached queries of the main and dirty tables are stale now, even when this file is older than everything in them
+        rfitrends.column_cache.bump_generation(connection_manager,[main_table,dirty_table])
         print(str(filename)+" uploaded.")
+    if occurrence_builder is not None:
+        print("Saving the occurrence index.")
+        occurrence_builder.save()
+    if regrid_writer is not None:
+        print("Appending to the dynamic spectra.")
+        regrid_writer.flush()
+    if quicklooks is not None:
+        print("Finishing the quicklooks.")
+        quicklooks.close()
+
+def upload_scan(scan,connection_manager,main_table,packed=False):
+    """
+    Uploads a file to the normalized tables of the main table as one scan, then fills the receiver caching tables with its clean channels
+
+    param scan: the parsed_scan of the file
+    param connection_manager: a class handling the connection to the SQL database
+    param main_table: the main table whose normalized tables (see schema_manager.py) the scan goes to
+    param packed: whether the channels are stored as one binary spectrum instead of as rows
+    """
+    import mysql.connector
+    scan_id = rfitrends.scan_store.insert_scan(connection_manager,main_table,scan,packed)
+    print("Stored as scan "+str(scan_id)+" with "+str(len(scan))+" channels.")
+    header = scan.header
+    if scan.dirty.any():
+        connection_manager.execute_command('INSERT INTO Bad_files (filename) VALUES (\''+str(header.filename)+'\');')
+    frontend_for_rcvr_table = rfitrends.GBT_receiver_specs.PrepareFrontendInput(header.frontend)
+    if frontend_for_rcvr_table == 'Unknown':
+        return
+    for index in np.flatnonzero(~scan.dirty):
+        # Another file with the same mjd may already have put this frequency in the receiver table. Unlike the wide layout, 
+        # Both files are kept as separate scans rather than averaged together
+        try:
+            update_caching_tables(scan.frequency_string(index),frontend_for_rcvr_table,connection_manager,header)
+        except mysql.connector.errors.IntegrityError:
+            continue
+
+def add_occurrences(occurrence_builder,scan):
+    # Only the clean lines are indexed, as in the main table
+    clean = ~scan.dirty
+    occurrence_builder.add(scan.frequency[clean],scan.intensity[clean],float(scan.header.mjd),scan.header.filename)
 
-def update_caching_tables(frequency_key,data_entry,frontend_for_rcvr_table,connection_manager,formatted_RFI_file): 
+def update_caching_tables(frequency_key,frontend_for_rcvr_table,connection_manager,header): 
+    mjd = str(header.mjd)
+    projid = str(header.projid)
     # Add frequency and mjd to receiver table
-    connection_manager.add_receiver_keys(frontend_for_rcvr_table,str(frequency_key),str(formatted_RFI_file.get("mjd")))
+    connection_manager.add_receiver_keys(frontend_for_rcvr_table,str(frequency_key),mjd)
     # Get the latest projects table data
     rows = connection_manager.get_latest_project_data(frontend_for_rcvr_table)
     # Parse latest projects table data
     for row in rows: 
         latest_projid = row[0]
         latest_mjd  = row[1]
-    if latest_mjd < Decimal(formatted_RFI_file.get("mjd")) and (formatted_RFI_file.get("projid") != 'NaN'):
+    if latest_mjd < header.mjd and (projid != 'NaN'):
         # Now we want to update the project id for the latest-project table:
-        connection_manager.update_latest_projid(str(formatted_RFI_file.get("projid")),frontend_for_rcvr_table)
+        connection_manager.update_latest_projid(projid,frontend_for_rcvr_table)
         # and update mjd:
-        connection_manager.update_latest_date(str(formatted_RFI_file.get("mjd")),frontend_for_rcvr_table)
+        connection_manager.update_latest_date(mjd,frontend_for_rcvr_table)
         # Before we replace the previous latest project with the current one, we want to drop the table containing the previous latest projects' data:
         if latest_projid != "None":
             connection_manager.drop_table(latest_projid)
         # We want to make a new table containing the previous latest project's data:
-        connection_manager.projid_table_maker(str(formatted_RFI_file.get("projid")))
+        connection_manager.projid_table_maker(projid)
         # The new latest project is the most recent project we just updated
-        latest_projid = str(formatted_RFI_file.get("projid"))
+        latest_projid = projid
            
-    if formatted_RFI_file.get("projid") == latest_projid and (formatted_RFI_file.get("projid") != 'NaN'):
+    if projid == latest_projid and (projid != 'NaN'):
         # Populate that table with this info
-        connection_manager.projid_populate_table(str(formatted_RFI_file.get("projid")),str(frequency_key),str(formatted_RFI_file.get("mjd")))
+        connection_manager.projid_populate_table(projid,str(frequency_key),mjd)
 
 
 ########### MAIN #############
@@ -544,8 +944,25 @@ def main():
     parser.add_argument("path",help="The path to the .txt files that need to be uploaded to the database")
     parser.add_argument("IP_address",nargs='?',default= '192.33.116.22',help="The IP address to find the SQL database to which you would like to add this table. Default is the GBO development server address. This would only work for employees.")
     parser.add_argument("database",nargs='?',default='jskipper',help="The name of the SQL database to which you would like to add this table. Default is jskipper, which would only work for employees.")
+    parser.add_argument("--create_schema",action='store_true',help="Create any missing tables, columns and indexes (see schema_manager.py) before uploading")
+    parser.add_argument("--occurrence_index",default=None,help="A directory holding an occurrence index (see occurrence_index.py) to add the uploaded files to. Needs --avgs_table")
+    parser.add_argument("--avgs_table",default=None,help="The avgs table the occurrence index and --compare_latest baselines are read from")
+    parser.add_argument("--regrid_cube",default=None,help="A directory of dynamic spectra (see regrid.py) to append every uploaded file to, regridded onto its receiver's frequency grid")
+    parser.add_argument("--quicklook",default=None,help="A directory to render a small image and JSON summary of every uploaded file to, with a catalog (see quicklook.py). They are made in worker processes while the files upload")
+    parser.add_argument("--quicklook_workers",type=int,default=2,help="The number of processes making quicklooks. Default is 2")
+    parser.add_argument("--compare_latest",action='store_true',help="After uploading, compare the latest project of every receiver against the avgs baseline and write the new and elevated RFI to the latest_rfi_flags table (see latest_comparison.py). Needs --avgs_table")
+    parser.add_argument("--spool",action='store_true',help="Keep every parsed file in the local spool (see scan_spool.py), and use the files already in it, so a rerun doesn't parse the files again")
+    parser.add_argument("--parse_workers",type=int,default=1,help="The number of processes reading, decompressing and parsing files ahead of the upload. Default is 1, which parses each file as it is needed")
+    parser.add_argument("--layout",choices=rfitrends.schema_manager.layouts,default="wide",help="How the main table is stored: wide (the header on every row, the default), normalized (a scans table and a spectra table, see schema_manager.py) or packed (a scans table and one binary spectrum per scan, read only with scan_store.read_scan, so it must not be a table the other scripts read)")
     # Parse those arguments
     args = parser.parse_args()
+    # Mistakes in the arguments are reported before asking for a password or walking the files
+    if args.compare_latest and args.avgs_table is None:
+        parser.error("--compare_latest needs --avgs_table for the baseline")
+    if args.occurrence_index is not None and args.avgs_table is None:
+        parser.error("--occurrence_index needs --avgs_table for the baseline")
+    if args.layout == "packed" and args.compare_latest:
+        parser.error("--compare_latest reads the main table, which doesn't show scans in the packed layout")
     main_table = args.main_table
     dirty_table = args.dirty_table
     IP_address = args.IP_address
@@ -556,13 +973,39 @@ def main():
     config = configparser.ConfigParser()
     # Create connection to the database
     connection_manager = rfitrends.connection_manager.connection_manager(IP_address,database)
+    if args.create_schema:
+        for change in rfitrends.schema_manager.ensure_schema(connection_manager,main_table,dirty_table,layout=args.layout):
+            print(change)
+    elif args.layout == "packed":
+        rfitrends.schema_manager.check_packed_names(connection_manager,main_table,dirty_table)
     # Collect filenames/paths from the directory specified and product a list of those names to run
     filepaths_to_process = gather_filepaths_to_process(path)
     # Going through each file one by one
     print("starting to upload files one by one...")
+    occurrence_builder = None
+    if args.occurrence_index is not None:
+        # Imported under its own name, so rfitrends stays the package for the rest of main
+        from rfitrends import occurrence_index
+        occurrence_builder = occurrence_index.open_builder(connection_manager,args.avgs_table,args.occurrence_index)
     # Upload files to database
-    upload_files(filepaths_to_process,connection_manager,main_table,dirty_table)
+    spool = None
+    if args.spool:
+        from rfitrends import scan_spool
+        spool = scan_spool.scan_spool()
+    regrid_writer = None
+    if args.regrid_cube is not None:
+        from rfitrends import regrid
+        regrid_writer = regrid.dynamic_spectrum_writer(args.regrid_cube)
+    quicklooks = None
+    if args.quicklook is not None:
+        from rfitrends import quicklook
+        quicklooks = quicklook.quicklook_pool(args.quicklook,args.quicklook_workers)
+    upload_files(filepaths_to_process,connection_manager,main_table,dirty_table,occurrence_builder,args.layout,spool,args.parse_workers,regrid_writer,quicklooks)
     print("All files uploaded.")
+    if args.compare_latest:
+        from rfitrends import latest_comparison
+        print("Comparing the latest projects against "+str(args.avgs_table)+"...")
+        latest_comparison.compare_latest_projects(connection_manager,main_table,args.avgs_table)
 
 if __name__ == "__main__":
     main()
@@ -5,192 +5,107 @@
 Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
 """
 
-import pymysql
 import numpy as np
 import matplotlib.pyplot as plt
-import rfitrends.fxns_output_process
-import sys
+import argparse
+import rfitrends.connection_manager
+import rfitrends.data_stream
+import rfitrends.column_cache
+from rfitrends.plot_decimation import plot_decimated
 
-def load_data(avgs_table):
+def load_data(connection_manager,avgs_table,use_cache=True):
     """
     Loads data from the RFI_Avgs_expanded table in the SQL database for RFI
-    returns: frequency: list of frequencies
-    returns: mean_intensity: list of mean intensities
-    returns: max_intensity: list of max intensities
-    returns: min_intensity: list of min intensities
-    returns: median intensity: list of median intensities
-    returns: low_percentile_intensity: list of 2nd percentile intensities
-    returns: high_percentile_intensity: list of 97th percentile intensities
+    param: connection_manager: An object that connects to the database for the user
+    param: avgs_table: the table containing the statistics made by RFI_avgs_loader.py
+    param: use_cache: whether to use the local column cache, which is reused as long as the table hasn't changed
+    returns: frequency: array of frequencies
+    returns: mean_intensity: array of mean intensities
+    returns: max_intensity: array of max intensities
+    returns: min_intensity: array of min intensities
+    returns: median intensity: array of median intensities
+    returns: low_percentile_intensity: array of 2nd percentile intensities
+    returns: high_percentile_intensity: array of 97th percentile intensities
     """
-    cursor,_ = fxns_output_process.connect_to_database()
-
-    print("fetching data...")
-    query = (" SELECT * FROM "+str(avgs_table)+"; ")
-    cursor.execute(query)
-
-    frequency = []
-    mean_intensity = []
-    max_intensity = []
-    min_intensity = []
-    median_intensity = []
-    low_percentile_intensity = []
-    high_percentile_intensity = []
-
-    print("processing data...")
-    result = cursor.fetchall() #getting each row
-    
-
-    for row in result:
-        
-        frequency.append(float(row[0]))
-        mean_intensity.append(row[1])
-        max_intensity.append(row[2])
-        min_intensity.append(row[3])
-        median_intensity.append(row[4])
-        low_percentile_intensity.append(row[5])
-        high_percentile_intensity.append(row[6])
-    
-    return frequency,mean_intensity,max_intensity,min_intensity,median_intensity,low_percentile_intensity,high_percentile_intensity
+    def fetch_data():
+        print("fetching data...")
+        # The rows are streamed from the server in chunks and joined as arrays, never as lists of python floats
+        chunks = rfitrends.data_stream.stream_avgs_table(connection_manager,avgs_table)
+        return(rfitrends.data_stream.concatenate_chunks(chunks,rfitrends.data_stream.avgs_columns))
+
+    if use_cache:
+        data = rfitrends.column_cache.load_cached_columns(connection_manager,avgs_table,rfitrends.data_stream.avgs_columns,fetch_data)
+    else:
+        data = fetch_data()
+
+    return tuple(data[column] for column in rfitrends.data_stream.avgs_columns)
 	
 	
 
 
 
-def log_y_axis_graph(frequency,mean_intensity,max_intensity,min_intensity,median_intensity,low_percentile_intensity,high_percentile_intensity):
+def plot_statistics(frequency,mean_intensity,max_intensity,min_intensity,median_intensity,low_percentile_intensity,high_percentile_intensity,ax=None):
     """
-    Graphs intensity vs frequency with the y-axis in log-scale
-    param: frequency: list of frequencies
-    param: mean_intensity: list of mean intensities
-    param: max_intensity: list of max intensities
-    param: min_intensity: list of min intensities
-    param: median intensity: list of median intensities
-    param: low_percentile_intensity: list of 2nd percentile intensities
-    param: high_percentile_intensity: list of 97th percentile intensities
+    Draws every statistic against frequency. Each curve is decimated to about the width of the plot in pixels (keeping the min and max
+    of each pixel so that narrow RFI spikes still show), and is decimated again from the full data whenever the x-limits change.
+    param: frequency: array of frequencies
+    param: mean_intensity: array of mean intensities
+    param: max_intensity: array of max intensities
+    param: min_intensity: array of min intensities
+    param: median intensity: array of median intensities
+    param: low_percentile_intensity: array of 2nd percentile intensities
+    param: high_percentile_intensity: array of 97th percentile intensities
+    param: ax: the matplotlib Axes to draw on, the current Axes by default
+    returns: ax: the Axes drawn on
     """
-    print("Making graph with log y-axis...")
-    plt.plot(frequency,max_intensity, color="red",label='max or min')
-    plt.plot(frequency,min_intensity, color="red")
+    if ax is None:
+        ax = plt.gca()
+    plot_decimated(ax,frequency,max_intensity, color="red",label='max or min')
+    plot_decimated(ax,frequency,min_intensity, color="red")
     # These next two lines will plot the 2.75 and 97.5 percentiles, i.e. showing us the range that encompasses 95% of the data
-    plt.plot(frequency,low_percentile_intensity, color="magenta",label='high or low percentiles (2.75 or 97.5)')
-    plt.plot(frequency,high_percentile_intensity, color="magenta")
-    plt.plot(frequency,mean_intensity, color="blue",label='mean')
+    plot_decimated(ax,frequency,low_percentile_intensity, color="magenta",label='high or low percentiles (2.75 or 97.5)')
+    plot_decimated(ax,frequency,high_percentile_intensity, color="magenta")
+    plot_decimated(ax,frequency,mean_intensity, color="blue",label='mean')
     # since these are Gaussian random variables the mean and median will be nearly equal
-    plt.plot(frequency,median_intensity, color="green",label='median')
-    plt.legend(loc='upper right')
-    plt.xlabel("Frequency (MHz)")
-    plt.ylabel("log(Intensity) (Jy)")
-    plt.yscale('log')
-    plt.title("Frequency vs. Intensity (Log Version)")
-    plt.show()
-    plt.clf()
+    plot_decimated(ax,frequency,median_intensity, color="green",label='median')
+    ax.legend(loc='upper right')
+    ax.set_xlabel("Frequency (MHz)")
+    return(ax)
 
-def lin_y_axis_graph(frequency,mean_intensity,max_intensity,min_intensity,median_intensity,low_percentile_intensity,high_percentile_intensity):
-    """
-    Graphs intensity vs frequency with the y-axis in linear scale
-    param: frequency: list of frequencies
-    param: mean_intensity: list of mean intensities
-    param: max_intensity: list of max intensities
-    param: min_intensity: list of min intensities
-    param: median intensity: list of median intensities
-    param: low_percentile_intensity: list of 2nd percentile intensities
-    param: high_percentile_intensity: list of 97th percentile intensities
-    """
-    print("Making graph with linear y-axis...")
-    plt.plot(frequency,max_intensity, color="red",label='max or min')
-    plt.plot(frequency,min_intensity, color="red")
-    # These next two lines will plot the 2.75 and 97.5 percentiles, i.e. showing us the range that encompasses 95% of the data
-    plt.plot(frequency,low_percentile_intensity, color="magenta",label='high or low percentiles (2.75 or 97.5)')
-    plt.plot(frequency,high_percentile_intensity, color="magenta")
-    plt.plot(frequency,mean_intensity, color="blue",label='mean')
-    # since these are Gaussian random variables the mean and median will be nearly equal
-    plt.plot(frequency,median_intensity, color="green",label='median')
-    plt.legend(loc='upper right')
 
 def log_y_axis_graph(frequency,mean_intensity,max_intensity,min_intensity,median_intensity,low_percentile_intensity,high_percentile_intensity):
     """
     Graphs intensity vs frequency with the y-axis in log-scale
-    param: frequency: list of frequencies
-    param: mean_intensity: list of mean intensities
-    param: max_intensity: list of max intensities
-    param: min_intensity: list of min intensities
-    param: median intensity: list of median intensities
-    param: low_percentile_intensity: list of 2nd percentile intensities
-    param: high_percentile_intensity: list of 97th percentile intensities
+    param: frequency: array of frequencies
+    param: mean_intensity: array of mean intensities
+    param: max_intensity: array of max intensities
+    param: min_intensity: array of min intensities
+    param: median intensity: array of median intensities
+    param: low_percentile_intensity: array of 2nd percentile intensities
+    param: high_percentile_intensity: array of 97th percentile intensities
     """
     print("Making graph with log y-axis...")
-    plt.plot(frequency,max_intensity, color="red",label='max or min')
-    plt.plot(frequency,min_intensity, color="red")
-    # These next two lines will plot the 2.75 and 97.5 percentiles, i.e. showing us the range that encompasses 95% of the data
-    plt.plot(frequency,low_percentile_intensity, color="magenta",label='high or low percentiles (2.75 or 97.5)')
-    plt.plot(frequency,high_percentile_intensity, color="magenta")
-    plt.plot(frequency,mean_intensity, color="blue",label='mean')
-    # since these are Gaussian random variables the mean and median will be nearly equal
-    plt.plot(frequency,median_intensity, color="green",label='median')
-    plt.legend(loc='upper right')
-    plt.xlabel("Frequency (MHz)")
+    plot_statistics(frequency,mean_intensity,max_intensity,min_intensity,median_intensity,low_percentile_intensity,high_percentile_intensity)
     plt.ylabel("log(Intensity) (Jy)")
     plt.yscale('log')
     plt.title("Frequency vs. Intensity (Log Version)")
     plt.show()
     plt.clf()
 
+
 def lin_y_axis_graph(frequency,mean_intensity,max_intensity,min_intensity,median_intensity,low_percentile_intensity,high_percentile_intensity):
     """
     Graphs intensity vs frequency with the y-axis in linear scale
-    param: frequency: list of frequencies
-    param: mean_intensity: list of mean intensities
-    param: max_intensity: list of max intensities
-    param: min_intensity: list of min intensities
-    param: median intensity: list of median intensities
-    param: low_percentile_intensity: list of 2nd percentile intensities
-    param: high_percentile_intensity: list of 97th percentile intensities
+    param: frequency: array of frequencies
+    param: mean_intensity: array of mean intensities
+    param: max_intensity: array of max intensities
+    param: min_intensity: array of min intensities
+    param: median intensity: array of median intensities
+    param: low_percentile_intensity: array of 2nd percentile intensities
+    param: high_percentile_intensity: array of 97th percentile intensities
     """
     print("Making graph with linear y-axis...")
-    plt.plot(frequency,max_intensity, color="red",label='max or min')
-    plt.plot(frequency,min_intensity, color="red")
-    # These next two lines will plot the 2.75 and 97.5 percentiles, i.e. showing us the range that encompasses 95% of the data
-    plt.plot(frequency,low_percentile_intensity, color="magenta",label='high or low percentiles (2.75 or 97.5)')
-    plt.plot(frequency,high_percentile_intensity, color="magenta")
-    plt.plot(frequency,mean_intensity, color="blue",label='mean')
-    # since these are Gaussian random variables the mean and median will be nearly equal
-    plt.plot(frequency,median_intensity, color="green",label='median')
-    plt.legend(loc='upper right')
-    plt.xlabel("Frequency (MHz)")
-    plt.ylabel("Intensity (Jy)")
-    plt.title("Frequency vs. Intensity (Linear Version)")
-    plt.show()
-    plt.clf()
-
-
-def log_y_axis_lim_graph(frequency,mean_intensity,max_intensity,min_intensity,median_intensity,low_percentile_intensity,high_percentile_intensity):
-    """
-    Graphs intensity vs frequency with the y-axis in log-scale, and the frequency range only from 600-700 MHz
-    param: frequency: list of frequencies
-    param: mean_intensity: list of mean intensities
-    param: max_intensity: list of max intensities
-    param: min_intensity: list of min intensities
-    param: median intensity: list of median intensities
-    param: low_percentile_intensity: list of 2nd percentile intensities
-    param: high_percentile_intensity: list of 97th percentile intensities
-    """
-    print("Making graph with log y-axis 600-700 MHz...")
-    plt.plot(frequency,max_intensity, color="red",label='max or min')
-    plt.plot(frequency,min_intensity, color="red")
-    # These next two lines will plot the 2.75 and 97.5 percentiles, i.e. showing us the range that encompasses 95% of the data
-    plt.plot(frequency,low_percentile_intensity, color="magenta",label='high or low percentiles (2.75 or 97.5)')
-    plt.plot(frequency,high_percentile_intensity, color="magenta")
-    plt.plot(frequency,mean_intensity, color="blue",label='mean')
-    # since these are Gaussian random variables the mean and median will be nearly equal
-    plt.plot(frequency,median_intensity, color="green",label='median')
-    plt.legend(loc='upper right')
-    plt.xlabel("Frequency (MHz)")
-    plt.ylabel("log(Intensity) (Jy)")
-    plt.title("Frequency vs Intensity (Log, 600-700 MHz only)")
-    plt.yscale('log')
-    plt.xlim(600.00,700.0)
-    plt.show()
-    plt.clf()
-    plt.xlabel("Frequency (MHz)")
+    plot_statistics(frequency,mean_intensity,max_intensity,min_intensity,median_intensity,low_percentile_intensity,high_percentile_intensity)
     plt.ylabel("Intensity (Jy)")
     plt.title("Frequency vs. Intensity (Linear Version)")
     plt.show()
@@ -200,39 +115,47 @@ def log_y_axis_lim_graph(frequency,mean_intensity,max_intensity,min_intensity,me
 def log_y_axis_lim_graph(frequency,mean_intensity,max_intensity,min_intensity,median_intensity,low_percentile_intensity,high_percentile_intensity):
     """
     Graphs intensity vs frequency with the y-axis in log-scale, and the frequency range only from 600-700 MHz
-    param: frequency: list of frequencies
-    param: mean_intensity: list of mean intensities
-    param: max_intensity: list of max intensities
-    param: min_intensity: list of min intensities
-    param: median intensity: list of median intensities
-    param: low_percentile_intensity: list of 2nd percentile intensities
-    param: high_percentile_intensity: list of 97th percentile intensities
+    param: frequency: array of frequencies
+    param: mean_intensity: array of mean intensities
+    param: max_intensity: array of max intensities
+    param: min_intensity: array of min intensities
+    param: median intensity: array of median intensities
+    param: low_percentile_intensity: array of 2nd percentile intensities
+    param: high_percentile_intensity: array of 97th percentile intensities
     """
     print("Making graph with log y-axis 600-700 MHz...")
-    plt.plot(frequency,max_intensity, color="red",label='max or min')
-    plt.plot(frequency,min_intensity, color="red")
-    # These next two lines will plot the 2.75 and 97.5 percentiles, i.e. showing us the range that encompasses 95% of the data
-    plt.plot(frequency,low_percentile_intensity, color="magenta",label='high or low percentiles (2.75 or 97.5)')
-    plt.plot(frequency,high_percentile_intensity, color="magenta")
-    plt.plot(frequency,mean_intensity, color="blue",label='mean')
-    # since these are Gaussian random variables the mean and median will be nearly equal
-    plt.plot(frequency,median_intensity, color="green",label='median')
-    plt.legend(loc='upper right')
-    plt.xlabel("Frequency (MHz)")
+    plot_statistics(frequency,mean_intensity,max_intensity,min_intensity,median_intensity,low_percentile_intensity,high_percentile_intensity)
     plt.ylabel("log(Intensity) (Jy)")
     plt.title("Frequency vs Intensity (Log, 600-700 MHz only)")
     plt.yscale('log')
+    # Narrowing the x-limits re-decimates every curve from the full data, so the 600-700 MHz view keeps its full detail
     plt.xlim(600.00,700.0)
     plt.show()
     plt.clf()
 
 
-
-if __name__ == "__main__":
-    avgs_table = sys.argv[1] # is usually RFI_avgs_expanded
+def main():
+    parser = argparse.ArgumentParser(description="Makes graphs of the RFI statistics made by RFI_avgs_loader.py")
+    parser.add_argument("avgs_table",help="The table containing the statistics from which you want to make plots (usually RFI_avgs_expanded)")
+    parser.add_argument("IP_address",nargs='?',default= '192.33.116.22',help="The IP address to find the SQL database. Default is the GBO development server address. This would only work for employees.")
+    parser.add_argument("database",nargs='?',default='jskipper',help="The name of the SQL database. Default is jskipper, which would only work for employees.")
+    parser.add_argument("--no_cache",action='store_true',help="Always read the table from the database instead of the local column cache")
+    parser.add_argument("--output_directory",default=None,help="Instead of showing the graphs, render them (and one per receiver band) to image files in this directory, without needing a display")
+    args = parser.parse_args()
+    connection_manager = rfitrends.connection_manager.connection_manager(args.IP_address,args.database)
     print("starting script...")
-    frequency,mean_intensity,max_intensity,min_intensity,median_intensity,low_percentile_intensity,high_percentile_intensity = load_data(avgs_table)
+    frequency,mean_intensity,max_intensity,min_intensity,median_intensity,low_percentile_intensity,high_percentile_intensity = load_data(connection_manager,args.avgs_table,use_cache=not args.no_cache)
+    if args.output_directory is not None:
+        # Imported here because it switches matplotlib to the Agg backend, and under its own name so rfitrends stays the package for the rest of main
+        from rfitrends import batch_render
+        print("rendering graphs to "+args.output_directory+"...")
+        batch_render.render_batch((frequency,mean_intensity,max_intensity,min_intensity,median_intensity,low_percentile_intensity,high_percentile_intensity),args.output_directory)
+        return
     print("starting graphs...")
     log_y_axis_graph(frequency,mean_intensity,max_intensity,min_intensity,median_intensity,low_percentile_intensity,high_percentile_intensity)
     lin_y_axis_graph(frequency,mean_intensity,max_intensity,min_intensity,median_intensity,low_percentile_intensity,high_percentile_intensity)
     log_y_axis_lim_graph(frequency,mean_intensity,max_intensity,min_intensity,median_intensity,low_percentile_intensity,high_percentile_intensity)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+.. module:: batch_render.py
+    :synopsis: Renders many RFI statistics graphs to image files at once, headless, in a process pool sharing one copy of the data
+.. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
+Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
+"""
+
+import matplotlib
+# Never needs a display, so this runs on headless nodes (i.e. the nightly report job)
+matplotlib.use("Agg")
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import numpy as np
+import os
+import tempfile
+import argparse
+import concurrent.futures
+import rfitrends.connection_manager
+import rfitrends.data_stream
+import rfitrends.GBT_receiver_specs
+from rfitrends.RFI_process_graph_avgs import load_data,plot_statistics
+
+# The image formats render_batch can write
+image_formats = ["png","svg"]
+
+# The columns of the shared data, filled in each worker process by open_shared_data
+shared_data = {}
+
+
+def default_figure_specs(windows=((600.0,700.0),),receivers=True):
+    """
+    Lists the graphs RFI_process_graph_avgs.py makes, plus any extra frequency windows and one graph per receiver band
+
+    param windows: (freq_min, freq_max) pairs in MHz to graph with a log y-axis
+    param receivers: whether to add a log graph for each receiver in GBT_receiver_ranges
+    returns specs: list of figure spec dictionaries with name, title, yscale, freq_min and freq_max
+    """
+    specs = [
+        {"name": "log_full","title": "Frequency vs. Intensity (Log Version)","yscale": "log","freq_min": None,"freq_max": None},
+        {"name": "linear_full","title": "Frequency vs. Intensity (Linear Version)","yscale": "linear","freq_min": None,"freq_max": None}
+    ]
+    for freq_min,freq_max in windows:
+        specs.append({"name": f"log_{freq_min:g}_{freq_max:g}MHz","title": f"Frequency vs Intensity (Log, {freq_min:g}-{freq_max:g} MHz only)","yscale": "log","freq_min": freq_min,"freq_max": freq_max})
+    if receivers:
+        for receiver,receiver_range in rfitrends.GBT_receiver_specs.GBT_receiver_ranges.items():
+            # The names covering several receivers are left out of the per-receiver graphs
+            if receiver in rfitrends.GBT_receiver_specs.combined_receivers:
+                continue
+            specs.append({"name": "log_"+receiver.replace(" ","_"),"title": "Frequency vs Intensity (Log, "+receiver+")","yscale": "log","freq_min": receiver_range['freq_min'],"freq_max": receiver_range['freq_max']})
+    return(specs)
+
+
+def open_shared_data(data_directory):
+    """
+    Worker process initializer: memory-maps the columns saved by render_batch, so every worker reads the same pages of one copy
+    """
+    for column in rfitrends.data_stream.avgs_columns:
+        shared_data[column] = np.load(os.path.join(data_directory,column+".npy"),mmap_mode='r')
+
+
+def render_figure(spec,output_directory,formats=("png",),size=(16,9),dpi=100):
+    """
+    Draws one graph from the shared data and saves it in each format
+
+    param spec: a figure spec dictionary, as from default_figure_specs
+    param output_directory: the directory to write the images to
+    param formats: the image formats to write
+    param size: the figure size in inches
+    param dpi: the figure resolution
+    returns paths: the paths of the images written
+    """
+    frequency = shared_data["Frequency"]
+    # Only the part of the data inside the window is handed to matplotlib
+    start = 0 if spec["freq_min"] is None else int(np.searchsorted(frequency,spec["freq_min"],side='left'))
+    stop = len(frequency) if spec["freq_max"] is None else int(np.searchsorted(frequency,spec["freq_max"],side='right'))
+    columns = [np.asarray(shared_data[column][start:stop]) for column in rfitrends.data_stream.avgs_columns]
+
+    figure = Figure(figsize=size,dpi=dpi)
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+    if len(columns[0]) > 0:
+        plot_statistics(*columns,ax=ax)
+    ax.set_yscale(spec["yscale"])
+    ax.set_ylabel("log(Intensity) (Jy)" if spec["yscale"] == "log" else "Intensity (Jy)")
+    ax.set_title(spec["title"])
+    if spec["freq_min"] is not None and spec["freq_max"] is not None:
+        ax.set_xlim(spec["freq_min"],spec["freq_max"])
+    paths = []
+    for image_format in formats:
+        path = os.path.join(output_directory,spec["name"]+"."+image_format)
+        figure.savefig(path,format=image_format)
+        paths.append(path)
+    return(paths)
+
+
+def render_batch(data,output_directory,specs=None,formats=("png",),workers=4,size=(16,9),dpi=100):
+    """
+    Renders every figure spec in a process pool. The data is written once to .npy files which every worker memory-maps,
+    instead of each figure reloading it.
+
+    param data: dictionary of avgs column arrays (i.e. from data_stream.concatenate_chunks), or the tuple returned by load_data
+    param output_directory: the directory to write the images to
+    param specs: list of figure specs, default_figure_specs() by default
+    param formats: the image formats to write
+    param workers: the number of figures to render at once
+    param size: the figure size in inches
+    param dpi: the figure resolution
+    returns paths: the paths of all the images written
+    """
+    if isinstance(data,tuple):
+        data = dict(zip(rfitrends.data_stream.avgs_columns,data))
+    if specs is None:
+        specs = default_figure_specs()
+    for image_format in formats:
+        if image_format not in image_formats:
+            raise ValueError("formats must be from "+str(image_formats))
+    os.makedirs(output_directory,exist_ok=True)
+    paths = []
+    with tempfile.TemporaryDirectory(dir=output_directory) as data_directory:
+        order = np.argsort(data["Frequency"],kind='stable')
+        for column in rfitrends.data_stream.avgs_columns:
+            np.save(os.path.join(data_directory,column+".npy"),np.asarray(data[column],dtype=np.float64)[order])
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers,initializer=open_shared_data,initargs=(data_directory,)) as executor:
+            futures = {executor.submit(render_figure,spec,output_directory,formats,size,dpi): spec["name"] for spec in specs}
+            for future in concurrent.futures.as_completed(futures):
+                figure_paths = future.result()
+                print("Rendered "+futures[future]+": "+", ".join(figure_paths))
+                paths.extend(figure_paths)
+    return(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Renders graphs of the RFI statistics to image files without a display")
+    parser.add_argument("avgs_table",help="The table containing the statistics from which you want to make plots (usually RFI_avgs_expanded)")
+    parser.add_argument("output_directory",help="The directory to write the images to")
+    parser.add_argument("IP_address",nargs='?',default= '192.33.116.22',help="The IP address to find the SQL database. Default is the GBO development server address. This would only work for employees.")
+    parser.add_argument("database",nargs='?',default='jskipper',help="The name of the SQL database. Default is jskipper, which would only work for employees.")
+    parser.add_argument("--formats",nargs='+',choices=image_formats,default=["png"],help="The image formats to write. Default is png")
+    parser.add_argument("--windows",nargs='*',type=rfitrends.data_stream.parse_window,default=[(600.0,700.0)],help="Frequency windows to graph, as freq_min:freq_max in MHz. Default is 600:700")
+    parser.add_argument("--no_receivers",action='store_true',help="Don't make a graph for each receiver band")
+    parser.add_argument("--workers",type=int,default=4,help="The number of figures to render at once. Default is 4")
+    args = parser.parse_args()
+    connection_manager = rfitrends.connection_manager.connection_manager(args.IP_address,args.database)
+    data = load_data(connection_manager,args.avgs_table)
+    render_batch(data,args.output_directory,default_figure_specs(args.windows,not args.no_receivers),args.formats,args.workers)
+
+
+if __name__ == "__main__":
+    main()
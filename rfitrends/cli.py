@@ -0,0 +1,56 @@
+"""
+.. module:: cli.py
+    :synopsis: The rfitrends command, which runs any of the tool's scripts as a subcommand and only imports the one asked for
+.. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
+Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
+"""
+
+import sys
+import argparse
+import importlib
+
+# subcommand: (module whose main() it runs, description). Nothing here is imported until its subcommand is run,
+# so "rfitrends --help" doesn't wait on matplotlib or mysql.
+commands = {
+    "upload": ("rfitrends.RFI_input_for_SQL","Parse RFI scan files and upload them to the main and dirty tables"),
+    "avgs": ("rfitrends.RFI_avgs_loader","Calculate the statistics of every frequency into an avgs table"),
+    "graph": ("rfitrends.RFI_process_graph_avgs","Graph the statistics of an avgs table"),
+    "energy": ("rfitrends.total_energy_calculator","Calculate the total energy of the main and avgs tables"),
+    "energy-series": ("rfitrends.energy_time_series","Calculate the energy per scan, day or month"),
+    "schema": ("rfitrends.schema_manager","Create or update the tables the tool uses"),
+    "partitions": ("rfitrends.receiver_partitions","Calculate the statistics separately for every receiver"),
+    "pyramid": ("rfitrends.frequency_pyramid","Build coarser frequency-binned copies of an avgs table"),
+    "time-cube": ("rfitrends.time_cube","Build a frequency x time cube of the main table"),
+    "render": ("rfitrends.batch_render","Render the avgs graphs to image files without a display"),
+    "waterfall": ("rfitrends.waterfall","Draw a frequency x time waterfall plot"),
+    "query": ("rfitrends.query","Ask for a spectrum, scans or a receiver's statistics through the query cache"),
+    "occurrences": ("rfitrends.occurrence_index","Build or search the index of when each frequency was above its baseline"),
+    "spool": ("rfitrends.scan_spool","Parse scan files into the local spool without uploading, or empty it"),
+    "compare": ("rfitrends.latest_comparison","Flag new and elevated RFI in each receiver's latest project against the avgs baseline"),
+    "regrid": ("rfitrends.regrid","Regrid scan files into a memory-mapped scan x channel array per receiver"),
+    "lines": ("rfitrends.line_detection","Find RFI lines in scan files or dynamic spectra and write one record per emitter"),
+    "quicklook": ("rfitrends.quicklook","Make quicklook images and summaries of scan files, or browse their catalog")
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="rfitrends",description="The GBT RFI Analysis Tool. Run \"rfitrends <command> --help\" for the arguments of each command.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,epilog="commands:\n"+"\n".join(f"  {name:<16}{description}" for name,(_,description) in commands.items()))
+    parser.add_argument("command",choices=list(commands),metavar="command",help="One of the commands below")
+    parser.add_argument("arguments",nargs=argparse.REMAINDER,help="The arguments of the command")
+    return(parser)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    args = build_parser().parse_args(argv)
+    module_name,_ = commands[args.command]
+    module = importlib.import_module(module_name)
+    # Each script parses its own arguments from sys.argv, so they're handed over as if it had been run on its own
+    sys.argv = ["rfitrends "+args.command]+args.arguments
+    return(module.main())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+.. module:: column_cache.py
+    :synopsis: Keeps loaded table columns on local disk as .npy files, keyed by the table's name and a cheap fingerprint, with least-recently-used eviction
+.. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
+Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
+"""
+
+import numpy as np
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+import configparser
+import rfitrends.schema_manager
+
+
+def cache_settings():
+    """
+    Reads the [Cache] section of rfitrends.conf, for every cache and the spool
+
+    returns settings: dictionary of
+        cache_directory: the root directory of the local caches
+        max_bytes: the most space all of the caches together may take up
+        max_query_memory_bytes: the most memory the query cache of query.py may keep results in
+        max_spool_bytes: the most space the spool of scan_spool.py may take up
+    """
+    # pkg_resources is slow to import, so it waits until the settings are needed
+    from pkg_resources import resource_filename
+    config = configparser.ConfigParser()
+    config.read(resource_filename('rfitrends','rfitrends.conf'))
+    def megabytes(option,fallback):
+        return(int(float(config.get('Cache',option,fallback=fallback))*1024*1024))
+    settings = {
+        "cache_directory": os.path.expanduser(config.get('Cache','cache_directory',fallback='~/.cache/rfitrends')),
+        "max_bytes": megabytes('max_cache_megabytes','4096'),
+        "max_query_memory_bytes": megabytes('max_query_memory_megabytes','256'),
+        "max_spool_bytes": megabytes('max_spool_megabytes','2048')
+    }
+    return(settings)
+
+
+def directory_size(path):
+    """
+    returns size: the total size in bytes of the files under path
+    """
+    size = 0
+    for root,_,filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.path.getsize(os.path.join(root,filename))
+            except OSError:
+                pass
+    return(size)
+
+
+def touch(path):
+    # Marks a cache entry as just used; the modification time of an entry is its place in the LRU order
+    try:
+        os.utime(path,None)
+    except OSError:
+        pass
+
+
+def evict_least_recently_used(root,max_bytes,keep=()):
+    """
+    Deletes the least recently used entries (the files or directories directly under root) until root fits in max_bytes
+
+    param root: the cache directory whose entries compete for space
+    param max_bytes: the most space the entries may take up
+    param keep: paths of entries that must not be evicted, such as the one just written
+    returns evicted: the paths of the entries deleted
+    """
+    if not os.path.isdir(root):
+        return([])
+    entries = []
+    for name in os.listdir(root):
+        path = os.path.join(root,name)
+        if name.startswith("."):
+            continue
+        size = directory_size(path) if os.path.isdir(path) else os.path.getsize(path)
+        entries.append((os.path.getmtime(path),size,path))
+    total = sum(size for _,size,_ in entries)
+    evicted = []
+    for _,size,path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path in keep:
+            continue
+        remove_entry(path)
+        total -= size
+        evicted.append(path)
+    return(evicted)
+
+
+def remove_entry(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path,ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+# Every write the tool makes to a table bumps the table's generation in this table, as neither MySQL's times nor the content signal
+# see every change: an upload of older scans (which is usual, as files go in in directory order) doesn't raise MAX(mjd)
+generations_table = "table_generations"
+
+
+def bump_generation(connection_manager,tables):
+    """
+    Records that the tool has just written to some tables, so their fingerprints change
+
+    param connection_manager: An object that connects to the database for the user
+    param tables: the names of the tables written to
+    """
+    connection_manager.execute_command("CREATE TABLE IF NOT EXISTS "+generations_table+" (table_name VARCHAR(128) NOT NULL, generation BIGINT NOT NULL, PRIMARY KEY (table_name));")
+    for table in tables:
+        connection_manager.execute_command("INSERT INTO "+generations_table+" (table_name,generation) VALUES (\'"+str(table)+"\',1) ON DUPLICATE KEY UPDATE generation = generation+1;")
+
+
+def table_generation(connection_manager,table):
+    """
+    returns generation: how many times the tool has written to a table, 0 if never
+    """
+    if not rfitrends.schema_manager.table_exists(connection_manager,generations_table):
+        return(0)
+    result = connection_manager.execute_command("SELECT generation FROM "+generations_table+" WHERE table_name = \'"+str(table)+"\'")
+    return(int(result[0][0]) if result else 0)
+
+
+def primary_key_column(connection_manager,table):
+    """
+    returns column: the first column of a table's primary key, or None if it has none
+    """
+    result = connection_manager.execute_command("SELECT column_name FROM information_schema.key_column_usage WHERE table_schema = DATABASE() AND table_name = \'"+str(table)+"\' AND constraint_name = \'PRIMARY\' AND ordinal_position = 1")
+    return(result[0][0] if result else None)
+
+
+def content_signal(connection_manager,table):
+    """
+    Gives a cheap signal of a table's contents: the largest value of the first column of its primary key, which MySQL reads from the
+    end of the index, or the row count for a table with no primary key (such as the small receiver partition tables)
+    """
+    column = primary_key_column(connection_manager,table)
+    if column is None:
+        return(connection_manager.execute_command("SELECT COUNT(*) FROM "+str(table)))
+    return(connection_manager.execute_command("SELECT MAX(`"+str(column)+"`) FROM "+str(table)))
+
+
+def table_fingerprint(connection_manager,table):
+    """
+    Makes a cheap fingerprint of a table's contents, shared by every cache of query results or columns read from the database.
+    It is made from the create and update times MySQL keeps for the table, its content signal (see content_signal) and its generation
+    (see bump_generation). InnoDB doesn't keep UPDATE_TIME across restarts, only to the second, and MySQL 8 caches it for
+    information_schema_stats_expiry, so the times alone can miss changes.
+    A view (the main table of a normalized layout, see schema_manager.py) has no times or contents of its own, so those of its tables are used.
+
+    param connection_manager: An object that connects to the database for the user
+    param table: the table to fingerprint
+    returns fingerprint: a short hex string
+    """
+    parts = connection_manager.execute_command("SELECT table_type,CREATE_TIME,UPDATE_TIME FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = \'"+str(table)+"\'")
+    parts.append(table_generation(connection_manager,table))
+    if parts and parts[0][0] == "VIEW":
+        tables = rfitrends.schema_manager.normalized_table_names(table)
+        parts += [table_fingerprint(connection_manager,tables[name]) for name in ["scans","spectra"]]
+    elif parts:
+        parts += content_signal(connection_manager,table)
+    fingerprint = hashlib.sha1(str(parts).encode()).hexdigest()[:16]
+    return(fingerprint)
+
+
+def table_cache_prefix(table):
+    # Table names are used in directory names, so anything other than letters, numbers and underscores is replaced
+    return(re.sub("[^0-9A-Za-z_]","_",str(table))+"-")
+
+
+def load_cached_columns(connection_manager,table,columns,loader,cache_directory=None,max_bytes=None):
+    """
+    Returns the columns of a table from the local cache if the table hasn't changed since they were cached, otherwise
+    calls loader, caches what it returns, and evicts the least recently used cached tables if the cache is over its limit.
+    Cached columns come back memory-mapped, so even a large table opens in milliseconds.
+
+    param connection_manager: An object that connects to the database for the user
+    param table: the table the columns are from
+    param columns: the names of the columns wanted
+    param loader: a function taking no arguments that loads the columns from the database, returning a dictionary of column name to numeric array
+    param cache_directory: the root of the local caches, from rfitrends.conf by default
+    param max_bytes: the most space all cached columns may take up, from rfitrends.conf by default
+    returns data: dictionary of column name to array
+    """
+    settings = cache_settings()
+    cache_directory = settings["cache_directory"] if cache_directory is None else cache_directory
+    max_bytes = settings["max_bytes"] if max_bytes is None else max_bytes
+    root = os.path.join(cache_directory,"columns")
+    os.makedirs(root,exist_ok=True)
+    prefix = table_cache_prefix(table)
+    entry = os.path.join(root,prefix+table_fingerprint(connection_manager,table))
+
+    if all(os.path.exists(os.path.join(entry,column+".npy")) for column in columns):
+        touch(entry)
+        print("Loading "+str(table)+" from the local cache.")
+        return({column: np.load(os.path.join(entry,column+".npy"),mmap_mode='r') for column in columns})
+
+    data = loader()
+    # Older copies of this table are stale now, so they go straight away
+    for name in os.listdir(root):
+        if name.startswith(prefix) and os.path.join(root,name) != entry:
+            remove_entry(os.path.join(root,name))
+    # Written to a temporary directory first and renamed into place, so a half-written entry is never read
+    temporary = tempfile.mkdtemp(prefix=".",dir=root)
+    for column in columns:
+        np.save(os.path.join(temporary,column+".npy"),np.asarray(data[column]))
+    remove_entry(entry)
+    os.rename(temporary,entry)
+    evict_least_recently_used(root,max_bytes,keep=(entry,))
+    return(data)
+
+
+def clear_cache(cache_directory=None):
+    """
+    Deletes every cached column
+
+    param cache_directory: the root of the local caches, from rfitrends.conf by default
+    """
+    if cache_directory is None:
+        cache_directory = cache_settings()["cache_directory"]
+    remove_entry(os.path.join(cache_directory,"columns"))
@@ -5,11 +5,15 @@
 Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
 """
 
-from mysql import connector
 import getpass
 
+# The columns written for each line of a scan by add_main_values, in the order they're inserted
+main_value_columns = ["feed","frontend","azimuth_deg","projid","resolution_MHz","Window","exposure","utc_hrs","date","number_IF_Windows","Channel","backend","mjd","Frequency_MHz","lst","filename","polarization","source","tsys","frequency_type","units","Intensity_Jy","scan_number","elevation_deg","Counts"]
+
 class connection_manager():
     def __init__(self,host,database):
+        # mysql is imported when a connection is first needed rather than when this module is imported
+        from mysql import connector
         self.host=host
         self.database=database
         while True:
@@ -26,10 +30,17 @@ class connection_manager():
             except(connector.errors.ProgrammingError):
                 print("Incorrect username or password. Please try again.")
 
-    def execute_command(self,query):
+    def connect(self):
+        # Opens a new connection with the stored credentials, for callers that need to manage their own cursors
+        from mysql import connector
         cnx = connector.connect(user=self.username, password=self.password,
                         host=self.host,
                         database=self.database)
+        return(cnx)
+
+    def execute_command(self,query):
+        from mysql import connector
+        cnx = self.connect()
         cursor = cnx.cursor(buffered=True)
         cursor.execute(query)
         cnx.commit()
@@ -41,12 +52,72 @@ class connection_manager():
             cursor.close()
         return(result)
 
+    def stream_query(self,query,chunk_size=100000):
+        """
+        Runs a query with an unbuffered cursor, so rows stay on the server until they are fetched, 
+        and yields them chunk_size rows at a time instead of pulling the whole result into memory with fetchall
+
+        param query: the SELECT statement to run
+        param chunk_size: the number of rows handed to fetchmany at a time
+        yields rows: a list of up to chunk_size row tuples
+        """
+        from mysql import connector
+        cnx = self.connect()
+        cursor = cnx.cursor(buffered=False)
+        try:
+            cursor.execute(query)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            # If the caller stopped early there are unread rows left on the server, which makes closing the cursor complain. 
+            # Closing the connection throws them away either way. 
+            try:
+                cursor.close()
+            except(connector.errors.Error):
+                pass
+            cnx.close()
+
+    def insert_rows(self,table,columns,rows,batch_size=5000):
+        """
+        Inserts many rows into a table with executemany, batch_size rows per statement, instead of opening a connection for every row
+
+        param table: the table to insert into
+        param columns: the names of the columns being filled, in the same order as the values in each row
+        param rows: a list of row tuples (or lists) containing plain python values
+        param batch_size: the number of rows to send per INSERT so we stay under the server's max_allowed_packet
+        """
+        query = "INSERT INTO "+str(table)+" ("+",".join("`"+column+"`" for column in columns)+") VALUES ("+",".join(["%s"]*len(columns))+")"
+        cnx = self.connect()
+        cursor = cnx.cursor()
+        try:
+            for start in range(0,len(rows),batch_size):
+                cursor.executemany(query,rows[start:start+batch_size])
+            cnx.commit()
+        finally:
+            cursor.close()
+            cnx.close()
+
     def get_distinct_filenames(self,main_table):
         result = self.execute_command("SELECT DISTINCT filename FROM "+main_table)
         return(result)
 
-    def add_main_values(self,data_entry,formatted_RFI_file,frequency):
-        self.execute_command("INSERT INTO "+str(data_entry["Database"])+" (feed,frontend,`azimuth_deg`,projid,`resolution_MHz`,Window,exposure,utc_hrs,date,number_IF_Windows,Channel,backend,mjd,Frequency_MHz,lst,filename,polarization,source,tsys,frequency_type,units,Intensity_Jy,scan_number,`elevation_deg`, `Counts`) VALUES (\""+str(formatted_RFI_file.get("feed"))+"\",\""+str(formatted_RFI_file.get("frontend"))+"\",\""+str(formatted_RFI_file.get("azimuth (deg)"))+"\",\""+str(formatted_RFI_file.get("projid"))+"\",\""+str(formatted_RFI_file.get("frequency_resolution (MHz)"))+"\",\""+str(data_entry["Window"])+"\",\""+str(formatted_RFI_file.get("exposure (sec)"))+"\",\""+str(formatted_RFI_file.get("utc (hrs)"))+"\",\""+str(formatted_RFI_file.get("date"))+"\",\""+str(formatted_RFI_file.get("number_IF_Windows"))+"\",\""+str(data_entry["Channel"])+"\",\""+str(formatted_RFI_file.get("backend"))+"\",\""+str(formatted_RFI_file.get("mjd"))+"\",\""+frequency+"\",\""+str(formatted_RFI_file.get("lst (hrs)"))+"\",\""+str(formatted_RFI_file.get("filename"))+"\",\""+str(formatted_RFI_file.get("polarization"))+"\",\""+str(formatted_RFI_file.get("source"))+"\",\""+str(formatted_RFI_file.get("tsys"))+"\",\""+str(formatted_RFI_file.get("frequency_type"))+"\",\""+str(formatted_RFI_file.get("units"))+"\",\""+str(data_entry["Intensity_Jy"])+"\",\""+str(formatted_RFI_file.get("scan_number"))+"\",\""+str(formatted_RFI_file.get("elevation (deg)"))+"\",\""+str(data_entry["Counts"])+"\");")
+    def add_main_values(self,table,header_values,frequency,intensity,window,channel,counts):
+        """
+        Inserts one line of a scan into the main or dirty table
+
+        param table: the table to insert into
+        param header_values: dictionary of the header columns of the file, as given by scan_header.column_values
+        param frequency: the frequency key as a decimal string
+        param intensity: the intensity of the line
+        param window: the IF window of the line, "NaN" if it has none
+        param channel: the channel of the line, "NaN" if it has none
+        param counts: the number of lines of the file averaged into this one
+        """
+        row = dict(header_values,Frequency_MHz=frequency,Intensity_Jy=intensity,Window=window,Channel=channel,Counts=counts)
+        self.insert_rows(table,main_value_columns,[[row[column] for column in main_value_columns]])
     
     def grab_values_for_avg_intensity(self,table,frequency,mjd):
         result = self.execute_command("SELECT Intensity_Jy,filename,Counts from "+table+" WHERE Frequency_MHz = "+frequency+" AND mjd = "+mjd)
@@ -81,4 +152,10 @@ class connection_manager():
         self.execute_command("CREATE TABLE IF NOT EXISTS "+projid_table+" (Frequency_MHz Decimal(12,6), mjd Decimal(8,3), PRIMARY KEY (Frequency_MHz,mjd));")
 
     def projid_populate_table(self,projid,frequency,mjd):
-        self.execute_command("INSERT INTO "+projid+" (Frequency_MHz,mjd) VALUES (\""+frequency+"\", \""+mjd+"\");")
\ No newline at end of file
+        self.execute_command("INSERT INTO "+projid+" (Frequency_MHz,mjd) VALUES (\""+frequency+"\", \""+mjd+"\");")
+
+    def pyramid_table_maker(self,level_table):
+        self.execute_command("CREATE TABLE IF NOT EXISTS "+level_table+" (Frequency Decimal(12,6), mean_intensity DOUBLE, max_intensity DOUBLE, min_intensity DOUBLE, median_intensity DOUBLE, low_percentile_intensity DOUBLE, high_percentile_intensity DOUBLE, n_channels INT, PRIMARY KEY (Frequency));")
+
+    def avgs_table_maker(self,avgs_table):
+        self.execute_command("CREATE TABLE IF NOT EXISTS "+avgs_table+" (Frequency Decimal(12,6), mean_intensity DOUBLE, max_intensity DOUBLE, min_intensity DOUBLE, median_intensity DOUBLE, low_percentile_intensity DOUBLE, high_percentile_intensity DOUBLE, PRIMARY KEY (Frequency));")
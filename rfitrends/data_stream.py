@@ -0,0 +1,190 @@
+"""
+.. module:: data_stream.py
+    :synopsis: Streams ordered rows straight from the RFI SQL tables as chunks of NumPy columns, so the analysis scripts don't need a CSV export
+.. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
+Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
+"""
+
+import numpy as np
+
+# The columns of the statistics table made by RFI_avgs_loader.py, in table order
+avgs_columns = ["Frequency","mean_intensity","max_intensity","min_intensity","median_intensity","low_percentile_intensity","high_percentile_intensity"]
+
+# Columns of the main and dirty tables that hold text, and so are kept as strings instead of being converted to floats
+string_columns = ["feed","frontend","projid","date","backend","filename","polarization","source","frequency_type","units","Window","Channel"]
+
+# How many rows are pulled from the server with each fetchmany call
+default_chunk_size = 100000
+
+
+def parse_window(window):
+    """
+    Turns a "600:700" command line argument, as the scripts take with --windows, into a (600.0, 700.0) frequency window
+    """
+    freq_min,freq_max = window.split(":")
+    return((float(freq_min),float(freq_max)))
+
+
+def build_select(table,columns,order_by=None,where=None):
+    """
+    Builds the SELECT statement for a set of columns of a table
+
+    param table: the table to read
+    param columns: list of column names to select
+    param order_by: optional list of columns to sort the result by
+    param where: optional SQL condition (without the WHERE) used to filter the rows
+    returns query: the SELECT statement
+    """
+    query = "SELECT "+",".join("`"+column+"`" for column in columns)+" FROM "+str(table)
+    if where:
+        query += " WHERE "+where
+    if order_by:
+        query += " ORDER BY "+",".join("`"+column+"`" for column in order_by)
+    return(query)
+
+
+def rows_to_columns(rows,columns):
+    """
+    Turns a list of row tuples into a dictionary of NumPy column arrays
+
+    param rows: list of row tuples, as given by fetchmany
+    param columns: the names of the columns in each row
+    returns chunk: dictionary of column name to array. Numeric columns become float64 (NULL becomes NaN), text columns stay as object arrays
+    """
+    chunk = {}
+    for index,column in enumerate(columns):
+        values = [row[index] for row in rows]
+        if column in string_columns:
+            chunk[column] = np.array(values,dtype=object)
+        else:
+            chunk[column] = np.array([np.nan if value is None else value for value in values],dtype=np.float64)
+    return(chunk)
+
+
+def stream_columns(connection_manager,table,columns,order_by=None,where=None,chunk_size=default_chunk_size):
+    """
+    Streams the given columns of a table through an unbuffered server-side cursor
+
+    param connection_manager: An object that connects to the database for the user
+    param table: the table to read
+    param columns: list of column names to read
+    param order_by: optional list of columns to sort the rows by on the server
+    param where: optional SQL condition used to filter the rows
+    param chunk_size: number of rows per yielded chunk
+    yields chunk: dictionary of column name to NumPy array, holding up to chunk_size rows
+    """
+    query = build_select(table,columns,order_by,where)
+    for rows in connection_manager.stream_query(query,chunk_size):
+        yield rows_to_columns(rows,columns)
+
+
+def stream_main_table(connection_manager,main_table,columns=("Frequency_MHz","Intensity_Jy"),order_by=("Frequency_MHz",),where=None,chunk_size=default_chunk_size):
+    """
+    Streams columns of the main (or dirty) table made by RFI_input_for_SQL.py
+
+    param connection_manager: An object that connects to the database for the user
+    param main_table: the table containing the RFI data
+    param columns: the columns to read, frequency and intensity by default
+    param order_by: the columns to sort by, frequency by default
+    param where: optional SQL condition used to filter the rows
+    param chunk_size: number of rows per yielded chunk
+    yields chunk: dictionary of column name to NumPy array
+    """
+    return(stream_columns(connection_manager,main_table,list(columns),order_by,where,chunk_size))
+
+
+def stream_avgs_table(connection_manager,avgs_table,columns=avgs_columns,where=None,chunk_size=default_chunk_size):
+    """
+    Streams the statistics table made by RFI_avgs_loader.py in order of frequency
+
+    param connection_manager: An object that connects to the database for the user
+    param avgs_table: the table containing the RFI statistics
+    param columns: the columns to read, all of the statistics by default
+    param where: optional SQL condition used to filter the rows
+    param chunk_size: number of rows per yielded chunk
+    yields chunk: dictionary of column name to NumPy array
+    """
+    return(stream_columns(connection_manager,avgs_table,list(columns),["Frequency"],where,chunk_size))
+
+
+def concatenate_chunks(chunks,columns=None):
+    """
+    Joins streamed chunks back into whole columns, for the cases where the full column is really needed (such as plotting)
+
+    param chunks: an iterable of chunk dictionaries
+    param columns: the column names to expect if no chunk arrives at all
+    returns data: dictionary of column name to a single array
+    """
+    pieces = {}
+    for chunk in chunks:
+        for column,values in chunk.items():
+            pieces.setdefault(column,[]).append(values)
+    data = {column: np.concatenate(values) for column,values in pieces.items()}
+    if not data and columns is not None:
+        data = {column: np.array([],dtype=object if column in string_columns else np.float64) for column in columns}
+    return(data)
+
+
+def nearest_frequency(sorted_frequency,frequency,max_distance):
+    """
+    Finds the nearest of a sorted array of frequencies (such as those of the avgs table) to every channel
+
+    param sorted_frequency: sorted array of the frequencies to look in
+    param frequency: array of the channel frequencies
+    param max_distance: how far away in MHz the nearest frequency may be
+    returns nearest: array of the index of the nearest frequency, -1 where there is none within max_distance
+    """
+    frequency = np.asarray(frequency,dtype=np.float64)
+    if len(sorted_frequency) == 0:
+        return(np.full(len(frequency),-1,dtype=np.int64))
+    # The nearest frequency is one of the two either side of where the channel would be inserted
+    right = np.clip(np.searchsorted(sorted_frequency,frequency),0,len(sorted_frequency)-1)
+    left = np.maximum(right-1,0)
+    nearest = np.where(np.abs(sorted_frequency[left]-frequency) <= np.abs(sorted_frequency[right]-frequency),left,right)
+    return(np.where(np.abs(sorted_frequency[nearest]-frequency) <= max_distance,nearest,-1))
+
+
+def group_starts(keys,rel_tol=0.0):
+    """
+    Finds where each run of equal (or, with rel_tol, nearly equal) values begins in an ordered array.
+    As in RFI_avgs_loader, each value is compared with the one just before it, so a slowly drifting run stays one group.
+
+    param keys: the ordered array of group keys, such as frequency
+    param rel_tol: the relative tolerance under which two neighbouring keys count as the same
+    returns starts: index of the first element of each group
+    """
+    keys = np.asarray(keys)
+    if len(keys) == 0:
+        return(np.array([],dtype=np.intp))
+    if rel_tol:
+        new_group = ~np.isclose(keys[1:],keys[:-1],rtol=rel_tol,atol=0.0)
+    else:
+        new_group = keys[1:] != keys[:-1]
+    starts = np.concatenate(([0],np.flatnonzero(new_group)+1))
+    return(starts)
+
+
+def stream_complete_groups(chunks,key_column,rel_tol=0.0):
+    """
+    Re-cuts a stream of chunks ordered by key_column so that no group of equal keys is split between two chunks.
+    The rows of the last group of each chunk are held back and put in front of the next chunk.
+
+    param chunks: an iterable of chunk dictionaries ordered by key_column
+    param key_column: the column the groups are made from
+    param rel_tol: the relative tolerance under which two neighbouring keys count as the same
+    yields (chunk, starts): a chunk containing only complete groups, and the start index of each group in it
+    """
+    carry = None
+    for chunk in chunks:
+        if carry is not None:
+            chunk = {column: np.concatenate((carry[column],values)) for column,values in chunk.items()}
+        starts = group_starts(chunk[key_column],rel_tol)
+        if len(starts) == 0:
+            continue
+        last_start = starts[-1]
+        carry = {column: values[last_start:] for column,values in chunk.items()}
+        if last_start > 0:
+            yield({column: values[:last_start] for column,values in chunk.items()},starts[:-1])
+    # Whatever is left over at the end of the stream is a complete group
+    if carry is not None and len(carry[key_column]) > 0:
+        yield(carry,np.array([0],dtype=np.intp))
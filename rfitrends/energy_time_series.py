@@ -0,0 +1,156 @@
+"""
+.. module:: energy_time_series.py
+    :synopsis: Integrates the RFI energy of the main table per scan, per day or per month (and optionally per frontend) in one streaming pass
+.. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
+Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
+"""
+
+import numpy as np
+import time
+import csv
+import argparse
+import rfitrends.connection_manager
+import rfitrends.data_stream
+from rfitrends.total_energy_calculator import energy_integrator,energy_factor,progress_interval
+from rfitrends.time_cube import mjd_to_month,month_to_mjd
+
+# The periods the energy can be grouped by
+time_series_periods = ["scan","day","month"]
+
+# The columns of the time series table
+time_series_columns = ["period_start_mjd","period","frontend","n_scans","n_channels","energy"]
+
+
+def period_start(mjd,period):
+    """
+    Gives the start of the period each mjd falls in
+
+    param mjd: array of mjd values
+    param period: "scan" (the mjd itself), "day" or "month"
+    returns start: array of the mjd at the start of each period
+    """
+    if period == "scan":
+        return(np.asarray(mjd,dtype=np.float64))
+    if period == "day":
+        return(np.floor(mjd))
+    return(month_to_mjd(mjd_to_month(mjd)))
+
+
+def period_label(start,period):
+    """
+    Gives a readable label for a period starting at the mjd start
+    """
+    if period == "month":
+        return(str(mjd_to_month([start]).astype('datetime64[M]')[0]))
+    if period == "day":
+        return(str((np.datetime64('1858-11-17')+np.timedelta64(int(start),'D'))))
+    return(f"{start:.3f}")
+
+
+def energy_time_series(connection_manager,full_data_table,period="day",by_frontend=False,where=None):
+    """
+    Streams the main table once, in order of (mjd, [frontend,] Frequency_MHz), integrating flux times delta nu within each scan and
+    adding each scan's energy to the period it falls in. Everything is done on whole chunks with segmented NumPy sums.
+
+    param connection_manager: An object that connects to the database for the user
+    param full_data_table: the table containing all RFI data
+    param period: "scan", "day" or "month"
+    param by_frontend: whether to keep a separate series for each frontend
+    param where: optional SQL condition to use only part of the table
+    returns series: a structured array with one row per period (and frontend), with the fields in time_series_columns
+    """
+    if period not in time_series_periods:
+        raise ValueError("period must be one of "+str(time_series_periods))
+    columns = ("mjd","frontend","Frequency_MHz","Intensity_Jy") if by_frontend else ("mjd","Frequency_MHz","Intensity_Jy")
+    order_by = ("mjd","frontend","Frequency_MHz") if by_frontend else ("mjd","Frequency_MHz")
+    chunks = rfitrends.data_stream.stream_main_table(connection_manager,full_data_table,columns=columns,order_by=order_by,where=where)
+
+    integrator = energy_integrator()
+    frontend_codes = {}
+    # (period start, frontend code) -> [flux times delta nu, number of scans, number of channels]
+    totals = {}
+    last_segment = None
+    rows = 0
+    last_print = time.monotonic()
+    for chunk in chunks:
+        mjd = chunk["mjd"]
+        if by_frontend:
+            names,inverse = np.unique(chunk["frontend"].astype(str),return_inverse=True)
+            codes = np.array([frontend_codes.setdefault(name,len(frontend_codes)) for name in names],dtype=np.int64)[inverse]
+        else:
+            codes = np.zeros(len(mjd),dtype=np.int64)
+        # mjd has 3 decimals, so this is an exact integer id for every (mjd, frontend) scan
+        segment = np.round(mjd*1000.0).astype(np.int64)*1000+codes
+        start_frequency,flux_times_delta_nu,interval_segment = integrator.intervals(chunk["Frequency_MHz"],chunk["Intensity_Jy"],segment)
+
+        # Each interval belongs to the scan of the row it starts from
+        interval_keys = np.stack((interval_segment//1000,interval_segment%1000),axis=1)
+        # A new scan starts wherever the segment changes, including across the chunk boundary
+        previous = np.concatenate(([last_segment if last_segment is not None else segment[0]-1],segment[:-1]))
+        new_scan = segment != previous
+        last_segment = segment[-1]
+        row_keys = np.stack((segment//1000,codes),axis=1)
+
+        for keys,values,kind in ((interval_keys,flux_times_delta_nu,0),(row_keys[new_scan],None,1),(row_keys,None,2)):
+            if len(keys) == 0:
+                continue
+            unique_keys,inverse = np.unique(keys,axis=0,return_inverse=True)
+            inverse = inverse.reshape(-1)
+            sums = np.bincount(inverse,weights=values,minlength=len(unique_keys))
+            starts = period_start(unique_keys[:,0]/1000.0,period)
+            for start,code,value in zip(starts.tolist(),unique_keys[:,1].tolist(),sums.tolist()):
+                totals.setdefault((start,code),[0.0,0,0])[kind] += value
+        rows += len(mjd)
+        if time.monotonic()-last_print >= progress_interval:
+            print("progress: "+str(rows)+" rows integrated from "+str(full_data_table))
+            last_print = time.monotonic()
+    print("done: "+str(rows)+" rows integrated into "+str(len(totals))+" periods")
+
+    frontend_names = {code: name for name,code in frontend_codes.items()}
+    series = np.zeros(len(totals),dtype=[("period_start_mjd",np.float64),("period","U16"),("frontend","U32"),("n_scans",np.int64),("n_channels",np.int64),("energy",np.float64)])
+    for index,((start,code),(flux_times_delta_nu,n_scans,n_channels)) in enumerate(sorted(totals.items())):
+        series[index] = (start,period_label(start,period),frontend_names.get(code,"All"),n_scans,n_channels,flux_times_delta_nu*energy_factor)
+    return(series)
+
+
+def write_time_series(series,connection_manager=None,output_table=None,csv_path=None):
+    """
+    Writes a time series to an SQL table and/or a CSV file
+
+    param series: the structured array from energy_time_series
+    param connection_manager: An object that connects to the database for the user, needed for output_table
+    param output_table: the SQL table to (re)create and fill
+    param csv_path: the CSV file to write
+    """
+    rows = [list(row) for row in series.tolist()]
+    if output_table is not None:
+        connection_manager.execute_command("DROP TABLE IF EXISTS "+output_table)
+        connection_manager.execute_command("CREATE TABLE "+output_table+" (period_start_mjd Decimal(8,3), period VARCHAR(16), frontend VARCHAR(32), n_scans INT, n_channels INT, energy DOUBLE, PRIMARY KEY (period_start_mjd,frontend));")
+        connection_manager.insert_rows(output_table,time_series_columns,rows)
+    if csv_path is not None:
+        with open(csv_path,'w',newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(time_series_columns)
+            writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calculates the RFI energy per scan, day or month from an RFI table")
+    parser.add_argument("full_data_table",help="The table containing all RFI data (likely main_table from RFI_input_for_SQL.py)")
+    parser.add_argument("IP_address",nargs='?',default= '192.33.116.22',help="The IP address to find the SQL database. Default is the GBO development server address. This would only work for employees.")
+    parser.add_argument("database",nargs='?',default='jskipper',help="The name of the SQL database. Default is jskipper, which would only work for employees.")
+    parser.add_argument("--period",choices=time_series_periods,default="day",help="Group the energy by scan, day or month. Default is day")
+    parser.add_argument("--by_frontend",action='store_true',help="Keep a separate series for each frontend")
+    parser.add_argument("--where",default=None,help="An SQL condition to use only part of the table, e.g. \"mjd > 58484\"")
+    parser.add_argument("--output_table",default=None,help="An SQL table to write the series to (it is replaced if it exists)")
+    parser.add_argument("--csv",default=None,help="A CSV file to write the series to")
+    args = parser.parse_args()
+    connection_manager = rfitrends.connection_manager.connection_manager(args.IP_address,args.database)
+    series = energy_time_series(connection_manager,args.full_data_table,args.period,args.by_frontend,args.where)
+    write_time_series(series,connection_manager,args.output_table,args.csv)
+    for row in series:
+        print(f"{row['period']:<16}{row['frontend']:<20}{row['n_scans']:>8}{row['energy']:>16.6e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+.. module:: frequency_pyramid.py
+    :synopsis: Builds and queries coarser frequency-binned copies of the avgs table, so wide views don't read every channel
+.. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
+Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
+"""
+
+import numpy as np
+import argparse
+import rfitrends.connection_manager
+import rfitrends.data_stream
+from rfitrends.RFI_avgs_loader import sorted_group_percentile
+
+# Bin widths, in MHz, of each level of the pyramid from finest to coarsest
+default_bin_widths = [0.1, 1.0, 10.0, 100.0]
+
+# A level has the same statistic columns as the avgs table, plus the number of channels that went into each bin.
+# For a bin: mean is the mean of the channel means, max/min are the max/min of the channel max/min, median is the median
+# of the channel medians, and the percentiles are the envelope (lowest low percentile, highest high percentile) of the channels.
+level_columns = rfitrends.data_stream.avgs_columns+["n_channels"]
+
+
+def level_table_name(avgs_table,bin_width):
+    """
+    Gives the name of the table holding one level of the pyramid, i.e. RFI_avgs_bin_0p1MHz for 0.1 MHz bins
+
+    param avgs_table: the avgs table the pyramid was built from
+    param bin_width: the bin width of the level in MHz
+    returns table: the level table name
+    """
+    return(str(avgs_table)+"_bin_"+("%g" % bin_width).replace(".","p")+"MHz")
+
+
+def registry_table_name(avgs_table):
+    """
+    Gives the name of the table listing the levels that have been built for an avgs table
+    """
+    return(str(avgs_table)+"_pyramid")
+
+
+def frequency_bin_index(frequency,bin_width):
+    """
+    Gives the index of the bin each frequency falls in. Rounded before the floor so that 600.0/0.1 lands in bin 6000 and not 5999.
+
+    param frequency: array of frequencies in MHz
+    param bin_width: the bin width in MHz
+    returns index: integer bin index of each frequency
+    """
+    return(np.floor(np.round(frequency/bin_width,6)).astype(np.int64))
+
+
+class pyramid_level():
+    """
+    Collects the statistics for one bin width as the avgs table streams by in order of frequency.
+    Only the bin that is still open at the end of a chunk is held back until the next chunk arrives.
+    """
+    def __init__(self,bin_width):
+        self.bin_width = bin_width
+        self.carry = None
+
+    def add(self,chunk):
+        """
+        param chunk: dictionary of avgs column arrays, ordered by frequency
+        returns statistics: dictionary of level column arrays for the bins completed by this chunk, or None
+        """
+        if self.carry is not None:
+            chunk = {column: np.concatenate((self.carry[column],values)) for column,values in chunk.items()}
+        index = frequency_bin_index(chunk["Frequency"],self.bin_width)
+        starts = rfitrends.data_stream.group_starts(index)
+        if len(starts) == 0:
+            return(None)
+        last_start = starts[-1]
+        self.carry = {column: values[last_start:] for column,values in chunk.items()}
+        if last_start == 0:
+            return(None)
+        complete = {column: values[:last_start] for column,values in chunk.items()}
+        return(self.reduce(complete,index[:last_start],starts[:-1]))
+
+    def finish(self):
+        """
+        returns statistics: the statistics of the last open bin, or None if nothing is left
+        """
+        if self.carry is None or len(self.carry["Frequency"]) == 0:
+            return(None)
+        index = frequency_bin_index(self.carry["Frequency"],self.bin_width)
+        statistics = self.reduce(self.carry,index,np.array([0],dtype=np.intp))
+        self.carry = None
+        return(statistics)
+
+    def reduce(self,chunk,index,starts):
+        counts = np.diff(np.append(starts,len(index)))
+        # Sorting the channel medians within each bin (the bins are already in order) gives us the median of the medians
+        median_order = np.lexsort((chunk["median_intensity"],index))
+        statistics = {
+            "Frequency": (index[starts]+0.5)*self.bin_width,
+            "mean_intensity": np.add.reduceat(chunk["mean_intensity"],starts)/counts,
+            "max_intensity": np.maximum.reduceat(chunk["max_intensity"],starts),
+            "min_intensity": np.minimum.reduceat(chunk["min_intensity"],starts),
+            "median_intensity": sorted_group_percentile(chunk["median_intensity"][median_order],starts,counts,50.0),
+            "low_percentile_intensity": np.minimum.reduceat(chunk["low_percentile_intensity"],starts),
+            "high_percentile_intensity": np.maximum.reduceat(chunk["high_percentile_intensity"],starts),
+            "n_channels": counts
+        }
+        return(statistics)
+
+
+def level_rows(statistics):
+    """
+    Turns a dictionary of level statistic arrays into rows ready for insertion
+
+    param statistics: dictionary of level column arrays
+    returns rows: list of row lists in the order of level_columns
+    """
+    frequencies = [f"{frequency:.6f}" for frequency in statistics["Frequency"]]
+    columns = [frequencies]+[statistics[column].tolist() for column in level_columns[1:]]
+    return([list(row) for row in zip(*columns)])
+
+
+def build_pyramid(connection_manager,avgs_table,bin_widths=default_bin_widths):
+    """
+    Builds every level of the pyramid in a single pass over the avgs table, replacing any levels built before
+
+    param connection_manager: An object that connects to the database for the user
+    param avgs_table: the table made by RFI_avgs_loader.py
+    param bin_widths: the bin widths, in MHz, of the levels to build
+    """
+    bin_widths = sorted(bin_widths)
+    levels = [pyramid_level(bin_width) for bin_width in bin_widths]
+    registry_table = registry_table_name(avgs_table)
+    connection_manager.execute_command("CREATE TABLE IF NOT EXISTS "+registry_table+" (bin_width_MHz DOUBLE, level_table VARCHAR(128), PRIMARY KEY (bin_width_MHz));")
+    for bin_width in bin_widths:
+        level_table = level_table_name(avgs_table,bin_width)
+        connection_manager.execute_command("DROP TABLE IF EXISTS "+level_table)
+        connection_manager.pyramid_table_maker(level_table)
+        connection_manager.execute_command("DELETE FROM "+registry_table+" WHERE bin_width_MHz = "+repr(float(bin_width)))
+
+    rows_read = 0
+    for chunk in rfitrends.data_stream.stream_avgs_table(connection_manager,avgs_table):
+        rows_read += len(chunk["Frequency"])
+        for level in levels:
+            statistics = level.add(chunk)
+            if statistics is not None:
+                connection_manager.insert_rows(level_table_name(avgs_table,level.bin_width),level_columns,level_rows(statistics))
+        print("progress: "+str(rows_read)+" frequencies binned, up to "+f"{chunk['Frequency'][-1]:.6f}"+" MHz")
+    for level in levels:
+        statistics = level.finish()
+        if statistics is not None:
+            connection_manager.insert_rows(level_table_name(avgs_table,level.bin_width),level_columns,level_rows(statistics))
+        # Only register the level once it is complete, so a half-built level is never queried
+        connection_manager.insert_rows(registry_table,["bin_width_MHz","level_table"],[[float(level.bin_width),level_table_name(avgs_table,level.bin_width)]])
+
+
+def choose_level(bin_widths,resolution):
+    """
+    Picks the coarsest level that still has at least the requested resolution
+
+    param bin_widths: the bin widths that have been built
+    param resolution: the coarsest bin width, in MHz, the caller can accept
+    returns bin_width: the chosen bin width, or None if the full-resolution avgs table is needed
+    """
+    usable = [bin_width for bin_width in bin_widths if bin_width <= resolution]
+    if not usable:
+        return(None)
+    return(max(usable))
+
+
+def range_condition(freq_min,freq_max,bin_width=None):
+    """
+    Builds the SQL condition for the rows of a level (or of the avgs table) that cover a frequency range. The Frequency of a level
+    row is the centre of its bin, so the range is widened by half a bin at each end to keep the bins that only partly overlap it.
+
+    param freq_min: the lowest frequency of the range in MHz
+    param freq_max: the highest frequency of the range in MHz
+    param bin_width: the bin width of the level, or None for the avgs table
+    returns where: the SQL condition, without the WHERE
+    """
+    if bin_width is None:
+        return("Frequency BETWEEN "+repr(float(freq_min))+" AND "+repr(float(freq_max)))
+    # A bin holds its lower edge but not its upper one
+    return("Frequency > "+repr(float(freq_min)-bin_width/2.0)+" AND Frequency <= "+repr(float(freq_max)+bin_width/2.0))
+
+
+def query_pyramid(connection_manager,avgs_table,freq_min,freq_max,resolution):
+    """
+    Reads the statistics for a frequency range at (at least) a given resolution, from the coarsest pyramid level that will do
+
+    param connection_manager: An object that connects to the database for the user
+    param avgs_table: the avgs table the pyramid was built from
+    param freq_min: the lowest frequency of the range in MHz
+    param freq_max: the highest frequency of the range in MHz
+    param resolution: the coarsest bin width, in MHz, the caller can accept. For a plot this is usually the range divided by its width in pixels
+    returns data: dictionary of column name to array, with the same statistic columns as the avgs table
+    returns bin_width: the bin width that was used, or None if the avgs table itself was read
+    """
+    registry = connection_manager.execute_command("SELECT bin_width_MHz,level_table FROM "+registry_table_name(avgs_table))
+    level_tables = {float(row[0]): row[1] for row in registry}
+    bin_width = choose_level(level_tables.keys(),resolution)
+    where = range_condition(freq_min,freq_max,bin_width)
+    if bin_width is None:
+        table,columns = avgs_table,rfitrends.data_stream.avgs_columns
+    else:
+        table,columns = level_tables[bin_width],level_columns
+    chunks = rfitrends.data_stream.stream_avgs_table(connection_manager,table,columns=columns,where=where)
+    data = rfitrends.data_stream.concatenate_chunks(chunks,columns)
+    return(data,bin_width)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds frequency-binned levels of an avgs table for fast wide-range views")
+    parser.add_argument("avgs_table",help="The table containing the statistics made by RFI_avgs_loader.py")
+    parser.add_argument("IP_address",nargs='?',default= '192.33.116.22',help="The IP address to find the SQL database. Default is the GBO development server address. This would only work for employees.")
+    parser.add_argument("database",nargs='?',default='jskipper',help="The name of the SQL database. Default is jskipper, which would only work for employees.")
+    parser.add_argument("--bin_widths",nargs='+',type=float,default=default_bin_widths,help="The bin widths in MHz of each level. Default is 0.1 1 10 100")
+    args = parser.parse_args()
+    connection_manager = rfitrends.connection_manager.connection_manager(args.IP_address,args.database)
+    build_pyramid(connection_manager,args.avgs_table,args.bin_widths)
+
+
+if __name__ == "__main__":
+    main()
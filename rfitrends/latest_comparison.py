@@ -0,0 +1,176 @@
+"""
+.. module:: latest_comparison.py
+    :synopsis: Compares the latest project of every receiver against the avgs baseline (median and 97.5th percentile), flagging new and elevated RFI into a flags table
+.. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
+Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
+"""
+
+import numpy as np
+import argparse
+import datetime
+import time
+import rfitrends.connection_manager
+import rfitrends.data_stream
+import rfitrends.schema_manager
+
+# The flags a channel of the latest project can get, from the most to the least surprising:
+# new: no frequency within max_baseline_distance has ever been seen before, so there is no baseline for it
+# record: above the highest intensity ever seen at that frequency
+# elevated: above factor times the 97.5th percentile
+flags = ["new","record","elevated"]
+
+default_flags_table = "latest_rfi_flags"
+
+flags_table_columns = [
+    ("frontend","VARCHAR(64) NOT NULL"),
+    ("projid","VARCHAR(64)"),
+    ("mjd","Decimal(8,3) NOT NULL"),
+    ("Frequency_MHz","Decimal(12,6) NOT NULL"),
+    ("Intensity_Jy","DOUBLE"),
+    ("median_intensity","DOUBLE"),
+    ("high_percentile_intensity","DOUBLE"),
+    ("ratio_to_median","DOUBLE"),
+    ("ratio_to_high_percentile","DOUBLE"),
+    ("flag","VARCHAR(16)"),
+    ("compared_at","VARCHAR(32)")
+]
+
+
+def latest_projects(connection_manager):
+    """
+    returns projects: list of (frontend, projid, mjd) from the latest_projects table kept up to date by RFI_input_for_SQL.py,
+    leaving out the receivers that have no project yet
+    """
+    rows = connection_manager.execute_command("SELECT frontend,projid,mjd FROM latest_projects")
+    return([(frontend,projid,mjd) for frontend,projid,mjd in rows if projid not in [None,"None","NaN"]])
+
+
+def latest_spectrum(connection_manager,main_table,projid):
+    """
+    Reads the channels of a project from the main table, through the table of its (Frequency_MHz, mjd) keys made by update_caching_tables,
+    so only those rows are read (by primary key) rather than the whole main table
+
+    returns spectrum: dictionary of mjd, Frequency_MHz and Intensity_Jy arrays
+    """
+    query = "SELECT main.mjd,main.Frequency_MHz,main.Intensity_Jy FROM "+str(projid)+" AS project JOIN "+str(main_table)+" AS main ON main.mjd = project.mjd AND main.Frequency_MHz = project.Frequency_MHz"
+    columns = ["mjd","Frequency_MHz","Intensity_Jy"]
+    chunks = (rfitrends.data_stream.rows_to_columns(rows,columns) for rows in connection_manager.stream_query(query))
+    return(rfitrends.data_stream.concatenate_chunks(chunks,columns))
+
+
+def load_baseline_range(connection_manager,avgs_table,freq_min,freq_max):
+    """
+    Reads the baseline statistics of the avgs table made by RFI_avgs_loader.py between two frequencies, sorted by frequency
+    """
+    columns = ["Frequency","median_intensity","max_intensity","high_percentile_intensity"]
+    where = "Frequency BETWEEN "+repr(float(freq_min))+" AND "+repr(float(freq_max))
+    chunks = rfitrends.data_stream.stream_avgs_table(connection_manager,avgs_table,columns=columns,where=where)
+    return(rfitrends.data_stream.concatenate_chunks(chunks,columns))
+
+
+def compare_spectrum(spectrum,baseline,factor=1.0,max_baseline_distance=0.5):
+    """
+    Compares every channel of a spectrum against the baseline at its frequency, all at once
+
+    param spectrum: dictionary of mjd, Frequency_MHz and Intensity_Jy arrays
+    param baseline: dictionary of the baseline statistics, as given by load_baseline_range
+    param factor: a channel is elevated if it is above factor times the 97.5th percentile
+    param max_baseline_distance: how far away in MHz a baseline frequency may be and still be used
+    returns comparison: dictionary of the spectrum's arrays plus median_intensity, high_percentile_intensity, ratio_to_median,
+    ratio_to_high_percentile and flag (an empty string for channels that aren't flagged)
+    """
+    frequency = np.asarray(spectrum["Frequency_MHz"],dtype=np.float64)
+    intensity = np.asarray(spectrum["Intensity_Jy"],dtype=np.float64)
+    nearest = rfitrends.data_stream.nearest_frequency(baseline["Frequency"],frequency,max_baseline_distance)
+    found = nearest >= 0
+    def at_channels(statistic):
+        values = np.full(len(frequency),np.nan)
+        values[found] = baseline[statistic][nearest[found]]
+        return(values)
+    median = at_channels("median_intensity")
+    high_percentile = at_channels("high_percentile_intensity")
+    maximum = at_channels("max_intensity")
+    with np.errstate(divide='ignore',invalid='ignore'):
+        ratio_to_median = intensity/median
+        ratio_to_high_percentile = intensity/high_percentile
+        flag = np.select([~found,intensity > maximum,intensity > factor*high_percentile],flags,default="")
+    return({"mjd": spectrum["mjd"],"Frequency_MHz": frequency,"Intensity_Jy": intensity,"median_intensity": median,"high_percentile_intensity": high_percentile,
+        "ratio_to_median": ratio_to_median,"ratio_to_high_percentile": ratio_to_high_percentile,"flag": flag})
+
+
+def none_if_nan(value):
+    # NaN can't be written to the table, so missing statistics are written as NULL
+    value = float(value)
+    return(None if np.isnan(value) or np.isinf(value) else value)
+
+
+def compare_latest_project(connection_manager,main_table,avgs_table,frontend,projid,flags_table=default_flags_table,factor=1.0,max_baseline_distance=0.5):
+    """
+    Compares one receiver's latest project against the baseline and replaces that receiver's rows of the flags table with its flagged channels
+
+    param connection_manager: An object that connects to the database for the user
+    param main_table: the table containing all RFI data
+    param avgs_table: the table containing the RFI statistics (made by RFI_avgs_loader.py)
+    param frontend: the receiver, as named in latest_projects
+    param projid: its latest project
+    param flags_table: the table to write the flagged channels to
+    param factor: a channel is elevated if it is above factor times the 97.5th percentile
+    param max_baseline_distance: how far away in MHz a baseline frequency may be and still be used
+    returns summary: dictionary of the number of channels compared and the number with each flag
+    """
+    spectrum = latest_spectrum(connection_manager,main_table,projid)
+    summary = {"frontend": frontend,"projid": projid,"channels": len(spectrum["Frequency_MHz"])}
+    connection_manager.execute_command("DELETE FROM "+str(flags_table)+" WHERE frontend = \'"+str(frontend)+"\'")
+    if summary["channels"] == 0:
+        summary.update({flag: 0 for flag in flags})
+        return(summary)
+    baseline = load_baseline_range(connection_manager,avgs_table,spectrum["Frequency_MHz"].min()-max_baseline_distance,spectrum["Frequency_MHz"].max()+max_baseline_distance)
+    comparison = compare_spectrum(spectrum,baseline,factor,max_baseline_distance)
+    flagged = np.flatnonzero(comparison["flag"] != "")
+    compared_at = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    rows = []
+    for index in flagged:
+        rows.append([frontend,projid,str(comparison["mjd"][index]),str(comparison["Frequency_MHz"][index]),none_if_nan(comparison["Intensity_Jy"][index]),
+            none_if_nan(comparison["median_intensity"][index]),none_if_nan(comparison["high_percentile_intensity"][index]),none_if_nan(comparison["ratio_to_median"][index]),
+            none_if_nan(comparison["ratio_to_high_percentile"][index]),str(comparison["flag"][index]),compared_at])
+    if rows:
+        connection_manager.insert_rows(flags_table,[name for name,_ in flags_table_columns],rows)
+    summary.update({flag: int(np.count_nonzero(comparison["flag"] == flag)) for flag in flags})
+    return(summary)
+
+
+def compare_latest_projects(connection_manager,main_table,avgs_table,flags_table=default_flags_table,receivers=None,factor=1.0,max_baseline_distance=0.5):
+    """
+    Compares the latest project of every receiver (or only of the receivers given) against the baseline, writing the flagged channels to the flags table
+
+    returns summaries: list of the summary of each receiver compared, as given by compare_latest_project
+    """
+    rfitrends.schema_manager.create_or_migrate_table(connection_manager,flags_table,flags_table_columns,["frontend","mjd","Frequency_MHz"],{"idx_flag": ["flag"]})
+    summaries = []
+    for frontend,projid,_ in latest_projects(connection_manager):
+        if receivers is not None and frontend not in receivers:
+            continue
+        start = time.time()
+        summary = compare_latest_project(connection_manager,main_table,avgs_table,frontend,projid,flags_table,factor,max_baseline_distance)
+        print(str(frontend)+" ("+str(projid)+"): "+str(summary["channels"])+" channels, "+", ".join(str(summary[flag])+" "+flag for flag in flags)+" in "+str(round(time.time()-start,2))+" s")
+        summaries.append(summary)
+    return(summaries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the latest project of every receiver against the avgs baseline, and writes the new and elevated RFI to a flags table")
+    parser.add_argument("main_table",help="The table containing all RFI data (likely main_table from RFI_input_for_SQL.py)")
+    parser.add_argument("avgs_table",help="The table containing the RFI statistics (likely table_to_make from RFI_avgs_loader.py)")
+    parser.add_argument("IP_address",nargs='?',default= '192.33.116.22',help="The IP address to find the SQL database. Default is the GBO development server address. This would only work for employees.")
+    parser.add_argument("database",nargs='?',default='jskipper',help="The name of the SQL database. Default is jskipper, which would only work for employees.")
+    parser.add_argument("--flags_table",default=default_flags_table,help="The table to write the flagged channels to. Default is "+default_flags_table)
+    parser.add_argument("--receivers",nargs='+',default=None,help="Only compare these receivers (as named in latest_projects)")
+    parser.add_argument("--factor",type=float,default=1.0,help="A channel is elevated if it is above factor times the 97.5th percentile. Default is 1")
+    parser.add_argument("--max_baseline_distance",type=float,default=0.5,help="How far away in MHz the nearest avgs frequency may be. Channels with none this close are flagged new. Default is 0.5")
+    args = parser.parse_args()
+    connection_manager = rfitrends.connection_manager.connection_manager(args.IP_address,args.database)
+    compare_latest_projects(connection_manager,args.main_table,args.avgs_table,args.flags_table,args.receivers,args.factor,args.max_baseline_distance)
+
+
+if __name__ == "__main__":
+    main()
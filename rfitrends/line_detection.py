@@ -0,0 +1,373 @@
+"""
+.. module:: line_detection.py
+    :synopsis: Finds RFI lines in batches of spectra (parsed scan files or the dynamic spectra of regrid.py) against a rolling median/MAD baseline, merging adjacent channels into one record per emitter
+.. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
+Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
+"""
+
+import numpy as np
+import os
+import time
+import warnings
+import argparse
+from numpy.lib.stride_tricks import sliding_window_view
+import rfitrends.connection_manager
+import rfitrends.schema_manager
+import rfitrends.regrid
+import rfitrends.scan_spool
+import rfitrends.RFI_input_for_SQL
+
+# One emitter: a run of adjacent channels above the threshold in one spectrum. center_frequency is weighted by the intensity above
+# the baseline, width runs from the first to the last channel (plus one channel), and integrated_flux is the intensity above the
+# baseline summed over the run times the channel width, in Jy MHz
+emitter_dtype = np.dtype([("filename","U128"),("frontend","U32"),("projid","U64"),("mjd","f8"),("center_frequency","f8"),("peak_frequency","f8"),
+    ("start_frequency","f8"),("width","f4"),("peak","f4"),("peak_snr","f4"),("integrated_flux","f4"),("n_channels","i4")])
+
+default_emitters_table = "rfi_emitters"
+
+emitters_table_columns = [
+    ("filename","VARCHAR(255) NOT NULL"),
+    ("frontend","VARCHAR(64)"),
+    ("projid","VARCHAR(64)"),
+    ("mjd","DOUBLE"),
+    ("center_frequency_MHz","DOUBLE"),
+    ("peak_frequency_MHz","DOUBLE"),
+    ("start_frequency_MHz","DOUBLE NOT NULL"),
+    ("width_MHz","FLOAT"),
+    ("peak_Jy","FLOAT"),
+    ("peak_snr","FLOAT"),
+    ("integrated_flux_Jy_MHz","FLOAT"),
+    ("n_channels","INT")
+]
+
+# The MAD of normally distributed noise times this is its standard deviation
+mad_to_sigma = 1.4826
+
+default_window = 65
+default_n_sigma = 5.0
+
+# The rolling windows of a block of channels are copied to take their median, so blocks are kept to about this many values
+block_values = 1 << 22
+
+
+def rolling_baseline(spectra,window=default_window,step=None):
+    """
+    Estimates the baseline and noise of every channel from the median and MAD of the window channels around it, for a whole batch of spectra at once.
+    The ends are reflected, so the first and last channels have a full window too. NaN channels are left out of the windows they fall in.
+    The median and MAD are only taken every step channels and interpolated in between, which changes them very little since neighbouring
+    windows share most of their channels, but makes this step times faster.
+
+    param spectra: array of spectra, the last axis being the channels
+    param window: the width of the rolling window in channels, made odd if it isn't
+    param step: how many channels apart the windows are taken. Default is an eighth of the window
+    returns baseline: array of the rolling median, the shape of spectra
+    returns sigma: array of the rolling MAD scaled to a standard deviation
+    """
+    spectra = np.asarray(spectra,dtype=np.float64)
+    n_channels = spectra.shape[-1]
+    window = min(window|1,max((n_channels-1)|1,1))
+    half = window//2
+    if step is None:
+        step = max(1,window//8)
+    pad = [(0,0)]*(spectra.ndim-1)+[(half,half)]
+    padded = np.pad(spectra,pad,mode='reflect') if n_channels > 1 else spectra
+    # The channels the windows are centred on, always including the last one
+    centres = np.unique(np.append(np.arange(0,n_channels,step),n_channels-1))
+    windows = sliding_window_view(padded,window,axis=-1)
+    median = np.nanmedian if np.isnan(spectra).any() else np.median
+    sampled_baseline = np.empty(spectra.shape[:-1]+(len(centres),))
+    sampled_sigma = np.empty_like(sampled_baseline)
+    block = max(1,block_values//(window*max(1,spectra.size//max(n_channels,1))))
+    with warnings.catch_warnings():
+        # Windows that are all NaN give NaN
+        warnings.simplefilter("ignore",RuntimeWarning)
+        for start in range(0,len(centres),block):
+            stop = min(start+block,len(centres))
+            block_windows = windows[...,centres[start:stop],:]
+            block_median = median(block_windows,axis=-1)
+            sampled_baseline[...,start:stop] = block_median
+            sampled_sigma[...,start:stop] = mad_to_sigma*median(np.abs(block_windows-block_median[...,None]),axis=-1)
+    if len(centres) == n_channels:
+        return(sampled_baseline,sampled_sigma)
+    # Linear interpolation between the centres, the same for every spectrum
+    channels = np.arange(n_channels)
+    right = np.clip(np.searchsorted(centres,channels),1,len(centres)-1)
+    fraction = (channels-centres[right-1])/(centres[right]-centres[right-1])
+    def interpolate(sampled):
+        return(sampled[...,right-1]*(1.0-fraction)+sampled[...,right]*fraction)
+    return(interpolate(sampled_baseline),interpolate(sampled_sigma))
+
+
+def find_emitters(frequency,spectra,n_sigma=default_n_sigma,window=default_window,min_channels=1):
+    """
+    Finds the channels more than n_sigma above the rolling baseline in a batch of spectra sharing one set of channel frequencies, and merges
+    runs of adjacent channels into emitters. Channels either side of a gap in frequency (between IF windows) are never merged.
+
+    param frequency: sorted array of the channel frequencies in MHz
+    param spectra: array of one spectrum, or of spectra (one per row), on those channels
+    param n_sigma: how many sigma above the baseline a channel has to be
+    param window: the width of the rolling baseline window in channels
+    param min_channels: the fewest channels an emitter may have
+    returns rows: array of the row of spectra each emitter was found in
+    returns emitters: emitter_dtype array, with the header fields left empty
+    """
+    frequency = np.asarray(frequency,dtype=np.float64)
+    spectra = np.atleast_2d(np.asarray(spectra,dtype=np.float64))
+    n_channels = spectra.shape[1]
+    if n_channels < 3:
+        return(np.zeros(0,dtype=np.int64),np.zeros(0,dtype=emitter_dtype))
+    baseline,sigma = rolling_baseline(spectra,window)
+    excess = spectra-baseline
+    with np.errstate(invalid='ignore'):
+        above = excess > n_sigma*sigma
+    spacing = np.diff(frequency)
+    channel_width = float(np.median(spacing))
+    # A channel continues the run of the one before it if both are above the threshold and there is no gap between them
+    continues = np.zeros_like(above)
+    continues[:,1:] = above[:,1:] & above[:,:-1] & (spacing <= 1.5*channel_width)
+    starts = (above & ~continues).ravel()
+    positions = np.flatnonzero(above.ravel())
+    if len(positions) == 0:
+        return(np.zeros(0,dtype=np.int64),np.zeros(0,dtype=emitter_dtype))
+    run = (np.cumsum(starts)-1)[positions]
+    first = np.flatnonzero(np.diff(run,prepend=-1))
+    rows = positions[first]//n_channels
+    channel = positions%n_channels
+    channel_frequency = frequency[channel]
+    run_excess = excess.ravel()[positions]
+    with np.errstate(divide='ignore',invalid='ignore'):
+        snr = run_excess/sigma.ravel()[positions]
+    n_run_channels = np.bincount(run)
+    total_excess = np.bincount(run,weights=run_excess)
+    # The peak of each run is its first channel once sorted by run, then by intensity from the highest
+    intensity = spectra.ravel()[positions]
+    peaks = np.lexsort((-intensity,run))[first]
+    emitters = np.zeros(len(first),dtype=emitter_dtype)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        emitters["center_frequency"] = np.bincount(run,weights=run_excess*channel_frequency)/total_excess
+    emitters["peak_frequency"] = channel_frequency[peaks]
+    emitters["start_frequency"] = channel_frequency[first]
+    emitters["width"] = np.maximum.reduceat(channel_frequency,first)-channel_frequency[first]+channel_width
+    emitters["peak"] = intensity[peaks]
+    emitters["peak_snr"] = np.maximum.reduceat(snr,first)
+    emitters["integrated_flux"] = total_excess*channel_width
+    emitters["n_channels"] = n_run_channels
+    keep = n_run_channels >= min_channels
+    return(rows[keep],emitters[keep])
+
+
+def scan_emitters(scan,n_sigma=default_n_sigma,window=default_window,min_channels=1):
+    """
+    returns emitters: the emitters in the clean channels of a parsed_scan, with its header fields filled in
+    """
+    clean = ~scan.dirty
+    _,emitters = find_emitters(scan.frequency[clean],scan.intensity[clean],n_sigma,window,min_channels)
+    header = scan.header
+    emitters["filename"] = str(header.filename)
+    emitters["frontend"] = str(header.frontend)
+    emitters["projid"] = str(header.projid)
+    emitters["mjd"] = float(header.mjd) if header.mjd is not None else np.nan
+    return(emitters)
+
+
+def detect_task(filepaths,settings,spool=None):
+    """
+    Parses the files of one parse task (see RFI_input_for_SQL.parse_tasks) and finds their emitters. This runs in the detection
+    workers, so only the emitters are sent back rather than the parsed files.
+
+    returns results: a list of (filepath, its filename column or None, emitters or None, the error raised parsing it or None)
+    """
+    results = []
+    for filepath,scan,error in rfitrends.RFI_input_for_SQL.parse_task(filepaths,spool):
+        if scan is None:
+            results.append((filepath,None,None,error))
+        else:
+            results.append((filepath,str(scan.header.filename),scan_emitters(scan,**settings),None))
+    return(results)
+
+
+def detect_files(filepaths,workers=1,spool=None,**settings):
+    """
+    Finds the emitters of every scan file, with workers processes each parsing and searching whole files
+
+    param filepaths: the files, as given by RFI_input_for_SQL.gather_filepaths_to_process
+    param workers: the number of worker processes
+    param spool: optionally, a scan_spool to take parsed files from and keep them in
+    param settings: n_sigma, window and min_channels, as for find_emitters
+    yields result: (filepath, its filename column or None, emitters or None, the error raised parsing it or None) for every file
+    """
+    tasks = rfitrends.RFI_input_for_SQL.parse_tasks(filepaths)
+    if workers <= 1:
+        for task in tasks:
+            for result in detect_task(task,settings,spool):
+                yield(result)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Files are handed out several at a time, since searching one takes less time than sending it to a worker
+        for results in executor.map(detect_task,tasks,[settings]*len(tasks),[spool]*len(tasks),chunksize=8):
+            for result in results:
+                yield(result)
+
+
+def detect_rows(directory,start,stop,settings):
+    """
+    Finds the emitters in rows start to stop of the dynamic spectrum (see regrid.py) in a directory, as one batch
+
+    returns emitters: emitter_dtype array, with the header fields of each row's scan filled in
+    """
+    spectrum = rfitrends.regrid.dynamic_spectrum(directory)
+    rows,emitters = find_emitters(spectrum.frequency,spectrum.spectra[start:stop],**settings)
+    scans = spectrum.scans[start:stop][rows]
+    emitters["filename"] = scans["filename"]
+    emitters["frontend"] = spectrum.receiver
+    emitters["projid"] = scans["projid"]
+    emitters["mjd"] = scans["mjd"]
+    return(emitters)
+
+
+def detect_dynamic_spectrum(directory,workers=1,batch_rows=64,**settings):
+    """
+    Finds the emitters in every scan of a dynamic spectrum, batch_rows scans at a time, with workers processes each searching batches.
+    The workers memory-map the spectra themselves, so nothing but the emitters is sent between processes.
+
+    yields emitters: emitter_dtype array of the emitters in each batch, in order
+    """
+    n_scans = len(rfitrends.regrid.dynamic_spectrum(directory))
+    batches = [(start,min(start+batch_rows,n_scans)) for start in range(0,n_scans,batch_rows)]
+    if workers <= 1:
+        for start,stop in batches:
+            yield(detect_rows(directory,start,stop,settings))
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for emitters in executor.map(detect_rows,[directory]*len(batches),[start for start,_ in batches],[stop for _,stop in batches],[settings]*len(batches)):
+            yield(emitters)
+
+
+def emitter_rows(emitters):
+    # The rows for the emitters table, as plain python values. The peak_snr of a line on a perfectly flat baseline is infinite, and is written as NULL
+    def number(value):
+        value = float(value)
+        return(value if np.isfinite(value) else None)
+    rows = []
+    for emitter in emitters:
+        rows.append([str(emitter["filename"]),str(emitter["frontend"]),str(emitter["projid"]),number(emitter["mjd"]),float(emitter["center_frequency"]),float(emitter["peak_frequency"]),
+            float(emitter["start_frequency"]),number(emitter["width"]),number(emitter["peak"]),number(emitter["peak_snr"]),number(emitter["integrated_flux"]),int(emitter["n_channels"])])
+    return(rows)
+
+
+def store_emitters(connection_manager,table,emitters,filenames):
+    """
+    Replaces the emitters of a batch of files in the emitters table, so a file that is searched again doesn't leave its old emitters behind
+
+    param connection_manager: An object that connects to the database for the user
+    param table: the emitters table
+    param emitters: emitter_dtype array of the emitters found
+    param filenames: every file searched, including those with no emitters
+    """
+    filenames = sorted(set(str(filename) for filename in filenames))
+    for start in range(0,len(filenames),500):
+        quoted = ",".join("\'"+filename.replace("\'","\'\'")+"\'" for filename in filenames[start:start+500])
+        connection_manager.execute_command("DELETE FROM "+str(table)+" WHERE filename IN ("+quoted+")")
+    if len(emitters) > 0:
+        connection_manager.insert_rows(table,[name for name,_ in emitters_table_columns],emitter_rows(emitters))
+
+
+def create_emitters_table(connection_manager,table=default_emitters_table):
+    return(rfitrends.schema_manager.create_or_migrate_table(connection_manager,table,emitters_table_columns,["filename","start_frequency_MHz"],
+        {"idx_center_frequency": ["center_frequency_MHz"],"idx_mjd": ["mjd"]}))
+
+
+class emitter_sink():
+    """
+    Collects emitters as they are found and writes them every batch_files files, to the emitters table or, if output is given, to a .npy file at the end
+    """
+    def __init__(self,connection_manager,table=default_emitters_table,output=None,batch_files=1000):
+        self.connection_manager = connection_manager
+        self.table = table
+        self.output = output
+        self.batch_files = batch_files
+        self.pieces = []
+        self.filenames = []
+        self.saved = []
+        self.n_emitters = 0
+        if output is None:
+            create_emitters_table(connection_manager,table)
+
+    def add(self,emitters,filenames):
+        self.pieces.append(emitters)
+        self.filenames += list(filenames)
+        self.n_emitters += len(emitters)
+        if len(self.filenames) >= self.batch_files:
+            self.flush()
+
+    def flush(self):
+        emitters = np.concatenate(self.pieces) if self.pieces else np.zeros(0,dtype=emitter_dtype)
+        if self.output is None:
+            store_emitters(self.connection_manager,self.table,emitters,self.filenames)
+        else:
+            self.saved.append(emitters)
+        self.pieces = []
+        self.filenames = []
+
+    def close(self):
+        self.flush()
+        if self.output is not None:
+            np.save(self.output,np.concatenate(self.saved))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Finds RFI lines above a rolling median/MAD baseline in scan files or in a dynamic spectrum made by regrid.py, and writes one record per emitter to a table")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    files_parser = subparsers.add_parser("files",help="Search every scan file in a directory")
+    files_parser.add_argument("path",help="The path to the .txt files")
+    cube_parser = subparsers.add_parser("cube",help="Search every scan of a receiver's dynamic spectrum")
+    cube_parser.add_argument("receiver_directory",help="The receiver's directory in a cube made by regrid.py, i.e. cube/Rcvr1_2")
+    cube_parser.add_argument("--batch_rows",type=int,default=64,help="The number of scans searched together. Default is 64")
+    for subparser in (files_parser,cube_parser):
+        subparser.add_argument("IP_address",nargs='?',default= '192.33.116.22',help="The IP address to find the SQL database. Default is the GBO development server address. This would only work for employees.")
+        subparser.add_argument("database",nargs='?',default='jskipper',help="The name of the SQL database. Default is jskipper, which would only work for employees.")
+        subparser.add_argument("--table",default=default_emitters_table,help="The table to write the emitters to. Default is "+default_emitters_table)
+        subparser.add_argument("--output",default=None,help="Save the emitters to this .npy file instead of the table, without connecting to the database")
+        subparser.add_argument("--workers",type=int,default=os.cpu_count(),help="The number of processes searching at once. Default is the number of cores")
+        subparser.add_argument("--n_sigma",type=float,default=default_n_sigma,help="How many sigma above the baseline a channel has to be. Default is "+str(default_n_sigma))
+        subparser.add_argument("--window",type=int,default=default_window,help="The width of the rolling baseline window in channels. Default is "+str(default_window))
+        subparser.add_argument("--min_channels",type=int,default=1,help="The fewest channels an emitter may have. Default is 1")
+    files_parser.add_argument("--spool",action='store_true',help="Take parsed files from the local spool (see scan_spool.py), and keep them in it")
+    args = parser.parse_args()
+    settings = {"n_sigma": args.n_sigma,"window": args.window,"min_channels": args.min_channels}
+    connection_manager = None
+    if args.output is None:
+        connection_manager = rfitrends.connection_manager.connection_manager(args.IP_address,args.database)
+    sink = emitter_sink(connection_manager,args.table,args.output)
+    start = time.time()
+    if args.command == "cube":
+        scans = rfitrends.regrid.dynamic_spectrum(args.receiver_directory).scans
+        n_scans = 0
+        for emitters in detect_dynamic_spectrum(args.receiver_directory,args.workers,args.batch_rows,**settings):
+            sink.add(emitters,scans["filename"][n_scans:n_scans+args.batch_rows])
+            n_scans = min(n_scans+args.batch_rows,len(scans))
+            print("progress: "+str(n_scans)+" of "+str(len(scans))+" scans searched, "+str(sink.n_emitters)+" emitters")
+    else:
+        spool = None
+        if args.spool:
+            spool = rfitrends.scan_spool.scan_spool()
+        filepaths = rfitrends.RFI_input_for_SQL.gather_filepaths_to_process(args.path)
+        n_scans = 0
+        for filenum,(filepath,filename,emitters,error) in enumerate(detect_files(filepaths,args.workers,spool,**settings)):
+            if error is not None:
+                print("Could not parse "+str(filepath)+": "+str(error))
+                continue
+            sink.add(emitters,[filename])
+            n_scans += 1
+            if (filenum+1)%100 == 0:
+                print("progress: "+str(filenum+1)+" of "+str(len(filepaths))+" files searched, "+str(sink.n_emitters)+" emitters")
+    sink.close()
+    elapsed = time.time()-start
+    print(str(sink.n_emitters)+" emitters in "+str(n_scans)+" scans, "+str(round(elapsed,1))+" s ("+str(round(n_scans/max(elapsed,1e-9)*60))+" scans per minute)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,15 @@
 """
 ..module:: manage_missing_cols.py
-    :synopsis: Takes in a dictionary containing the data for a single line of RFI data, and fills in NaN for any columns missing data. 
+    :synopsis: Takes in a dictionary containing the data for a single line of RFI data, or a parsed_scan, and fills in NaN for any columns missing data. 
 ..moduleauthor:: JoySkipper <jskipper@nrao.edu>
 Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
 """
 
+import numpy as np
+from rfitrends.parsed_scan import parsed_scan,missing_index
+
 class manage_missing_cols: 
-    # Takes in data_entry, a dictionary containing the data for a single line of RFI data
+    # Takes in data_entry, a dictionary containing the data for a single line of RFI data, or a parsed_scan holding a whole file
     
     def __init__(self, data_entry):
         self.data_entry = data_entry
@@ -14,9 +17,14 @@ class manage_missing_cols:
         self.setcolumn("Channel")
 
     def setcolumn(self,column_name):
-        if column_name not in self.data_entry: 
+        if isinstance(self.data_entry,parsed_scan):
+            # A parsed_scan keeps missing window and channel numbers as missing_index, which is written as "NaN"
+            attribute = column_name.lower()
+            if getattr(self.data_entry,attribute) is None:
+                setattr(self.data_entry,attribute,np.full(len(self.data_entry),missing_index,dtype=np.int32))
+        elif column_name not in self.data_entry: 
             self.data_entry[column_name] = "NaN"
 
     def getdata_entry(self):
         return self.data_entry
-        
\ No newline at end of file
+        
@@ -0,0 +1,282 @@
+"""
+.. module:: occurrence_index.py
+    :synopsis: Keeps a sorted index of every scan in which a frequency bin rose above its baseline from the avgs table, so "when and where did this signal appear" is answered by binary search instead of a scan of the main table
+.. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
+Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
+"""
+
+import numpy as np
+import os
+import json
+import tempfile
+import argparse
+import rfitrends.connection_manager
+import rfitrends.data_stream
+
+# One record per (frequency bin, scan) whose peak is above the baseline. frequency is the channel the peak was in, and
+# ratio is the peak over the baseline there. filename is a code into the filenames list kept in index.json.
+occurrence_dtype = [("freq_bin",np.int64),("mjd",np.float64),("frequency",np.float64),("peak",np.float32),("ratio",np.float32),("filename",np.int32)]
+
+# The avgs statistics a baseline can be made from
+baseline_statistics = ["high_percentile_intensity","median_intensity","mean_intensity"]
+
+
+def load_baseline(connection_manager,avgs_table,statistic="high_percentile_intensity",factor=1.0):
+    """
+    Reads the per-frequency baseline from the avgs table made by RFI_avgs_loader.py. A channel is an occurrence if its intensity is above factor times the statistic.
+
+    param connection_manager: An object that connects to the database for the user
+    param avgs_table: the table containing the RFI statistics
+    param statistic: the avgs column to use, the 97.5th percentile by default
+    param factor: what to multiply the statistic by
+    returns frequency: sorted array of the avgs frequencies
+    returns threshold: array of the threshold at each frequency
+    """
+    if statistic not in baseline_statistics:
+        raise ValueError("statistic must be one of "+str(baseline_statistics))
+    chunks = rfitrends.data_stream.stream_avgs_table(connection_manager,avgs_table,columns=["Frequency",statistic])
+    data = rfitrends.data_stream.concatenate_chunks(chunks,["Frequency",statistic])
+    return(data["Frequency"],data[statistic]*factor)
+
+
+def peak_per_scan(records):
+    """
+    Keeps only the highest record of every (frequency bin, scan), sorted by frequency bin then mjd, ready for binary search
+    """
+    if len(records) == 0:
+        return(records)
+    # Highest peak first within each (bin, mjd), so the first record of each group is the one kept
+    order = np.lexsort((-records["peak"],records["mjd"],records["freq_bin"]))
+    records = records[order]
+    new_group = np.concatenate(([True],(records["freq_bin"][1:] != records["freq_bin"][:-1]) | (records["mjd"][1:] != records["mjd"][:-1])))
+    return(records[new_group])
+
+
+class occurrence_index_builder():
+    """
+    Collects occurrences chunk by chunk (from the main table, or from files as they are uploaded) and merges them into an index directory
+    """
+    def __init__(self,directory,baseline_frequency,baseline_threshold,bin_width=0.1,max_baseline_distance=0.5):
+        self.directory = directory
+        self.baseline_frequency = np.asarray(baseline_frequency,dtype=np.float64)
+        self.baseline_threshold = np.asarray(baseline_threshold,dtype=np.float64)
+        self.bin_width = bin_width
+        self.max_baseline_distance = max_baseline_distance
+        self.filenames = {}
+        self.pieces = []
+        self.rows = 0
+
+    def thresholds(self,frequency):
+        """
+        Finds the baseline threshold of the nearest avgs frequency to each channel, NaN if none is within max_baseline_distance MHz
+        """
+        nearest = rfitrends.data_stream.nearest_frequency(self.baseline_frequency,frequency,self.max_baseline_distance)
+        threshold = np.full(len(nearest),np.nan)
+        threshold[nearest >= 0] = self.baseline_threshold[nearest[nearest >= 0]]
+        return(threshold)
+
+    def add(self,frequency,intensity,mjd,filename):
+        """
+        Adds the channels above the baseline from a chunk of rows
+
+        param frequency: array of frequencies in MHz
+        param intensity: array of intensities in Jy
+        param mjd: array of the mjd of each row, or one mjd for all of them
+        param filename: array of the filename of each row, or one filename for all of them
+        returns n_occurrences: the number of channels above the baseline
+        """
+        frequency = np.asarray(frequency,dtype=np.float64)
+        intensity = np.asarray(intensity,dtype=np.float64)
+        mjd = np.broadcast_to(np.asarray(mjd,dtype=np.float64),frequency.shape)
+        filename = np.broadcast_to(np.asarray(filename,dtype=object),frequency.shape)
+        self.rows += len(frequency)
+        threshold = self.thresholds(frequency)
+        with np.errstate(invalid='ignore'):
+            above = intensity > threshold
+        if not np.any(above):
+            return(0)
+        names,inverse = np.unique(filename[above].astype(str),return_inverse=True)
+        codes = np.array([self.filenames.setdefault(name,len(self.filenames)) for name in names],dtype=np.int32)[inverse.reshape(-1)]
+        records = np.zeros(int(above.sum()),dtype=occurrence_dtype)
+        records["freq_bin"] = np.floor(frequency[above]/self.bin_width).astype(np.int64)
+        records["mjd"] = mjd[above]
+        records["frequency"] = frequency[above]
+        records["peak"] = intensity[above]
+        with np.errstate(divide='ignore',invalid='ignore'):
+            records["ratio"] = intensity[above]/threshold[above]
+        records["filename"] = codes
+        self.pieces.append(peak_per_scan(records))
+        return(len(records))
+
+    def save(self,append=True):
+        """
+        Writes the collected occurrences to the index directory, merged with what is already there if append is True
+
+        returns n_records: the number of records in the index
+        """
+        records = np.concatenate(self.pieces) if self.pieces else np.zeros(0,dtype=occurrence_dtype)
+        filenames = [name for name,_ in sorted(self.filenames.items(),key=lambda item: item[1])]
+        settings_path = os.path.join(self.directory,"index.json")
+        if append and os.path.exists(settings_path):
+            existing = occurrence_index(self.directory)
+            if existing.settings["bin_width"] != self.bin_width:
+                raise ValueError("The index in "+self.directory+" uses a bin width of "+str(existing.settings["bin_width"])+" MHz, not "+str(self.bin_width))
+            # The codes of the new records are moved past the existing filenames, reusing the existing code where a file is already in the index
+            existing_codes = {name: code for code,name in enumerate(existing.filenames)}
+            merged_filenames = list(existing.filenames)
+            remap = np.zeros(len(filenames),dtype=np.int32)
+            for code,name in enumerate(filenames):
+                if name not in existing_codes:
+                    existing_codes[name] = len(merged_filenames)
+                    merged_filenames.append(name)
+                remap[code] = existing_codes[name]
+            if len(records) > 0:
+                records["filename"] = remap[records["filename"]]
+            records = np.concatenate((np.asarray(existing.records),records))
+            filenames = merged_filenames
+        records = peak_per_scan(records)
+        os.makedirs(self.directory,exist_ok=True)
+        # Written under temporary names and renamed into place, so readers never see half an index
+        descriptor,temporary = tempfile.mkstemp(prefix=".",suffix=".npy",dir=self.directory)
+        with os.fdopen(descriptor,'wb') as f:
+            np.save(f,records)
+        os.replace(temporary,os.path.join(self.directory,"records.npy"))
+        descriptor,temporary = tempfile.mkstemp(prefix=".",suffix=".json",dir=self.directory)
+        with os.fdopen(descriptor,'w') as f:
+            json.dump({"bin_width": self.bin_width,"max_baseline_distance": self.max_baseline_distance,"filenames": filenames},f)
+        os.replace(temporary,settings_path)
+        self.pieces = []
+        self.filenames = {}
+        return(len(records))
+
+
+def open_builder(connection_manager,avgs_table,directory,bin_width=None,statistic="high_percentile_intensity",factor=1.0):
+    """
+    Makes an occurrence_index_builder with its baseline read from the avgs table, for use while uploading files.
+    If bin_width isn't given, the bin width of the index already in the directory is used (0.1 MHz for a new index).
+    """
+    if bin_width is None:
+        bin_width = 0.1
+        if os.path.exists(os.path.join(directory,"index.json")):
+            bin_width = occurrence_index(directory).bin_width
+    baseline_frequency,baseline_threshold = load_baseline(connection_manager,avgs_table,statistic,factor)
+    return(occurrence_index_builder(directory,baseline_frequency,baseline_threshold,bin_width))
+
+
+def build_occurrence_index(connection_manager,main_table,avgs_table,directory,bin_width=0.1,statistic="high_percentile_intensity",factor=1.0,where=None,append=False):
+    """
+    Builds the occurrence index from the main table in one streaming pass
+
+    param connection_manager: An object that connects to the database for the user
+    param main_table: the table containing all RFI data
+    param avgs_table: the table containing the RFI statistics, for the baseline
+    param directory: the directory to write the index to
+    param bin_width: the width of the frequency bins in MHz
+    param statistic: the avgs column the baseline is made from
+    param factor: what to multiply the statistic by to get the threshold
+    param where: optional SQL condition to index only part of the table, e.g. "mjd > 59000" to add new scans with append
+    param append: whether to merge into an existing index instead of replacing it
+    returns n_records: the number of records in the index
+    """
+    builder = open_builder(connection_manager,avgs_table,directory,bin_width,statistic,factor)
+    chunks = rfitrends.data_stream.stream_main_table(connection_manager,main_table,columns=("mjd","Frequency_MHz","Intensity_Jy","filename"),order_by=None,where=where)
+    occurrences = 0
+    for chunk in chunks:
+        occurrences += builder.add(chunk["Frequency_MHz"],chunk["Intensity_Jy"],chunk["mjd"],chunk["filename"])
+        print("progress: "+str(builder.rows)+" rows read, "+str(occurrences)+" channels above the baseline")
+    n_records = builder.save(append)
+    print("done: "+str(n_records)+" occurrences in "+directory)
+    return(n_records)
+
+
+class occurrence_index():
+    """
+    Opens an occurrence index memory-mapped, so a lookup only reads the records it returns
+    """
+    def __init__(self,directory):
+        self.directory = directory
+        with open(os.path.join(directory,"index.json")) as f:
+            self.settings = json.load(f)
+        self.filenames = self.settings["filenames"]
+        self.bin_width = self.settings["bin_width"]
+        self.records = np.load(os.path.join(directory,"records.npy"),mmap_mode='r')
+
+    def lookup(self,freq_min,freq_max,mjd_min=None,mjd_max=None,min_ratio=None):
+        """
+        Finds every scan in which a channel between freq_min and freq_max was above the baseline
+
+        param freq_min: the lowest frequency in MHz
+        param freq_max: the highest frequency in MHz
+        param mjd_min: optionally, the earliest mjd
+        param mjd_max: optionally, the latest mjd
+        param min_ratio: optionally, only occurrences at least this many times the baseline
+        returns occurrences: structured array of freq_bin, mjd, frequency, peak, ratio and filename (as text), ordered by frequency bin then mjd
+        """
+        freq_bin = self.records["freq_bin"]
+        # The records are sorted by frequency bin, so the bins asked for are one contiguous slice
+        start = int(np.searchsorted(freq_bin,int(np.floor(freq_min/self.bin_width)),side='left'))
+        stop = int(np.searchsorted(freq_bin,int(np.floor(freq_max/self.bin_width)),side='right'))
+        records = np.asarray(self.records[start:stop])
+        keep = (records["frequency"] >= freq_min) & (records["frequency"] <= freq_max)
+        if mjd_min is not None:
+            keep &= records["mjd"] >= mjd_min
+        if mjd_max is not None:
+            keep &= records["mjd"] <= mjd_max
+        if min_ratio is not None:
+            keep &= records["ratio"] >= min_ratio
+        records = records[keep]
+        occurrences = np.zeros(len(records),dtype=occurrence_dtype[:-1]+[("filename","U128")])
+        for field in occurrence_dtype[:-1]:
+            occurrences[field[0]] = records[field[0]]
+        if len(records) > 0:
+            occurrences["filename"] = np.array(self.filenames,dtype=object)[records["filename"]].astype(str)
+        return(occurrences)
+
+    def timeline(self,freq_min,freq_max,mjd_min=None,mjd_max=None,min_ratio=None):
+        """
+        Gives the scans in which anything between freq_min and freq_max was above the baseline, with the highest peak of each
+
+        returns mjd: sorted array of the scans' mjds
+        returns peak: array of the highest peak in the range for each scan
+        """
+        occurrences = self.lookup(freq_min,freq_max,mjd_min,mjd_max,min_ratio)
+        mjd,inverse = np.unique(occurrences["mjd"],return_inverse=True)
+        peak = np.full(len(mjd),-np.inf)
+        np.maximum.at(peak,inverse.reshape(-1),occurrences["peak"].astype(np.float64))
+        return(mjd,peak)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds, or looks things up in, the index of when each frequency rose above its baseline")
+    subparsers = parser.add_subparsers(dest="command",required=True)
+    build_parser = subparsers.add_parser("build",help="Build the index from the main table")
+    build_parser.add_argument("main_table",help="The table containing all RFI data (likely main_table from RFI_input_for_SQL.py)")
+    build_parser.add_argument("avgs_table",help="The table containing the RFI statistics, for the baseline (likely table_to_make from RFI_avgs_loader.py)")
+    build_parser.add_argument("directory",help="The directory to write the index to")
+    build_parser.add_argument("IP_address",nargs='?',default= '192.33.116.22',help="The IP address to find the SQL database. Default is the GBO development server address. This would only work for employees.")
+    build_parser.add_argument("database",nargs='?',default='jskipper',help="The name of the SQL database. Default is jskipper, which would only work for employees.")
+    build_parser.add_argument("--bin_width",type=float,default=0.1,help="The width of the frequency bins in MHz. Default is 0.1")
+    build_parser.add_argument("--statistic",choices=baseline_statistics,default="high_percentile_intensity",help="The avgs column the baseline is made from. Default is the 97.5th percentile")
+    build_parser.add_argument("--factor",type=float,default=1.0,help="A channel counts if it is above factor times the baseline. Default is 1")
+    build_parser.add_argument("--where",default=None,help="An SQL condition to index only part of the table, e.g. \"mjd > 59000\"")
+    build_parser.add_argument("--append",action='store_true',help="Merge into the existing index instead of replacing it")
+    lookup_parser = subparsers.add_parser("lookup",help="List the scans in which a frequency range was above the baseline")
+    lookup_parser.add_argument("directory",help="The directory of the index")
+    lookup_parser.add_argument("freq_min",type=float,help="The lowest frequency in MHz")
+    lookup_parser.add_argument("freq_max",type=float,help="The highest frequency in MHz")
+    lookup_parser.add_argument("--mjd_range",nargs=2,type=float,default=[None,None],help="Only the scans between these two mjds")
+    lookup_parser.add_argument("--min_ratio",type=float,default=None,help="Only occurrences at least this many times the baseline")
+    args = parser.parse_args()
+    if args.command == "build":
+        connection_manager = rfitrends.connection_manager.connection_manager(args.IP_address,args.database)
+        build_occurrence_index(connection_manager,args.main_table,args.avgs_table,args.directory,args.bin_width,args.statistic,args.factor,args.where,args.append)
+    else:
+        occurrences = occurrence_index(args.directory).lookup(args.freq_min,args.freq_max,args.mjd_range[0],args.mjd_range[1],args.min_ratio)
+        print(f"{'mjd':>12}{'frequency':>14}{'peak':>14}{'ratio':>10}  filename")
+        for row in occurrences:
+            print(f"{row['mjd']:>12.3f}{row['frequency']:>14.4f}{row['peak']:>14.4g}{row['ratio']:>10.2f}  {row['filename']}")
+        print(str(len(occurrences))+" occurrences")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+.. module:: parsed_scan.py
+    :synopsis: A compact in-memory form of one parsed RFI scan file: a header with typed fields and the channels as contiguous NumPy arrays
+.. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
+Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
+"""
+
+import numpy as np
+import math
+from decimal import Decimal
+
+# Frequencies are kept as whole numbers of 0.0001 MHz, the precision of the Frequency_MHz key in the tables
+frequency_scale = 10000
+
+# Stored in the window and channel arrays where a file has no such column, or where channels were averaged together
+missing_index = -1
+
+# scan_header field: (the header keys it can be read from, its type). Headers, and the header extrapolate_header makes
+# for headerless files, don't always use the same key for a value, so every known spelling is listed.
+header_fields = {
+    "filename": (["filename"],str),
+    "projid": (["projid"],str),
+    "date": (["date"],str),
+    "utc_hrs": (["utc (hrs)"],float),
+    "mjd": (["mjd"],Decimal),
+    "lst": (["lst (hrs)"],float),
+    "scan_number": (["scan_number","scan_numbers"],str),
+    "frontend": (["frontend"],str),
+    "feed": (["feed"],str),
+    "polarization": (["polarization"],str),
+    "backend": (["backend"],str),
+    "number_IF_Windows": (["number_IF_Windows"],str),
+    "exposure": (["exposure (sec)","exposure"],str),
+    "tsys": (["tsys (K)","tsys"],str),
+    "frequency_type": (["frequency_type"],str),
+    "resolution_MHz": (["frequency_resolution (MHz)"],str),
+    "source": (["source"],str),
+    "azimuth_deg": (["azimuth (deg)"],float),
+    "elevation_deg": (["elevation (deg)"],float),
+    "units": (["units","Units"],str)
+}
+
+
+class scan_header():
+    """
+    The header of one scan file. Numeric fields are floats (NaN if missing or unreadable), mjd is a Decimal as in the tables,
+    and text fields are kept as they were written, or None if missing.
+    """
+    __slots__ = list(header_fields)+["column_names","has_header"]
+
+    def __init__(self,**fields):
+        for field in self.__slots__:
+            setattr(self,field,fields.get(field))
+
+    @classmethod
+    def from_dict(cls,header_dict,has_header=True):
+        """
+        Makes a scan_header from the dictionary made by process_header or extrapolate_header
+        """
+        header = cls(column_names=list(header_dict.get("Column names",[])),has_header=has_header)
+        for field,(keys,field_type) in header_fields.items():
+            value = next((header_dict[key] for key in keys if key in header_dict),None)
+            if field_type is float:
+                try:
+                    value = float(value)
+                except (TypeError,ValueError):
+                    value = math.nan
+            elif field_type is Decimal:
+                value = None if value is None else Decimal(str(value))
+            setattr(header,field,value)
+        return(header)
+
+    def get(self,field,default=None):
+        value = getattr(self,field,default)
+        return(default if value is None else value)
+
+    def column_values(self):
+        """
+        Gives the values of the header columns of the main and dirty tables, as written by connection_manager.add_main_values.
+        Missing numbers become NULL; missing text is written as "None", as it always has been.
+        """
+        values = {}
+        for field,(_,field_type) in header_fields.items():
+            value = getattr(self,field)
+            if field_type is float:
+                values[field] = None if math.isnan(value) else value
+            else:
+                values[field] = str(value)
+        return(values)
+
+
+class parsed_scan():
+    """
+    One parsed scan file: its header plus one entry per distinct frequency in each array.
+    frequency_key is the frequency in units of 0.0001 MHz (rounded down, as the tables' key always has been), dirty marks the
+    channels that go to the dirty table, and counts is how many lines of the file were averaged into each channel.
+    nan_lines is how many lines of the file were dropped for having a NaN intensity (scan_store doesn't keep it, so scans read back have 0).
+    """
+    __slots__ = ["header","frequency_key","intensity","window","channel","counts","dirty","nan_lines"]
+
+    def __init__(self,header,frequency_key,intensity,window=None,channel=None,counts=None,dirty=None,nan_lines=0):
+        self.header = header
+        self.frequency_key = np.asarray(frequency_key,dtype=np.int64)
+        self.intensity = np.asarray(intensity,dtype=np.float64)
+        self.window = None if window is None else np.asarray(window,dtype=np.int32)
+        self.channel = None if channel is None else np.asarray(channel,dtype=np.int32)
+        self.counts = np.ones(len(self.frequency_key),dtype=np.int32) if counts is None else np.asarray(counts,dtype=np.int32)
+        self.dirty = np.zeros(len(self.frequency_key),dtype=bool) if dirty is None else np.asarray(dirty,dtype=bool)
+        self.nan_lines = int(nan_lines)
+
+    def __len__(self):
+        return(len(self.frequency_key))
+
+    @property
+    def frequency(self):
+        """
+        returns frequency: the channel frequencies in MHz
+        """
+        return(self.frequency_key/frequency_scale)
+
+    @property
+    def nbytes(self):
+        return(sum(getattr(self,name).nbytes for name in self.__slots__[1:] if isinstance(getattr(self,name),np.ndarray)))
+
+    def frequency_string(self,index):
+        """
+        returns frequency: the frequency of one channel as the exact decimal string used as the Frequency_MHz key
+        """
+        return(frequency_key_string(self.frequency_key[index]))
+
+    @classmethod
+    def from_lines(cls,header,frequency_MHz,intensity,window=None,channel=None,dirty=None,nan_lines=0):
+        """
+        Makes a parsed_scan from the columns of every valid line of a file. Lines with the same frequency key are averaged into one channel,
+        with their counts added up and their window and channel set to missing, since those no longer mean anything.
+
+        param header: the scan_header of the file
+        param frequency_MHz: array of the frequency of each line in MHz
+        param intensity: array of the intensity of each line
+        param window: optional array of the IF window of each line
+        param channel: optional array of the channel of each line
+        param dirty: optional array marking the lines that go to the dirty table
+        param nan_lines: the number of lines of the file already dropped for having a NaN intensity
+        returns scan: the parsed_scan, ordered by frequency
+        """
+        keys = frequency_keys(frequency_MHz)
+        unique_keys,first,inverse,counts = np.unique(keys,return_index=True,return_inverse=True,return_counts=True)
+        inverse = inverse.reshape(-1)
+        intensity = np.asarray(intensity,dtype=np.float64)
+        mean_intensity = np.bincount(inverse,weights=intensity,minlength=len(unique_keys))/counts
+        repeated = counts > 1
+        def first_of_each(values):
+            if values is None:
+                return(None)
+            values = np.asarray(values,dtype=np.int32)[first]
+            values[repeated] = missing_index
+            return(values)
+        dirty = None if dirty is None else np.asarray(dirty,dtype=bool)[first]
+        return(cls(header,unique_keys,mean_intensity,first_of_each(window),first_of_each(channel),counts,dirty,nan_lines))
+
+
+def frequency_keys(frequency_MHz):
+    """
+    Rounds frequencies in MHz down to whole numbers of 0.0001 MHz, giving the same keys as FrequencyVerification in RFI_input_for_SQL.py,
+    which truncates the decimal string of each frequency (str(float(value)*1000.0) for a frequency given in GHz).
+    A float's string is the shortest decimal that reads back as the same float, so it reaches a multiple of 0.0001 exactly when that
+    multiple reads back as the float. 1471.4568 is stored as 1471.45679999..., but its string is "1471.4568" and its key 14714568,
+    while 32.6842 GHz becomes 32.6842*1000.0 = 32684.199999999997 (not the float nearest 32684.2), whose string truncates to 326841999.
+    """
+    frequency_MHz = np.asarray(frequency_MHz,dtype=np.float64)
+    keys = np.floor(frequency_MHz*frequency_scale).astype(np.int64)
+    # The multiplication can land a step either side of the right key, which is the largest whose multiple of 0.0001 isn't above the float
+    keys -= keys/frequency_scale > frequency_MHz
+    keys += (keys+1)/frequency_scale <= frequency_MHz
+    return(keys)
+
+
+def frequency_key_string(key):
+    """
+    returns frequency: a frequency key as a decimal string with 4 decimals, i.e. 14714568 -> "1471.4568"
+    """
+    key = int(key)
+    sign = "-" if key < 0 else ""
+    key = abs(key)
+    return(sign+str(key//frequency_scale)+"."+str(key%frequency_scale).zfill(4))
+
+
+def index_string(value):
+    """
+    returns value: a window or channel number as the text stored in the tables, "NaN" if it is missing
+    """
+    return("NaN" if value == missing_index else str(int(value)))
@@ -0,0 +1,136 @@
+"""
+.. module:: plot_decimation.py
+    :synopsis: Reduces long spectra to about the pixel width of a plot before matplotlib draws them, keeping narrow RFI spikes visible
+.. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
+Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
+"""
+
+import numpy as np
+import rfitrends.data_stream
+
+# The decimation methods plot_decimated understands
+decimation_methods = ["minmax","lttb"]
+
+
+def visible_points(x,y,x_range=None):
+    """
+    Cuts x and y down to the points inside x_range (plus one on each side so the line still runs to the edge of the plot),
+    and drops NaN values
+
+    param x: ordered array of x values
+    param y: array of y values
+    param x_range: optional (low, high) tuple of the visible x range
+    returns x, y: the visible points
+    """
+    if x_range is not None:
+        start = max(int(np.searchsorted(x,min(x_range),side='left'))-1,0)
+        stop = min(int(np.searchsorted(x,max(x_range),side='right'))+1,len(x))
+        x = x[start:stop]
+        y = y[start:stop]
+    finite = np.isfinite(y)
+    return(x[finite],y[finite])
+
+
+def minmax_decimate(x,y,n_buckets,x_range=None):
+    """
+    Splits the x range into n_buckets equal-width buckets and keeps only the lowest and highest point of each.
+    Every spike, however narrow, is the highest point of its bucket, so it survives.
+
+    param x: ordered array of x values
+    param y: array of y values
+    param n_buckets: the number of buckets, usually the width of the plot in pixels
+    param x_range: optional (low, high) tuple; only points in this range are kept
+    returns x, y: at most 2*n_buckets points, still in order of x
+    """
+    x,y = visible_points(np.asarray(x,dtype=np.float64),np.asarray(y,dtype=np.float64),x_range)
+    if len(x) <= 2*n_buckets or x[-1] == x[0]:
+        return(x,y)
+    bucket = np.minimum(((x-x[0])/(x[-1]-x[0])*n_buckets).astype(np.int64),n_buckets-1)
+    starts = rfitrends.data_stream.group_starts(bucket)
+    ends = np.append(starts[1:],len(x))-1
+    # Sorting by bucket and then by y puts each bucket's lowest point at its start and its highest point at its end
+    order = np.lexsort((y,bucket))
+    keep = np.unique(np.concatenate((order[starts],order[ends])))
+    return(x[keep],y[keep])
+
+
+def lttb_decimate(x,y,n_points,x_range=None):
+    """
+    Largest-Triangle-Three-Buckets downsampling: keeps, from each bucket, the point making the largest triangle with the point
+    kept from the bucket before and the average of the bucket after. This follows the shape of the curve more closely than
+    minmax_decimate, but can drop a spike that sits next to a bigger one.
+
+    param x: ordered array of x values
+    param y: array of y values
+    param n_points: the number of points to keep
+    param x_range: optional (low, high) tuple; only points in this range are kept
+    returns x, y: n_points points, still in order of x
+    """
+    x,y = visible_points(np.asarray(x,dtype=np.float64),np.asarray(y,dtype=np.float64),x_range)
+    n = len(x)
+    if n <= n_points or n_points < 3:
+        return(x,y)
+    bucket_size = (n-2)/(n_points-2)
+    kept = np.empty(n_points,dtype=np.intp)
+    kept[0] = 0
+    kept[-1] = n-1
+    previous = 0
+    for bucket in range(n_points-2):
+        start = int(bucket*bucket_size)+1
+        end = int((bucket+1)*bucket_size)+1
+        next_end = min(int((bucket+2)*bucket_size)+1,n)
+        if bucket == n_points-3:
+            next_x,next_y = x[-1],y[-1]
+        else:
+            next_x,next_y = x[end:next_end].mean(),y[end:next_end].mean()
+        area = np.abs((x[previous]-next_x)*(y[start:end]-y[previous])-(x[previous]-x[start:end])*(next_y-y[previous]))
+        previous = start+int(np.argmax(area))
+        kept[bucket+1] = previous
+    return(x[kept],y[kept])
+
+
+class decimated_line():
+    """
+    A line on a matplotlib Axes drawn from a decimated copy of the data. Whenever the x limits change (i.e. zooming in, or
+    setting the limits to 600-700 MHz), the visible part of the full data is decimated again, so detail appears as you zoom.
+    """
+    def __init__(self,ax,x,y,method="minmax",**plot_kwargs):
+        if method not in decimation_methods:
+            raise ValueError("method must be one of "+str(decimation_methods))
+        x = np.asarray(x,dtype=np.float64)
+        y = np.asarray(y,dtype=np.float64)
+        if len(x) > 1 and np.any(np.diff(x) < 0):
+            order = np.argsort(x,kind='stable')
+            x,y = x[order],y[order]
+        self.ax = ax
+        self.x = x
+        self.y = y
+        self.method = method
+        self.line, = ax.plot(*self.decimate(None),**plot_kwargs)
+        ax.callbacks.connect('xlim_changed',self.update)
+
+    def pixels(self):
+        # The width of the axes on screen (or in the saved image), in pixels
+        return(max(int(self.ax.bbox.width),1))
+
+    def decimate(self,x_range):
+        if self.method == "lttb":
+            return(lttb_decimate(self.x,self.y,2*self.pixels(),x_range))
+        return(minmax_decimate(self.x,self.y,self.pixels(),x_range))
+
+    def update(self,ax):
+        self.line.set_data(*self.decimate(ax.get_xlim()))
+
+
+def plot_decimated(ax,x,y,method="minmax",**plot_kwargs):
+    """
+    Plots y against x on ax like ax.plot, but only ever draws about two points per pixel of the current x range
+
+    param ax: the matplotlib Axes to draw on
+    param x: array of x values (e.g. frequency)
+    param y: array of y values (e.g. intensity)
+    param method: "minmax" (keeps every spike) or "lttb" (follows the curve's shape)
+    param plot_kwargs: any other keyword arguments for ax.plot, such as color and label
+    returns line: the decimated_line, whose .line is the matplotlib Line2D
+    """
+    return(decimated_line(ax,x,y,method,**plot_kwargs))
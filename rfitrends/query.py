@@ -0,0 +1,301 @@
+"""
+.. module:: query.py
+    :synopsis: Typed functions for the questions most often asked of the RFI tables (a spectrum over a frequency range, the scans in an mjd range, a receiver's statistics), returning NumPy records through an in-memory and on-disk LRU cache
+.. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
+Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
+"""
+
+import numpy as np
+import os
+import json
+import hashlib
+import tempfile
+import argparse
+import collections
+import rfitrends.connection_manager
+import rfitrends.data_stream
+import rfitrends.column_cache
+from rfitrends.receiver_partitions import partition_table_name
+
+# The fields of the records each query returns
+spectrum_dtype = [("mjd",np.float64),("frontend","U32"),("Frequency_MHz",np.float64),("Intensity_Jy",np.float64)]
+scan_dtype = [("mjd",np.float64),("filename","U128"),("frontend","U32"),("projid","U64"),("n_channels",np.int64),("freq_min",np.float64),("freq_max",np.float64)]
+statistics_dtype = [(column,np.float64) for column in rfitrends.data_stream.avgs_columns]
+
+
+class query_cache():
+    """
+    A two-level least-recently-used cache of query results. Results are kept in memory up to max_memory_bytes, and saved
+    as .npy files under <cache_directory>/queries, kept under the max_cache_megabytes limit of rfitrends.conf.
+    Results are handed out read-only, since the same array goes to every caller asking the same question.
+    """
+    def __init__(self,cache_directory=None,max_bytes=None,max_memory_bytes=None):
+        settings = rfitrends.column_cache.cache_settings()
+        self.directory = os.path.join(settings["cache_directory"] if cache_directory is None else cache_directory,"queries")
+        self.max_bytes = settings["max_bytes"] if max_bytes is None else max_bytes
+        self.max_memory_bytes = settings["max_query_memory_bytes"] if max_memory_bytes is None else max_memory_bytes
+        self.memory = collections.OrderedDict()
+        self.memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def key(self,name,parameters):
+        """
+        Makes the cache key of a query from its name and parameters (which include the version of the tables it reads)
+        """
+        text = json.dumps([name,parameters],sort_keys=True,default=str)
+        return(name+"-"+hashlib.sha1(text.encode()).hexdigest()[:24])
+
+    def get(self,key):
+        """
+        returns result: the cached result for key, or None if it isn't cached
+        """
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return(self.memory[key])
+        path = os.path.join(self.directory,key+".npy")
+        if os.path.exists(path):
+            rfitrends.column_cache.touch(path)
+            result = np.load(path)
+            result.flags.writeable = False
+            self.remember(key,result)
+            self.hits += 1
+            return(result)
+        self.misses += 1
+        return(None)
+
+    def remember(self,key,result):
+        # Keeps a result in memory, dropping the least recently used ones until the rest fit
+        self.memory[key] = result
+        self.memory.move_to_end(key)
+        self.memory_bytes += result.nbytes
+        while self.memory_bytes > self.max_memory_bytes and len(self.memory) > 1:
+            _,dropped = self.memory.popitem(last=False)
+            self.memory_bytes -= dropped.nbytes
+        if self.memory_bytes > self.max_memory_bytes:
+            # A single result bigger than the whole memory budget only lives on disk
+            self.memory.clear()
+            self.memory_bytes = 0
+
+    def put(self,key,result):
+        """
+        Caches a result in memory and on disk
+
+        param key: the key from key()
+        param result: a structured array of plain (non-object) fields
+        returns result: the cached, read-only result
+        """
+        result = np.ascontiguousarray(result)
+        result.flags.writeable = False
+        self.remember(key,result)
+        os.makedirs(self.directory,exist_ok=True)
+        path = os.path.join(self.directory,key+".npy")
+        # Written under a temporary name first and renamed into place, so a half-written result is never read
+        descriptor,temporary = tempfile.mkstemp(prefix=".",suffix=".npy",dir=self.directory)
+        with os.fdopen(descriptor,'wb') as f:
+            np.save(f,result)
+        os.replace(temporary,path)
+        rfitrends.column_cache.evict_least_recently_used(self.directory,self.max_bytes,keep=(path,))
+        return(result)
+
+    def clear(self):
+        """
+        Forgets every cached result, in memory and on disk
+        """
+        self.memory.clear()
+        self.memory_bytes = 0
+        rfitrends.column_cache.remove_entry(self.directory)
+
+
+# The cache shared by every query in this process, made the first time it is needed
+shared_cache = None
+
+
+def default_cache():
+    global shared_cache
+    if shared_cache is None:
+        shared_cache = query_cache()
+    return(shared_cache)
+
+
+def table_version(connection_manager,table):
+    """
+    returns version: the fingerprint of a table (see column_cache.table_fingerprint), which changes whenever its contents do
+    """
+    return(rfitrends.column_cache.table_fingerprint(connection_manager,table))
+
+
+def cached_query(connection_manager,name,tables,parameters,run,use_cache=True,cache=None):
+    """
+    Returns the result of a query from the cache if the same query has been asked of the same version of its tables, otherwise runs it and caches it
+
+    param connection_manager: An object that connects to the database for the user
+    param name: the name of the query, i.e. "spectrum"
+    param tables: the tables the query reads, whose versions are part of the key
+    param parameters: dictionary of the query's parameters
+    param run: a function taking no arguments that runs the query, returning a structured array
+    param use_cache: whether to use the cache at all
+    param cache: the query_cache to use, the one shared by the process by default
+    returns result: the structured array
+    """
+    if not use_cache:
+        return(run())
+    if cache is None:
+        cache = default_cache()
+    key = cache.key(name,dict(parameters,versions=[table_version(connection_manager,table) for table in tables]))
+    result = cache.get(key)
+    if result is None:
+        result = cache.put(key,run())
+    return(result)
+
+
+def range_condition(column,low,high):
+    """
+    Builds the SQL condition for low <= column <= high, leaving out whichever end is None
+    """
+    conditions = []
+    if low is not None:
+        conditions.append(column+" >= "+repr(float(low)))
+    if high is not None:
+        conditions.append(column+" <= "+repr(float(high)))
+    return(conditions)
+
+
+def records_from_chunks(chunks,dtype):
+    """
+    Turns streamed chunks into one structured array with the given fields
+    """
+    columns = [field[0] for field in dtype]
+    data = rfitrends.data_stream.concatenate_chunks(chunks,columns)
+    records = np.zeros(len(data[columns[0]]),dtype=dtype)
+    for column in columns:
+        values = data[column]
+        if records.dtype[column].kind == 'U':
+            values = np.array(["" if value is None else str(value) for value in values])
+        records[column] = values
+    return(records)
+
+
+def spectrum(connection_manager,main_table,freq_min,freq_max,mjd_min=None,mjd_max=None,frontend=None,use_cache=True,cache=None):
+    """
+    Gives every channel of the main table in a frequency range (and optionally an mjd range and one frontend)
+
+    param connection_manager: An object that connects to the database for the user
+    param main_table: the table containing all RFI data
+    param freq_min: the lowest frequency in MHz
+    param freq_max: the highest frequency in MHz
+    param mjd_min: optionally, the earliest mjd
+    param mjd_max: optionally, the latest mjd
+    param frontend: optionally, only this frontend
+    param use_cache: whether to use the query cache
+    param cache: the query_cache to use, the one shared by the process by default
+    returns records: structured array with the fields of spectrum_dtype, ordered by frequency then mjd
+    """
+    def run():
+        conditions = range_condition("Frequency_MHz",freq_min,freq_max)+range_condition("mjd",mjd_min,mjd_max)
+        if frontend is not None:
+            conditions.append("frontend = \'"+frontend+"\'")
+        chunks = rfitrends.data_stream.stream_main_table(connection_manager,main_table,columns=[field[0] for field in spectrum_dtype],order_by=("Frequency_MHz","mjd"),where=" AND ".join(conditions))
+        return(records_from_chunks(chunks,spectrum_dtype))
+    parameters = {"table": main_table,"freq_min": freq_min,"freq_max": freq_max,"mjd_min": mjd_min,"mjd_max": mjd_max,"frontend": frontend}
+    return(cached_query(connection_manager,"spectrum",[main_table],parameters,run,use_cache,cache))
+
+
+def scans(connection_manager,main_table,mjd_min=None,mjd_max=None,frontend=None,use_cache=True,cache=None):
+    """
+    Lists the scans (one per mjd) in the main table in an mjd range. The grouping is done by the server, so only one row per scan comes back.
+
+    param connection_manager: An object that connects to the database for the user
+    param main_table: the table containing all RFI data
+    param mjd_min: the earliest mjd, or None for no limit
+    param mjd_max: the latest mjd, or None for no limit
+    param frontend: optionally, only this frontend
+    param use_cache: whether to use the query cache
+    param cache: the query_cache to use, the one shared by the process by default
+    returns records: structured array with the fields of scan_dtype, ordered by mjd
+    """
+    def run():
+        conditions = range_condition("mjd",mjd_min,mjd_max)
+        if frontend is not None:
+            conditions.append("frontend = \'"+frontend+"\'")
+        query = "SELECT mjd,MIN(filename),MIN(frontend),MIN(projid),COUNT(*),MIN(Frequency_MHz),MAX(Frequency_MHz) FROM "+str(main_table)
+        if conditions:
+            query += " WHERE "+" AND ".join(conditions)
+        query += " GROUP BY mjd ORDER BY mjd"
+        rows = connection_manager.execute_command(query) or []
+        records = np.zeros(len(rows),dtype=scan_dtype)
+        for index,row in enumerate(rows):
+            records[index] = tuple("" if value is None else value for value in row)
+        return(records)
+    parameters = {"table": main_table,"mjd_min": mjd_min,"mjd_max": mjd_max,"frontend": frontend}
+    return(cached_query(connection_manager,"scans",[main_table],parameters,run,use_cache,cache))
+
+
+def receiver_statistics(connection_manager,avgs_table,receiver,freq_min=None,freq_max=None,use_cache=True,cache=None):
+    """
+    Gives the statistics of one receiver from its partition made by receiver_partitions.py
+
+    param connection_manager: An object that connects to the database for the user
+    param avgs_table: the name of the avgs table for all receivers, which the partitions are named after
+    param receiver: the standardized receiver name, i.e. "Rcvr1_2"
+    param freq_min: optionally, the lowest frequency in MHz
+    param freq_max: optionally, the highest frequency in MHz
+    param use_cache: whether to use the query cache
+    param cache: the query_cache to use, the one shared by the process by default
+    returns records: structured array with the avgs columns as fields, ordered by frequency
+    """
+    partition_table = partition_table_name(avgs_table,receiver)
+    def run():
+        conditions = range_condition("Frequency",freq_min,freq_max)
+        chunks = rfitrends.data_stream.stream_avgs_table(connection_manager,partition_table,where=" AND ".join(conditions))
+        return(records_from_chunks(chunks,statistics_dtype))
+    parameters = {"table": partition_table,"freq_min": freq_min,"freq_max": freq_max}
+    return(cached_query(connection_manager,"receiver_statistics",[partition_table],parameters,run,use_cache,cache))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Asks the RFI tables for a spectrum, a list of scans or a receiver's statistics, through the local query cache")
+    parser.add_argument("--no_cache",action='store_true',help="Go straight to the database without using or filling the query cache")
+    parser.add_argument("--clear_cache",action='store_true',help="Delete every cached query result first")
+    parser.add_argument("--csv",default=None,help="A CSV file to write the result to")
+    subparsers = parser.add_subparsers(dest="query",required=True)
+    spectrum_parser = subparsers.add_parser("spectrum",help="Every channel of the main table in a frequency range")
+    spectrum_parser.add_argument("main_table",help="The table containing all RFI data (likely main_table from RFI_input_for_SQL.py)")
+    spectrum_parser.add_argument("freq_min",type=float,help="The lowest frequency in MHz")
+    spectrum_parser.add_argument("freq_max",type=float,help="The highest frequency in MHz")
+    spectrum_parser.add_argument("--mjd_range",nargs=2,type=float,default=[None,None],help="Only the scans between these two mjds")
+    spectrum_parser.add_argument("--frontend",default=None,help="Only this frontend")
+    scans_parser = subparsers.add_parser("scans",help="The scans of the main table in an mjd range")
+    scans_parser.add_argument("main_table",help="The table containing all RFI data (likely main_table from RFI_input_for_SQL.py)")
+    scans_parser.add_argument("mjd_min",type=float,help="The earliest mjd")
+    scans_parser.add_argument("mjd_max",type=float,help="The latest mjd")
+    scans_parser.add_argument("--frontend",default=None,help="Only this frontend")
+    receiver_parser = subparsers.add_parser("receiver",help="The statistics of one receiver from receiver_partitions.py")
+    receiver_parser.add_argument("avgs_table",help="The name of the avgs table the receiver partitions were made for")
+    receiver_parser.add_argument("receiver",help="The standardized receiver name, i.e. Rcvr1_2")
+    receiver_parser.add_argument("--freq_range",nargs=2,type=float,default=[None,None],help="Only the frequencies between these two, in MHz")
+    for subparser in (spectrum_parser,scans_parser,receiver_parser):
+        subparser.add_argument("IP_address",nargs='?',default= '192.33.116.22',help="The IP address to find the SQL database. Default is the GBO development server address. This would only work for employees.")
+        subparser.add_argument("database",nargs='?',default='jskipper',help="The name of the SQL database. Default is jskipper, which would only work for employees.")
+    args = parser.parse_args()
+    if args.clear_cache:
+        default_cache().clear()
+    connection_manager = rfitrends.connection_manager.connection_manager(args.IP_address,args.database)
+    use_cache = not args.no_cache
+    if args.query == "spectrum":
+        records = spectrum(connection_manager,args.main_table,args.freq_min,args.freq_max,args.mjd_range[0],args.mjd_range[1],args.frontend,use_cache)
+    elif args.query == "scans":
+        records = scans(connection_manager,args.main_table,args.mjd_min,args.mjd_max,args.frontend,use_cache)
+    else:
+        records = receiver_statistics(connection_manager,args.avgs_table,args.receiver,args.freq_range[0],args.freq_range[1],use_cache)
+    print(str(len(records))+" rows")
+    if args.csv is not None:
+        np.savetxt(args.csv,records,fmt="%s",delimiter=",",header=",".join(records.dtype.names),comments="")
+    else:
+        for row in records[:20]:
+            print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""
+.. module:: quicklook.py
+    :synopsis: Renders a small decimated PNG and a JSON summary of every scan as it is uploaded, in worker processes off the upload path, and keeps a catalog of them for browsing
+.. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
+Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
+"""
+
+import numpy as np
+import os
+import json
+import tempfile
+import argparse
+import concurrent.futures
+import rfitrends.plot_decimation
+import rfitrends.RFI_input_for_SQL
+
+# The catalog holds one JSON summary per line, appended as quicklooks are finished. A file rendered again has a later line, which wins.
+catalog_name = "catalog.jsonl"
+
+# Quicklooks are small: 800 pixels across, so the spectrum is decimated to 800 min/max buckets
+default_size = (8,3)
+default_dpi = 100
+
+# The most scans waiting to be rendered that are held in memory. Scans after that are rendered from their files once the upload is done
+default_max_pending = 32
+
+
+def coverage_segments(frequency,max_gap_factor=1.5):
+    """
+    Splits a scan's channels into the contiguous bands they cover, breaking wherever two channels are further apart than
+    max_gap_factor times the median channel spacing (between IF windows)
+
+    returns segments: list of [freq_min, freq_max] in MHz
+    """
+    if len(frequency) == 0:
+        return([])
+    if len(frequency) == 1:
+        return([[float(frequency[0]),float(frequency[0])]])
+    spacing = np.diff(frequency)
+    breaks = np.flatnonzero(spacing > max_gap_factor*np.median(spacing))
+    starts = np.concatenate(([0],breaks+1))
+    stops = np.concatenate((breaks,[len(frequency)-1]))
+    return([[float(frequency[start]),float(frequency[stop])] for start,stop in zip(starts,stops)])
+
+
+def finite_or_none(value):
+    # JSON has no NaN, so missing numbers are written as null
+    if value is None or not np.isfinite(float(value)):
+        return(None)
+    return(float(value))
+
+
+def summarize_scan(scan):
+    """
+    Makes the compact summary of a parsed_scan kept in its quicklook .json and in the catalog
+
+    returns summary: dictionary of the scan's header fields, band coverage, max and median intensity of its clean channels,
+    the number of dirty channels and the number of lines dropped while parsing for having a NaN intensity
+    """
+    header = scan.header
+    frequency = scan.frequency
+    clean = ~scan.dirty
+    intensity = scan.intensity[clean]
+    finite = np.isfinite(intensity)
+    segments = coverage_segments(frequency)
+    summary = {
+        "filename": str(header.filename),
+        "projid": str(header.projid),
+        "frontend": str(header.frontend),
+        "mjd": None if header.mjd is None else float(header.mjd),
+        "date": str(header.date),
+        "source": str(header.source),
+        "azimuth_deg": finite_or_none(header.azimuth_deg),
+        "elevation_deg": finite_or_none(header.elevation_deg),
+        "n_channels": len(scan),
+        "freq_min": float(frequency[0]) if len(scan) else None,
+        "freq_max": float(frequency[-1]) if len(scan) else None,
+        "bands": segments,
+        "covered_MHz": float(sum(stop-start for start,stop in segments)),
+        "max_intensity": None,
+        "max_frequency": None,
+        "median_intensity": None,
+        "dirty_channels": int(np.count_nonzero(scan.dirty)),
+        "nan_lines": scan.nan_lines
+    }
+    if finite.any():
+        peak = int(np.argmax(np.where(finite,intensity,-np.inf)))
+        summary["max_intensity"] = float(intensity[peak])
+        summary["max_frequency"] = float(frequency[clean][peak])
+        summary["median_intensity"] = float(np.median(intensity[finite]))
+    return(summary)
+
+
+def quicklook_paths(directory,summary):
+    """
+    returns png: the path of a scan's quicklook image, under a directory per receiver
+    returns json: the path of its summary
+    """
+    stem = os.path.splitext(summary["filename"])[0]
+    receiver_directory = os.path.join(directory,summary["frontend"].replace(" ","_"))
+    return(os.path.join(receiver_directory,stem+".png"),os.path.join(receiver_directory,stem+".json"))
+
+
+def write_atomically(path,write):
+    # Written to a temporary file and renamed into place, so a half-written quicklook is never browsed
+    descriptor,temporary = tempfile.mkstemp(prefix=".",suffix=os.path.splitext(path)[1],dir=os.path.dirname(path))
+    try:
+        with os.fdopen(descriptor,'wb') as f:
+            write(f)
+        os.replace(temporary,path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def render_quicklook(scan,directory,size=default_size,dpi=default_dpi):
+    """
+    Renders a scan's quicklook image and writes its summary. This runs in the quicklook workers.
+
+    param scan: the parsed_scan, or the path of a scan file to parse first
+    param directory: the quicklook directory
+    param size: the image size in inches
+    param dpi: the image resolution
+    returns summary: the scan's summary, with the paths of its image and summary relative to directory
+    """
+    import matplotlib
+    # Never needs a display, so quicklooks can be made on the headless upload nodes
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    if isinstance(scan,str):
+        scan = rfitrends.RFI_input_for_SQL.parse_file(scan)
+    summary = summarize_scan(scan)
+    png_path,json_path = quicklook_paths(directory,summary)
+    os.makedirs(os.path.dirname(png_path),exist_ok=True)
+
+    figure = Figure(figsize=size,dpi=dpi)
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+    n_buckets = int(size[0]*dpi)
+    frequency = scan.frequency
+    for mask,color,label in ((~scan.dirty,"tab:blue","clean"),(scan.dirty,"tab:red","dirty")):
+        if not mask.any():
+            continue
+        # Min/max decimation keeps every spike, however narrow
+        x,y = rfitrends.plot_decimation.minmax_decimate(frequency[mask],scan.intensity[mask],n_buckets)
+        ax.plot(x,y,color=color,linewidth=0.5,label=label)
+    if scan.dirty.any():
+        ax.legend(loc="upper right",fontsize="small")
+    ax.set_xlabel("Frequency (MHz)")
+    ax.set_ylabel("Intensity ("+str(scan.header.units)+")")
+    ax.set_title(summary["filename"]+" ("+summary["frontend"]+", mjd "+str(summary["mjd"])+")",fontsize="small")
+    figure.tight_layout()
+    write_atomically(png_path,lambda f: figure.savefig(f,format="png"))
+    summary["png"] = os.path.relpath(png_path,directory)
+    summary["json"] = os.path.relpath(json_path,directory)
+    write_atomically(json_path,lambda f: f.write(json.dumps(summary,indent=1).encode()))
+    return(summary)
+
+
+def lower_priority():
+    # Worker process initializer: quicklooks only get the CPU time the upload isn't using
+    try:
+        os.nice(10)
+    except (AttributeError,OSError):
+        pass
+
+
+class quicklook_pool():
+    """
+    Renders quicklooks in worker processes while files are uploaded. Unless wait_when_full is set, submit never waits: once max_pending
+    scans are waiting, later files are noted and rendered from their files by close, after the upload. The catalog is only written from this process.
+    """
+    def __init__(self,directory,workers=2,max_pending=default_max_pending,wait_when_full=False):
+        self.directory = directory
+        self.max_pending = max_pending
+        self.wait_when_full = wait_when_full
+        os.makedirs(directory,exist_ok=True)
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers,initializer=lower_priority)
+        self.pending = set()
+        self.deferred = []
+        self.rendered = 0
+        self.failed = 0
+
+    def submit(self,filepath,scan):
+        """
+        Queues a parsed file for a quicklook
+
+        param filepath: the path to the scan file, used to parse it again if it has to wait until close
+        param scan: its parsed_scan
+        """
+        self.collect()
+        if len(self.pending) >= self.max_pending and self.wait_when_full:
+            concurrent.futures.wait(self.pending,return_when=concurrent.futures.FIRST_COMPLETED)
+            self.collect()
+        if len(self.pending) >= self.max_pending:
+            self.deferred.append(filepath)
+            return
+        self.pending.add(self.executor.submit(render_quicklook,scan,self.directory))
+
+    def collect(self,wait=False):
+        """
+        Adds the finished quicklooks to the catalog
+
+        param wait: whether to wait for every pending quicklook to finish
+        """
+        if wait:
+            finished,_ = concurrent.futures.wait(self.pending)
+        else:
+            finished = [future for future in self.pending if future.done()]
+        if not finished:
+            return
+        entries = []
+        for future in finished:
+            self.pending.discard(future)
+            try:
+                entries.append(future.result())
+            except Exception as error:
+                # A quicklook that can't be made never stops the upload
+                print("Could not make a quicklook: "+str(error))
+                self.failed += 1
+        with open(os.path.join(self.directory,catalog_name),'a') as f:
+            for entry in entries:
+                f.write(json.dumps(entry)+"\n")
+        self.rendered += len(entries)
+
+    def close(self):
+        """
+        Renders the deferred files, waits for every quicklook to finish and shuts the workers down
+        """
+        for filepath in self.deferred:
+            self.pending.add(self.executor.submit(render_quicklook,filepath,self.directory))
+        self.deferred = []
+        self.collect(wait=True)
+        self.executor.shutdown()
+        print(str(self.rendered)+" quicklooks made in "+self.directory+(", "+str(self.failed)+" failed" if self.failed else ""))
+
+
+def load_catalog(directory):
+    """
+    returns entries: the latest catalog entry of every file in a quicklook directory, in the order they were first made
+    """
+    entries = {}
+    path = os.path.join(directory,catalog_name)
+    if not os.path.exists(path):
+        return([])
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            entries[entry["filename"]] = entry
+    return(list(entries.values()))
+
+
+def browse(directory,frontend=None,mjd_range=None,freq=None,min_intensity=None):
+    """
+    Picks catalog entries without opening any images
+
+    param frontend: only scans of this receiver
+    param mjd_range: (mjd_min, mjd_max) of the scans
+    param freq: only scans covering this frequency (MHz)
+    param min_intensity: only scans whose highest clean channel is at least this
+    returns entries: the matching catalog entries, by mjd
+    """
+    entries = []
+    for entry in load_catalog(directory):
+        if frontend is not None and entry["frontend"] != frontend:
+            continue
+        if mjd_range is not None and (entry["mjd"] is None or not mjd_range[0] <= entry["mjd"] <= mjd_range[1]):
+            continue
+        if freq is not None and not any(start <= freq <= stop for start,stop in entry["bands"]):
+            continue
+        if min_intensity is not None and (entry["max_intensity"] is None or entry["max_intensity"] < min_intensity):
+            continue
+        entries.append(entry)
+    return(sorted(entries,key=lambda entry: -np.inf if entry["mjd"] is None else entry["mjd"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Makes quicklook images and summaries of RFI scan files, or browses the catalog of those already made. RFI_input_for_SQL.py --quicklook makes them while uploading.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    make_parser = subparsers.add_parser("make",help="Make the quicklooks of every scan file in a directory")
+    make_parser.add_argument("path",help="The path to the .txt files")
+    make_parser.add_argument("quicklook_directory",help="The directory to write the quicklooks and catalog to")
+    make_parser.add_argument("--workers",type=int,default=2,help="The number of processes rendering at once. Default is 2")
+    make_parser.add_argument("--parse_workers",type=int,default=1,help="The number of processes parsing files at once")
+    browse_parser = subparsers.add_parser("browse",help="List the catalog entries matching some conditions")
+    browse_parser.add_argument("quicklook_directory",help="The directory holding the quicklooks and catalog")
+    browse_parser.add_argument("--frontend",default=None,help="Only scans of this receiver")
+    browse_parser.add_argument("--mjd_range",type=float,nargs=2,default=None,help="Only scans between these two mjds")
+    browse_parser.add_argument("--freq",type=float,default=None,help="Only scans covering this frequency (MHz)")
+    browse_parser.add_argument("--min_intensity",type=float,default=None,help="Only scans whose highest clean channel is at least this")
+    args = parser.parse_args()
+    if args.command == "browse":
+        entries = browse(args.quicklook_directory,args.frontend,args.mjd_range,args.freq,args.min_intensity)
+        for entry in entries:
+            print(str(entry["mjd"])+"  "+entry["frontend"]+"  "+entry["filename"]+"  max "+str(entry["max_intensity"])+" at "+str(entry["max_frequency"])+" MHz  "+os.path.join(args.quicklook_directory,entry["png"]))
+        print(str(len(entries))+" scans")
+        return
+    filepaths = rfitrends.RFI_input_for_SQL.gather_filepaths_to_process(args.path)
+    # Nothing is being uploaded, so parsing waits for the renderers rather than parsing files twice
+    pool = quicklook_pool(args.quicklook_directory,args.workers,max_pending=2*args.workers,wait_when_full=True)
+    for filepath,scan,error in rfitrends.RFI_input_for_SQL.parse_files(filepaths,args.parse_workers):
+        if error is not None:
+            print("Could not parse "+str(filepath)+": "+str(error))
+            continue
+        pool.submit(filepath,scan)
+    pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+.. module:: receiver_partitions.py
+    :synopsis: Calculates the avgs statistics separately for every standardized GBT receiver, in parallel, and indexes which receivers cover which frequencies
+.. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
+Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
+"""
+
+import re
+import argparse
+import concurrent.futures
+import rfitrends.connection_manager
+import rfitrends.data_stream
+import rfitrends.GBT_receiver_specs
+from rfitrends.RFI_avgs_loader import calculate_avgs_load_into_database
+
+
+def standard_receivers(connection_manager=None,table_to_read=None):
+    """
+    Lists the receivers to make partitions for: the standardized receiver names from frontend_aliases, and every name actually
+    stored in the frontend column of table_to_read if it is given, since inferred frontends (see GBT_receiver_specs.choose_frontend)
+    can be names such as "Kband All" that aren't aliases of anything
+
+    param connection_manager: An object that connects to the database for the user
+    param table_to_read: optionally, the main table whose frontends are added
+    returns receivers: the sorted receiver names
+    """
+    receivers = set(rfitrends.GBT_receiver_specs.frontend_aliases.values())
+    if table_to_read is not None:
+        result = connection_manager.execute_command("SELECT DISTINCT frontend FROM "+str(table_to_read))
+        receivers.update(row[0] for row in result if row[0] is not None)
+    return(sorted(receivers))
+
+
+def partition_table_name(avgs_table,receiver):
+    """
+    Gives the name of the avgs partition for a receiver, i.e. RFI_avgs_Prime_Focus_1 for "Prime Focus 1"
+
+    param avgs_table: the name of the avgs table for all receivers
+    param receiver: the standardized receiver name
+    returns table: the partition table name
+    """
+    return(str(avgs_table)+"_"+re.sub("[^0-9A-Za-z_]","_",receiver))
+
+
+def index_table_name(avgs_table):
+    """
+    Gives the name of the table recording which receiver partitions cover which frequencies
+    """
+    return(str(avgs_table)+"_receiver_index")
+
+
+def build_receiver_partition(connection_manager,table_to_read,avgs_table,receiver):
+    """
+    Calculates the statistics of one receiver's rows of the main table into that receiver's partition.
+    This runs in a worker process, so it only takes things that can be pickled.
+
+    param connection_manager: An object that connects to the database for the user
+    param table_to_read: the main table from which we calculate statistics
+    param avgs_table: the name of the avgs table for all receivers
+    param receiver: the standardized receiver name
+    returns index_row: [receiver, partition table, data freq_min, data freq_max, spec freq_min, spec freq_max, number of frequencies],
+    or None if the receiver has no data
+    """
+    partition_table = partition_table_name(avgs_table,receiver)
+    connection_manager.execute_command("DROP TABLE IF EXISTS "+partition_table)
+    connection_manager.avgs_table_maker(partition_table)
+    n_frequencies = calculate_avgs_load_into_database(connection_manager,table_to_read,partition_table,where="frontend = \'"+receiver+"\'")
+    if n_frequencies == 0:
+        connection_manager.drop_table(partition_table)
+        return(None)
+    freq_min,freq_max = connection_manager.execute_command("SELECT MIN(Frequency),MAX(Frequency) FROM "+partition_table)[0]
+    receiver_range = rfitrends.GBT_receiver_specs.GBT_receiver_ranges.get(receiver,{'freq_min': None,'freq_max': None})
+    index_row = [receiver,partition_table,float(freq_min),float(freq_max),receiver_range['freq_min'],receiver_range['freq_max'],n_frequencies]
+    return(index_row)
+
+
+def build_receiver_partitions(connection_manager,table_to_read,avgs_table,receivers=None,workers=4):
+    """
+    Builds an avgs partition for every receiver at the same time, then rewrites the receiver index table
+
+    param connection_manager: An object that connects to the database for the user
+    param table_to_read: the main table from which we calculate statistics
+    param avgs_table: the name of the avgs table for all receivers, used as the prefix for the partitions
+    param receivers: the receivers to build, by default all of the standardized receivers and every frontend in table_to_read
+    param workers: how many receivers to process at once
+    returns index_rows: the rows written to the index table
+    """
+    if receivers is None:
+        receivers = standard_receivers(connection_manager,table_to_read)
+    index_table = index_table_name(avgs_table)
+    connection_manager.execute_command("CREATE TABLE IF NOT EXISTS "+index_table+" (frontend VARCHAR(64), partition_table VARCHAR(128), freq_min Decimal(12,6), freq_max Decimal(12,6), spec_freq_min DOUBLE, spec_freq_max DOUBLE, n_frequencies INT, PRIMARY KEY (frontend), INDEX (freq_min,freq_max));")
+    index_rows = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(build_receiver_partition,connection_manager,table_to_read,avgs_table,receiver): receiver for receiver in receivers}
+        for future in concurrent.futures.as_completed(futures):
+            receiver = futures[future]
+            index_row = future.result()
+            # Each receiver's index row is replaced as soon as its partition is done
+            connection_manager.execute_command("DELETE FROM "+index_table+" WHERE frontend = \'"+receiver+"\'")
+            if index_row is None:
+                print("No data for receiver "+receiver+", no partition made.")
+                continue
+            connection_manager.insert_rows(index_table,["frontend","partition_table","freq_min","freq_max","spec_freq_min","spec_freq_max","n_frequencies"],[index_row])
+            index_rows.append(index_row)
+            print("Partition for "+receiver+" done: "+str(index_row[6])+" frequencies from "+str(index_row[2])+" to "+str(index_row[3])+" MHz")
+    return(index_rows)
+
+
+def partitions_for_range(connection_manager,avgs_table,freq_min,freq_max):
+    """
+    Looks up which receiver partitions have data between freq_min and freq_max
+
+    param connection_manager: An object that connects to the database for the user
+    param avgs_table: the name of the avgs table for all receivers
+    param freq_min: the lowest frequency of the range in MHz
+    param freq_max: the highest frequency of the range in MHz
+    returns partitions: list of (receiver, partition table) pairs
+    """
+    result = connection_manager.execute_command("SELECT frontend,partition_table FROM "+index_table_name(avgs_table)+" WHERE freq_min <= "+repr(float(freq_max))+" AND freq_max >= "+repr(float(freq_min))+" ORDER BY freq_min")
+    return([(row[0],row[1]) for row in result])
+
+
+def read_band(connection_manager,avgs_table,freq_min,freq_max,receivers=None):
+    """
+    Reads the statistics of a frequency range from only the partitions that cover it
+
+    param connection_manager: An object that connects to the database for the user
+    param avgs_table: the name of the avgs table for all receivers
+    param freq_min: the lowest frequency of the range in MHz
+    param freq_max: the highest frequency of the range in MHz
+    param receivers: optionally, only read these receivers
+    returns band: dictionary of receiver to a dictionary of avgs column arrays
+    """
+    band = {}
+    where = "Frequency BETWEEN "+repr(float(freq_min))+" AND "+repr(float(freq_max))
+    for receiver,partition_table in partitions_for_range(connection_manager,avgs_table,freq_min,freq_max):
+        if receivers is not None and receiver not in receivers:
+            continue
+        chunks = rfitrends.data_stream.stream_avgs_table(connection_manager,partition_table,where=where)
+        band[receiver] = rfitrends.data_stream.concatenate_chunks(chunks,rfitrends.data_stream.avgs_columns)
+    return(band)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calculates the RFI statistics separately for each receiver, in parallel")
+    parser.add_argument("table_to_read",help="The table from which you want to calculate statistics (likely main_table from RFI_input_for_SQL.py)")
+    parser.add_argument("avgs_table",help="The name of the avgs table. Each receiver's partition is named after it, i.e. <avgs_table>_Rcvr1_2")
+    parser.add_argument("IP_address",nargs='?',default= '192.33.116.22',help="The IP address to find the SQL database. Default is the GBO development server address. This would only work for employees.")
+    parser.add_argument("database",nargs='?',default='jskipper',help="The name of the SQL database. Default is jskipper, which would only work for employees.")
+    parser.add_argument("--receivers",nargs='+',default=None,help="Only build these receivers. Default is every standardized receiver in GBT_receiver_specs.py and every frontend in table_to_read")
+    parser.add_argument("--workers",type=int,default=4,help="How many receivers to process at once. Default is 4")
+    args = parser.parse_args()
+    connection_manager = rfitrends.connection_manager.connection_manager(args.IP_address,args.database)
+    build_receiver_partitions(connection_manager,args.table_to_read,args.avgs_table,args.receivers,args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+"""
+.. module:: regrid.py
+    :synopsis: Resamples parsed scans onto a fixed frequency grid per receiver and appends them as rows of a memory-mapped scan x channel array (a dynamic spectrum), with the scans' mjd, lst, az/el and projid alongside
+.. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
+Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
+"""
+
+import numpy as np
+import os
+import json
+import tempfile
+import warnings
+import argparse
+import rfitrends.GBT_receiver_specs
+import rfitrends.time_cube
+import rfitrends.RFI_input_for_SQL
+import rfitrends.scan_spool
+
+# The metadata kept for every row of a dynamic spectrum, in scans.npy
+scan_dtype = np.dtype([("mjd","f8"),("lst","f8"),("azimuth_deg","f8"),("elevation_deg","f8"),("projid","U64"),("filename","U128"),("channels_filled","i4")])
+
+# The spectra are float32, which keeps about 7 significant figures and halves the size of the cube
+spectrum_dtype = np.dtype("<f4")
+
+default_channel_width = 0.1
+
+# A receiver's pending rows are written out once they take up this much memory
+default_flush_bytes = 256*1024*1024
+
+
+def receiver_directory_name(receiver):
+    # Some receiver names have spaces in them ("Prime Focus 1")
+    return(str(receiver).replace(" ","_"))
+
+
+def frequency_grid(receiver,channel_width=default_channel_width):
+    """
+    returns edges: the channel edges of a receiver's grid in MHz, covering its range in GBT_receiver_specs.GBT_receiver_ranges
+    """
+    receiver_range = rfitrends.GBT_receiver_specs.GBT_receiver_ranges.get(receiver,rfitrends.GBT_receiver_specs.GBT_receiver_ranges['Unknown'])
+    return(np.arange(receiver_range['freq_min'],receiver_range['freq_max']+channel_width/2.0,channel_width))
+
+
+def regrid(frequency,intensity,edges,max_gap=None):
+    """
+    Resamples a spectrum onto a grid. Grid channels holding one or more of the spectrum's channels get their mean, and empty grid channels
+    between two of the spectrum's channels (where the spectrum is coarser than the grid) are linearly interpolated, unless the two are
+    more than max_gap apart, so gaps between IF windows stay empty.
+
+    param frequency: sorted array of the spectrum's frequencies in MHz
+    param intensity: array of the spectrum's intensities
+    param edges: the grid's channel edges in MHz, evenly spaced
+    param max_gap: the widest gap in MHz to interpolate across. Default is twice the larger of the grid's channel width and the spectrum's median channel spacing
+    returns spectrum: float32 array with one value per grid channel, NaN where the spectrum has no data
+    """
+    frequency = np.asarray(frequency,dtype=np.float64)
+    intensity = np.asarray(intensity,dtype=np.float64)
+    finite = np.isfinite(frequency) & np.isfinite(intensity)
+    frequency = frequency[finite]
+    intensity = intensity[finite]
+    n_channels = len(edges)-1
+    width = edges[1]-edges[0]
+    spectrum = np.full(n_channels,np.nan,dtype=spectrum_dtype)
+    index = np.floor((frequency-edges[0])/width).astype(np.int64)
+    inside = (index >= 0) & (index < n_channels)
+    counts = np.bincount(index[inside],minlength=n_channels)
+    sums = np.bincount(index[inside],weights=intensity[inside],minlength=n_channels)
+    filled = counts > 0
+    spectrum[filled] = sums[filled]/counts[filled]
+    if len(frequency) < 2:
+        return(spectrum)
+    if max_gap is None:
+        max_gap = 2.0*max(width,float(np.median(np.diff(frequency))))
+    centres = edges[:-1]+width/2.0
+    empty = np.flatnonzero(~filled & (centres > frequency[0]) & (centres < frequency[-1]))
+    right = np.clip(np.searchsorted(frequency,centres[empty]),1,len(frequency)-1)
+    close = frequency[right]-frequency[right-1] <= max_gap
+    spectrum[empty[close]] = np.interp(centres[empty[close]],frequency,intensity)
+    return(spectrum)
+
+
+def scan_metadata(header,channels_filled):
+    """
+    returns metadata: the scan_dtype record of a scan's header
+    """
+    metadata = np.zeros(1,dtype=scan_dtype)
+    metadata["mjd"] = float(header.mjd) if header.mjd is not None else np.nan
+    metadata["lst"] = header.lst
+    metadata["azimuth_deg"] = header.azimuth_deg
+    metadata["elevation_deg"] = header.elevation_deg
+    metadata["projid"] = str(header.projid)
+    metadata["filename"] = str(header.filename)
+    metadata["channels_filled"] = channels_filled
+    return(metadata)
+
+
+class dynamic_spectrum_writer():
+    """
+    Regrids scans as they are parsed and appends them to the dynamic spectrum of their receiver in a cube directory, one subdirectory per receiver.
+    A file already in a receiver's dynamic spectrum is skipped. Rows are kept in memory until flush, and scans.npy is only replaced once
+    the rows it describes are on disk, so an interrupted append leaves the dynamic spectrum as it was.
+    """
+    def __init__(self,directory,channel_width=default_channel_width,flush_bytes=default_flush_bytes):
+        self.directory = directory
+        self.channel_width = channel_width
+        self.flush_bytes = flush_bytes
+        self.grids = {}
+        self.filenames = {}
+        self.pending = {}
+
+    def receiver_path(self,receiver):
+        return(os.path.join(self.directory,receiver_directory_name(receiver)))
+
+    def grid(self,receiver):
+        """
+        returns edges: the grid of a receiver, as already written in its grid.json, or made with channel_width for a new one
+        """
+        if receiver not in self.grids:
+            grid_path = os.path.join(self.receiver_path(receiver),"grid.json")
+            if os.path.exists(grid_path):
+                existing = dynamic_spectrum(self.receiver_path(receiver))
+                self.grids[receiver] = existing.edges
+                self.filenames[receiver] = set(existing.scans["filename"].tolist())
+            else:
+                self.grids[receiver] = frequency_grid(receiver,self.channel_width)
+                self.filenames[receiver] = set()
+        return(self.grids[receiver])
+
+    def add(self,scan):
+        """
+        Regrids the clean channels of a parsed_scan onto its receiver's grid and adds it to the rows to append
+
+        returns added: False if the file is already in the dynamic spectrum
+        """
+        receiver = scan.header.frontend if scan.header.frontend in rfitrends.GBT_receiver_specs.GBT_receiver_ranges else 'Unknown'
+        edges = self.grid(receiver)
+        filename = str(scan.header.filename)
+        if filename in self.filenames[receiver]:
+            return(False)
+        clean = ~scan.dirty
+        spectrum = regrid(scan.frequency[clean],scan.intensity[clean],edges)
+        rows,metadata = self.pending.setdefault(receiver,([],[]))
+        rows.append(spectrum)
+        metadata.append(scan_metadata(scan.header,int(np.count_nonzero(np.isfinite(spectrum)))))
+        self.filenames[receiver].add(filename)
+        if len(rows)*spectrum.nbytes >= self.flush_bytes:
+            self.flush(receiver)
+        return(True)
+
+    def flush(self,receiver=None):
+        """
+        Appends the pending rows of one receiver (or of every receiver) to their dynamic spectra
+
+        returns n_scans: dictionary of each receiver written to the number of scans now in its dynamic spectrum
+        """
+        n_scans = {}
+        for name in ([receiver] if receiver is not None else list(self.pending)):
+            rows,metadata = self.pending.pop(name,([],[]))
+            if not rows:
+                continue
+            path = self.receiver_path(name)
+            os.makedirs(path,exist_ok=True)
+            edges = self.grids[name]
+            grid_path = os.path.join(path,"grid.json")
+            scans_path = os.path.join(path,"scans.npy")
+            if not os.path.exists(grid_path):
+                with open(grid_path,'w') as f:
+                    json.dump({"receiver": name,"freq_min": float(edges[0]),"channel_width": round(float(edges[1]-edges[0]),9),"n_channels": len(edges)-1},f)
+            existing = np.load(scans_path) if os.path.exists(scans_path) else np.zeros(0,dtype=scan_dtype)
+            row_bytes = (len(edges)-1)*spectrum_dtype.itemsize
+            spectra_path = os.path.join(path,"spectra.dat")
+            with open(spectra_path,'ab') as f:
+                # Rows written after the last scans.npy (by an append that was interrupted) are dropped before appending
+                f.truncate(len(existing)*row_bytes)
+                f.seek(len(existing)*row_bytes)
+                f.write(np.stack(rows).astype(spectrum_dtype,copy=False).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            scans = np.concatenate([existing]+metadata)
+            descriptor,temporary = tempfile.mkstemp(prefix=".",suffix=".npy",dir=path)
+            with os.fdopen(descriptor,'wb') as f:
+                np.save(f,scans)
+            os.replace(temporary,scans_path)
+            n_scans[name] = len(scans)
+        return(n_scans)
+
+
+class dynamic_spectrum():
+    """
+    The dynamic spectrum of one receiver, opened read-only: spectra is a memory-mapped (scan x channel) float32 array, NaN where a scan has
+    no data, and scans holds the mjd, lst, azimuth_deg, elevation_deg, projid and filename of each row
+    """
+    def __init__(self,directory):
+        self.directory = directory
+        with open(os.path.join(directory,"grid.json")) as f:
+            self.grid = json.load(f)
+        self.receiver = self.grid["receiver"]
+        self.channel_width = self.grid["channel_width"]
+        self.edges = self.grid["freq_min"]+self.channel_width*np.arange(self.grid["n_channels"]+1)
+        self.frequency = self.edges[:-1]+self.channel_width/2.0
+        scans_path = os.path.join(directory,"scans.npy")
+        self.scans = np.load(scans_path) if os.path.exists(scans_path) else np.zeros(0,dtype=scan_dtype)
+        shape = (len(self.scans),self.grid["n_channels"])
+        if len(self.scans) == 0:
+            self.spectra = np.zeros(shape,dtype=spectrum_dtype)
+        else:
+            self.spectra = np.memmap(os.path.join(directory,"spectra.dat"),dtype=spectrum_dtype,mode='r',shape=shape)
+
+    def __len__(self):
+        return(len(self.scans))
+
+    def channels(self,freq_min=None,freq_max=None):
+        """
+        returns channels: a slice of the grid channels that overlap freq_min to freq_max (MHz)
+        """
+        return(rfitrends.time_cube.edges_to_slice(self.edges,freq_min,freq_max))
+
+    def rows(self,mjd_min=None,mjd_max=None,projid=None):
+        """
+        returns rows: the indices of the scans within an mjd range and, optionally, of one project, in the order they were added
+        """
+        keep = np.ones(len(self.scans),dtype=bool)
+        if mjd_min is not None:
+            keep &= self.scans["mjd"] >= mjd_min
+        if mjd_max is not None:
+            keep &= self.scans["mjd"] <= mjd_max
+        if projid is not None:
+            keep &= self.scans["projid"] == projid
+        return(np.flatnonzero(keep))
+
+    def reduce(self,function,freq_min=None,freq_max=None,rows=None,block_channels=4096):
+        """
+        Applies a NaN-ignoring reduction such as np.nanmedian over the scans of every channel, reading block_channels channels at a time so a whole-archive median never needs the whole array in memory
+
+        returns frequency: the centre of each channel in MHz
+        returns values: the reduction of each channel, NaN for channels no scan covers
+        """
+        channels = self.channels(freq_min,freq_max)
+        rows = np.arange(len(self.scans)) if rows is None else np.asarray(rows)
+        values = np.full(channels.stop-channels.start,np.nan)
+        if len(rows) == 0:
+            return(self.frequency[channels],values)
+        for start in range(channels.start,channels.stop,block_channels):
+            stop = min(start+block_channels,channels.stop)
+            block = np.asarray(self.spectra[rows,start:stop],dtype=np.float64)
+            with warnings.catch_warnings():
+                # Channels no scan covers are all NaN, and are left as NaN
+                warnings.simplefilter("ignore",RuntimeWarning)
+                values[start-channels.start:stop-channels.start] = function(block,axis=0)
+        return(self.frequency[channels],values)
+
+    def median_spectrum(self,freq_min=None,freq_max=None,rows=None):
+        return(self.reduce(np.nanmedian,freq_min,freq_max,rows))
+
+    def mean_spectrum(self,freq_min=None,freq_max=None,rows=None):
+        return(self.reduce(np.nanmean,freq_min,freq_max,rows))
+
+    def channel_series(self,frequency,rows=None):
+        """
+        returns mjd: the mjd of every scan
+        returns values: the intensity of every scan in the grid channel holding frequency (MHz)
+        """
+        channel = int(np.clip(np.floor((frequency-self.edges[0])/self.channel_width),0,len(self.frequency)-1))
+        rows = np.arange(len(self.scans)) if rows is None else np.asarray(rows)
+        return(self.scans["mjd"][rows],np.asarray(self.spectra[rows,channel],dtype=np.float64))
+
+    def correlation(self,frequency_a,frequency_b,rows=None):
+        """
+        returns correlation: the Pearson correlation over the scans of two channels, using only the scans with data in both, or NaN if there are fewer than 3
+        """
+        _,a = self.channel_series(frequency_a,rows)
+        _,b = self.channel_series(frequency_b,rows)
+        both = np.isfinite(a) & np.isfinite(b)
+        if np.count_nonzero(both) < 3:
+            return(np.nan)
+        return(float(np.corrcoef(a[both],b[both])[0,1]))
+
+
+def receivers(directory):
+    """
+    returns receivers: dictionary of each receiver with a dynamic spectrum in a cube directory to its directory
+    """
+    found = {}
+    if not os.path.isdir(directory):
+        return(found)
+    for name in sorted(os.listdir(directory)):
+        grid_path = os.path.join(directory,name,"grid.json")
+        if os.path.exists(grid_path):
+            with open(grid_path) as f:
+                found[json.load(f)["receiver"]] = os.path.join(directory,name)
+    return(found)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regrids RFI scan files onto a fixed frequency grid per receiver and appends them to memory-mapped dynamic spectra (scan x channel arrays)")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    build_parser = subparsers.add_parser("build",help="Regrid every scan file in a directory and append it to the cube (files already in it are skipped)")
+    build_parser.add_argument("path",help="The path to the .txt files")
+    build_parser.add_argument("cube_directory",help="The directory holding a dynamic spectrum per receiver")
+    build_parser.add_argument("--channel_width",type=float,default=default_channel_width,help="The channel width in MHz of the grid of receivers new to the cube. Default is "+str(default_channel_width))
+    build_parser.add_argument("--parse_workers",type=int,default=1,help="The number of processes parsing files at once")
+    build_parser.add_argument("--spool",action='store_true',help="Take parsed files from the local spool (see scan_spool.py), and keep them in it")
+    info_parser = subparsers.add_parser("info",help="Print the receivers, grids and number of scans of a cube")
+    info_parser.add_argument("cube_directory",help="The directory holding a dynamic spectrum per receiver")
+    args = parser.parse_args()
+    if args.command == "info":
+        for receiver,path in receivers(args.cube_directory).items():
+            spectrum = dynamic_spectrum(path)
+            print(str(receiver)+": "+str(len(spectrum))+" scans x "+str(len(spectrum.frequency))+" channels of "+str(spectrum.channel_width)+" MHz from "+str(spectrum.edges[0])+" to "+str(round(spectrum.edges[-1],6))+" MHz")
+        return
+    spool = None
+    if args.spool:
+        spool = rfitrends.scan_spool.scan_spool()
+    writer = dynamic_spectrum_writer(args.cube_directory,args.channel_width)
+    filepaths = rfitrends.RFI_input_for_SQL.gather_filepaths_to_process(args.path)
+    for filenum,(filepath,scan,error) in enumerate(rfitrends.RFI_input_for_SQL.parse_files(filepaths,args.parse_workers,spool)):
+        print("Regridding file "+str(filenum+1)+" of "+str(len(filepaths))+": "+str(filepath))
+        if error is not None:
+            print("Could not parse this file: "+str(error))
+            continue
+        if not writer.add(scan):
+            print("Already in the cube, moving on to the next file.")
+    for receiver,n_scans in writer.flush().items():
+        print(str(receiver)+": "+str(n_scans)+" scans")
+
+
+if __name__ == "__main__":
+    main()
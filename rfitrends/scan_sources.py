@@ -0,0 +1,167 @@
+"""
+.. module:: scan_sources.py
+    :synopsis: Finds and opens RFI scan files whether they are plain .txt files, gzip/bzip2/xz compressed, or members of tar archives, decompressing them as they are read
+.. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
+Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
+"""
+
+import os
+import io
+import bz2
+import gzip
+import lzma
+import tarfile
+import contextlib
+
+# A scan inside a tar archive is named by the archive's path and the member's name joined by this, i.e. "scans_2014.tar.gz::TRFI_..._el045.txt"
+member_separator = "::"
+
+# Compressed scan files, and the function opening each as a stream of decompressed bytes (each also takes an open file object)
+compression_openers = {".gz": gzip.open,".bz2": bz2.open,".xz": lzma.open}
+
+tar_suffixes = [".tar",".tar.gz",".tgz",".tar.bz2",".tbz2",".tar.xz",".txz"]
+
+
+def split_source(source):
+    """
+    returns path: the file on disk holding a scan
+    returns member: the name of the scan in the tar archive at path, or None if path is the scan itself
+    """
+    if member_separator in source:
+        path,member = source.split(member_separator,1)
+        return(path,member)
+    return(source,None)
+
+
+def compression_suffix(name):
+    # The compression suffix of a file name, or None if it isn't compressed
+    return(next((suffix for suffix in compression_openers if name.endswith(suffix)),None))
+
+
+def scan_filename(source):
+    """
+    returns filename: the name of the scan file without its directory or compression suffix, as kept in the filename column,
+    so a file counts as the same file whether it was uploaded compressed or not
+    """
+    path,member = split_source(source)
+    name = (member if member is not None else path).split("/")[-1]
+    suffix = compression_suffix(name)
+    if suffix is not None:
+        name = name[:-len(suffix)]
+    return(name)
+
+
+def is_plain_file(source):
+    """
+    returns is_plain: whether a scan is an uncompressed file of its own, which can be memory-mapped
+    """
+    path,member = split_source(source)
+    return(member is None and compression_suffix(path) is None)
+
+
+def is_tar_archive(name):
+    return(any(name.endswith(suffix) for suffix in tar_suffixes))
+
+
+def is_scan_file(name):
+    """
+    returns is_scan: whether a file (or tar member) name is one of the RFI scans we're interested in, compressed or not
+    """
+    filename = scan_filename(name)
+    return(filename.endswith(".txt") and filename != "URLs.txt" and (filename.startswith('AGBT') or filename.startswith('TRFI') or filename.startswith('TGBT')))
+
+
+def archive_sources(path,wanted=is_scan_file):
+    """
+    Lists the scans in a tar archive. This reads through the whole archive once, but nothing is extracted to disk.
+
+    param path: the path to the tar archive
+    param wanted: a function taking a member name and returning whether it should be listed
+    returns sources: the names of the scans, as path::member
+    """
+    with tarfile.open(path,"r:*") as archive:
+        return([path+member_separator+member.name for member in archive if member.isfile() and wanted(member.name)])
+
+
+def source_status(source):
+    """
+    returns status: the path, size and modification time (in ns) of the file on disk holding a scan, and the scan's name within it (or None)
+    """
+    path,member = split_source(source)
+    status = os.stat(path)
+    return([os.path.abspath(path),status.st_size,status.st_mtime_ns,member])
+
+
+def decompressing(name,stream):
+    # Wraps a stream in the decompressor its name calls for, if any
+    suffix = compression_suffix(name)
+    if suffix is None:
+        return(stream)
+    return(compression_openers[suffix](stream,"rb"))
+
+
+@contextlib.contextmanager
+def open_scan(source):
+    """
+    Opens a scan for reading, decompressing it as it is read
+
+    param source: the path to a scan file, or path::member for a scan in a tar archive
+    yields stream: a binary stream of the scan's (decompressed) bytes, which can be peeked at without being read
+    yields modification_time: the unix time the scan was last modified
+    """
+    path,member = split_source(source)
+    if member is None:
+        with open(path,"rb") as f:
+            stream = decompressing(path,f)
+            yield(buffered(stream),os.path.getmtime(path))
+        return
+    # Finding one member of a compressed archive means decompressing everything before it, so many members are better read with archive_scans
+    with tarfile.open(path,"r:*") as archive:
+        info = archive.getmember(member)
+        stream = decompressing(member,archive.extractfile(info))
+        yield(buffered(stream),float(info.mtime))
+
+
+def archive_scans(path,members):
+    """
+    Reads through a tar archive once, as a stream, giving each of the wanted scans in the order they're stored
+
+    param path: the path to the tar archive
+    param members: the names of the wanted members
+    yields source: the scan, as path::member
+    yields stream: a binary stream of the scan's (decompressed) bytes. It can only be read until the next scan is given
+    yields modification_time: the unix time the scan was last modified
+    """
+    members = set(members)
+    with tarfile.open(path,"r|*") as archive:
+        for info in archive:
+            if info.name in members and info.isfile():
+                stream = io.BufferedReader(forward_only(archive.extractfile(info)))
+                yield(path+member_separator+info.name,buffered(decompressing(info.name,stream)),float(info.mtime))
+
+
+class forward_only(io.RawIOBase):
+    """
+    A member of a tar archive read as a stream, which can only be read forwards. The file objects tarfile gives for these
+    claim to be seekable but fail when asked, which text and decompression wrappers do.
+    """
+    def __init__(self,member):
+        self.member = member
+
+    def readable(self):
+        return(True)
+
+    def seekable(self):
+        return(False)
+
+    def readinto(self,buffer):
+        data = self.member.read(len(buffer))
+        buffer[:len(data)] = data
+        return(len(data))
+
+
+def buffered(stream):
+    # Every stream needs peek, so the first byte of a scan can be checked without reading it
+    if hasattr(stream,"peek"):
+        return(stream)
+    return(io.BufferedReader(stream))
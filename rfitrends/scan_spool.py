@@ -0,0 +1,201 @@
+"""
+.. module:: scan_spool.py
+    :synopsis: Keeps the parsed form of every scan file read on local disk, keyed by the file's path, size and modification time, so reruns, dry runs and other uploaders don't parse the archive again
+.. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
+Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
+"""
+
+import numpy as np
+import os
+import json
+import math
+import hashlib
+import tempfile
+import argparse
+from decimal import Decimal
+import rfitrends.column_cache
+import rfitrends.scan_sources
+import rfitrends.RFI_input_for_SQL
+from rfitrends.parsed_scan import parsed_scan,scan_header,header_fields
+
+# Part of every key, so spooled scans are parsed again once the way files are parsed changes
+spool_version = 2
+
+# The arrays of a parsed_scan saved in each spool entry
+scan_arrays = ["frequency_key","intensity","window","channel","counts","dirty"]
+
+
+def spool_settings():
+    """
+    returns directory: the spool directory, spool under the cache directory of rfitrends.conf
+    returns max_bytes: the most space the spool may take up, max_spool_megabytes of the [Cache] section of rfitrends.conf
+    """
+    settings = rfitrends.column_cache.cache_settings()
+    return(os.path.join(settings["cache_directory"],"spool"),settings["max_spool_bytes"])
+
+
+def spool_key(filepath):
+    """
+    Makes the spool key of a file from its absolute path, size and modification time, so a file that is changed or replaced is parsed again.
+    For a scan in a tar archive these are the archive's, along with the scan's name in it.
+
+    param filepath: the path to the scan file, or path::member (see scan_sources.py)
+    returns key: a hex string
+    """
+    text = json.dumps([spool_version]+rfitrends.scan_sources.source_status(filepath))
+    return(hashlib.sha1(text.encode()).hexdigest())
+
+
+def header_to_json(header):
+    # NaN is written as it is by json, and mjd is kept as the exact decimal string
+    fields = {}
+    for field,(_,field_type) in header_fields.items():
+        value = getattr(header,field)
+        fields[field] = value if field_type is float or value is None else str(value)
+    return(json.dumps({"fields": fields,"column_names": header.column_names,"has_header": header.has_header}))
+
+
+def header_from_json(text):
+    saved = json.loads(text)
+    fields = saved["fields"]
+    for field,(_,field_type) in header_fields.items():
+        if field_type is float:
+            fields[field] = math.nan if fields[field] is None else float(fields[field])
+        elif field_type is Decimal and fields[field] is not None:
+            fields[field] = Decimal(fields[field])
+    return(scan_header(column_names=saved["column_names"],has_header=saved["has_header"],**fields))
+
+
+def save_scan(path,scan):
+    """
+    Saves a parsed_scan as an uncompressed .npz file (its arrays are already compact), written to a temporary file and renamed into place
+    """
+    arrays = {name: getattr(scan,name) for name in scan_arrays if getattr(scan,name) is not None}
+    directory = os.path.dirname(path)
+    handle,temporary = tempfile.mkstemp(prefix=".",suffix=".npz",dir=directory)
+    try:
+        with os.fdopen(handle,"wb") as f:
+            np.savez(f,header=np.array(header_to_json(scan.header)),nan_lines=np.array(scan.nan_lines),**arrays)
+        os.replace(temporary,path)
+    except BaseException:
+        rfitrends.column_cache.remove_entry(temporary)
+        raise
+
+
+def load_scan(path):
+    """
+    returns scan: the parsed_scan saved at path by save_scan
+    """
+    with np.load(path) as saved:
+        arrays = {name: saved[name] if name in saved.files else None for name in scan_arrays}
+        header = header_from_json(str(saved["header"]))
+        nan_lines = int(saved["nan_lines"])
+    return(parsed_scan(header,arrays["frequency_key"],arrays["intensity"],arrays["window"],arrays["channel"],arrays["counts"],arrays["dirty"],nan_lines))
+
+
+class scan_spool():
+    """
+    A directory of parsed scans, one .npz file per scan file, kept under max_bytes by evicting the least recently used.
+    A scan is only found again if its file still has the same path, size and modification time.
+    """
+    def __init__(self,directory=None,max_bytes=None):
+        default_directory,default_max_bytes = spool_settings()
+        self.directory = default_directory if directory is None else directory
+        self.max_bytes = default_max_bytes if max_bytes is None else max_bytes
+        os.makedirs(self.directory,exist_ok=True)
+        # The size of the spool is only walked once, then kept up to date as scans are added
+        self.size = None
+        self.hits = 0
+        self.misses = 0
+
+    def path(self,filepath):
+        return(os.path.join(self.directory,spool_key(filepath)+".npz"))
+
+    def get(self,filepath):
+        """
+        returns scan: the spooled parsed_scan of a file, or None if it isn't spooled
+        """
+        path = self.path(filepath)
+        if not os.path.exists(path):
+            return(None)
+        try:
+            scan = load_scan(path)
+        except (OSError,ValueError,KeyError):
+            # A damaged entry is parsed again and replaced
+            rfitrends.column_cache.remove_entry(path)
+            return(None)
+        rfitrends.column_cache.touch(path)
+        return(scan)
+
+    def put(self,filepath,scan):
+        """
+        Spools the parsed_scan of a file, then evicts the least recently used scans if the spool is over its limit
+        """
+        path = self.path(filepath)
+        save_scan(path,scan)
+        if self.size is None:
+            self.size = rfitrends.column_cache.directory_size(self.directory)
+        else:
+            self.size += os.path.getsize(path)
+        if self.size > self.max_bytes:
+            rfitrends.column_cache.evict_least_recently_used(self.directory,self.max_bytes,keep=(path,))
+            self.size = rfitrends.column_cache.directory_size(self.directory)
+
+    def parse(self,filepath):
+        """
+        Gives the parsed_scan of a file from the spool, or parses it with RFI_input_for_SQL.parse_file and spools it
+
+        param filepath: the path to the scan file
+        returns scan: the parsed_scan
+        """
+        scan = self.get(filepath)
+        if scan is not None:
+            self.hits += 1
+            return(scan)
+        self.misses += 1
+        scan = rfitrends.RFI_input_for_SQL.parse_file(filepath)
+        self.put(filepath,scan)
+        return(scan)
+
+    def purge(self):
+        """
+        Deletes every spooled scan
+        """
+        rfitrends.column_cache.remove_entry(self.directory)
+        os.makedirs(self.directory,exist_ok=True)
+        self.size = 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parses RFI scan files into the local spool without touching the database, or empties the spool. RFI_input_for_SQL.py --spool reads from it.")
+    parser.add_argument("--spool_directory",default=None,help="The spool directory. Default is spool under the cache directory of rfitrends.conf")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    fill_parser = subparsers.add_parser("fill",help="Parse every scan file in a directory into the spool (a dry run of an upload)")
+    fill_parser.add_argument("path",help="The path to the .txt files")
+    fill_parser.add_argument("--parse_workers",type=int,default=1,help="The number of processes parsing files at once")
+    subparsers.add_parser("purge",help="Delete every spooled scan")
+    subparsers.add_parser("info",help="Print the size of the spool")
+    args = parser.parse_args()
+    spool = scan_spool(args.spool_directory)
+    if args.command == "purge":
+        spool.purge()
+        print("Spool emptied: "+spool.directory)
+    elif args.command == "info":
+        entries = [name for name in os.listdir(spool.directory) if name.endswith(".npz") and not name.startswith(".")]
+        print(str(len(entries))+" scans, "+str(round(rfitrends.column_cache.directory_size(spool.directory)/1024/1024,1))+" MB of "+str(round(spool.max_bytes/1024/1024,1))+" MB in "+spool.directory)
+    else:
+        filepaths = rfitrends.RFI_input_for_SQL.gather_filepaths_to_process(args.path)
+        parsed = 0
+        for filenum,(filepath,scan,error) in enumerate(rfitrends.RFI_input_for_SQL.parse_files(filepaths,args.parse_workers,spool)):
+            print("Parsed file "+str(filenum+1)+" of "+str(len(filepaths))+": "+str(filepath))
+            if error is not None:
+                print("Could not parse this file: "+str(error))
+                continue
+            print(str(len(scan))+" channels, "+str(int(scan.dirty.sum()))+" dirty")
+            parsed += 1
+        print(str(parsed)+" of "+str(len(filepaths))+" files are in the spool.")
+
+
+if __name__ == "__main__":
+    main()
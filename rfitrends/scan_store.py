@@ -0,0 +1,138 @@
+"""
+.. module:: scan_store.py
+    :synopsis: Writes parsed scans to, and reads them back from, the normalized layouts of the main table: one scans row per file holding its header, with its channels as narrow rows or as one packed binary spectrum
+.. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
+Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
+"""
+
+import numpy as np
+import math
+from rfitrends.schema_manager import normalized_table_names,scans_table_columns,spectra_table_columns,spectrum_blob_columns
+from rfitrends.parsed_scan import parsed_scan,scan_header,header_fields,missing_index,frequency_keys
+
+# The header columns of the scans table, which are named as the fields of scan_header.column_values
+header_columns = [name for name,_ in scans_table_columns if name not in ["scan_id","n_channels"]]
+
+# The arrays packed into each row of the spectrum blobs table, and how they're stored. Intensities are float32, which keeps
+# about 7 significant figures; frequencies stay exact as whole numbers of 0.0001 MHz
+packed_arrays = {"frequency_keys": "<i8","intensity": "<f4","counts": "<i4","window": "<i4","channel": "<i4","dirty": "u1"}
+
+
+def spectrum_rows(scan_id,scan):
+    """
+    returns rows: the rows of the spectra table for a scan, with missing window and channel numbers as NULL
+    """
+    def index_value(value):
+        return(None if value == missing_index else int(value))
+    rows = []
+    for index in range(len(scan)):
+        rows.append([scan_id,scan.frequency_string(index),float(scan.intensity[index]),int(scan.counts[index]),index_value(scan.window[index]),index_value(scan.channel[index]),int(scan.dirty[index])])
+    return(rows)
+
+
+def pack_spectrum(scan):
+    """
+    returns arrays: dictionary of the name of each of packed_arrays to its bytes for a scan
+    """
+    values = {"frequency_keys": scan.frequency_key,"intensity": scan.intensity,"counts": scan.counts,"window": scan.window,"channel": scan.channel,"dirty": scan.dirty}
+    return({name: np.ascontiguousarray(values[name],dtype=dtype).tobytes() for name,dtype in packed_arrays.items()})
+
+
+def unpack_spectrum(header,arrays):
+    """
+    Makes a parsed_scan from a header and the bytes made by pack_spectrum
+
+    param header: the scan_header of the scan
+    param arrays: dictionary of the name of each of packed_arrays to its bytes
+    returns scan: the parsed_scan
+    """
+    values = {name: np.frombuffer(arrays[name],dtype=dtype) for name,dtype in packed_arrays.items()}
+    return(parsed_scan(header,values["frequency_keys"],values["intensity"],values["window"],values["channel"],values["counts"],values["dirty"].astype(bool)))
+
+
+def insert_scan(connection_manager,main_table,scan,packed=False,batch_size=5000):
+    """
+    Writes a scan to the normalized tables of a main table in one transaction, so a scans row is never left without its channels
+
+    param connection_manager: An object that connects to the database for the user
+    param main_table: the main table whose normalized tables the scan goes to
+    param scan: the parsed_scan
+    param packed: whether the channels are stored as one row of binary arrays in the spectrum blobs table rather than as rows of the spectra table
+    param batch_size: the number of channel rows sent per INSERT
+    returns scan_id: the id given to the scan
+    """
+    tables = normalized_table_names(main_table)
+    header_values = scan.header.column_values()
+    scan_columns = ["n_channels"]+header_columns
+    cnx = connection_manager.connect()
+    cursor = cnx.cursor()
+    try:
+        cursor.execute(insert_statement(tables["scans"],scan_columns),[len(scan)]+[header_values[column] for column in header_columns])
+        scan_id = cursor.lastrowid
+        if packed:
+            arrays = pack_spectrum(scan)
+            cursor.execute(insert_statement(tables["blobs"],[name for name,_ in spectrum_blob_columns]),[scan_id,len(scan)]+[arrays[name] for name in packed_arrays])
+        else:
+            rows = spectrum_rows(scan_id,scan)
+            query = insert_statement(tables["spectra"],[name for name,_ in spectra_table_columns])
+            for start in range(0,len(rows),batch_size):
+                cursor.executemany(query,rows[start:start+batch_size])
+        cnx.commit()
+    except Exception:
+        cnx.rollback()
+        raise
+    finally:
+        cursor.close()
+        cnx.close()
+    return(scan_id)
+
+
+def insert_statement(table,columns):
+    return("INSERT INTO "+str(table)+" ("+",".join("`"+column+"`" for column in columns)+") VALUES ("+",".join(["%s"]*len(columns))+")")
+
+
+def scan_ids(connection_manager,main_table,filename):
+    """
+    returns scan_ids: the ids of the scans of a main table uploaded from a file of this name, so the duplicate check doesn't need any channels
+    """
+    tables = normalized_table_names(main_table)
+    result = connection_manager.execute_command("SELECT scan_id FROM "+tables["scans"]+" WHERE filename = \'"+str(filename)+"\'")
+    return([row[0] for row in result])
+
+
+def header_from_row(row):
+    """
+    Makes a scan_header from a row of the scans table, holding header_columns in order
+    """
+    fields = dict(zip(header_columns,row))
+    for field,(_,field_type) in header_fields.items():
+        # NULL numbers are read back as NaN, as scan_header keeps them
+        if field_type is float:
+            fields[field] = math.nan if fields[field] is None else float(fields[field])
+    return(scan_header(column_names=[],has_header=True,**fields))
+
+
+def read_scan(connection_manager,main_table,scan_id):
+    """
+    Reads one scan back from the normalized tables of a main table, whichever way its channels were stored
+
+    param connection_manager: An object that connects to the database for the user
+    param main_table: the main table whose normalized tables hold the scan
+    param scan_id: the id of the scan
+    returns scan: the parsed_scan, or None if there is no such scan
+    """
+    tables = normalized_table_names(main_table)
+    result = connection_manager.execute_command("SELECT "+",".join("`"+column+"`" for column in header_columns)+" FROM "+tables["scans"]+" WHERE scan_id = "+str(int(scan_id)))
+    if not result:
+        return(None)
+    header = header_from_row(result[0])
+    blobs = connection_manager.execute_command("SELECT "+",".join(packed_arrays)+" FROM "+tables["blobs"]+" WHERE scan_id = "+str(int(scan_id)))
+    if blobs:
+        return(unpack_spectrum(header,dict(zip(packed_arrays,blobs[0]))))
+    rows = connection_manager.execute_command("SELECT Frequency_MHz,Intensity_Jy,Counts,Window,Channel,dirty FROM "+tables["spectra"]+" WHERE scan_id = "+str(int(scan_id))+" ORDER BY Frequency_MHz")
+    if not rows:
+        return(parsed_scan(header,[],[],[],[],[],[]))
+    frequency,intensity,counts,window,channel,dirty = zip(*rows)
+    def index_array(values):
+        return([missing_index if value is None else value for value in values])
+    return(parsed_scan(header,frequency_keys(np.array(frequency,dtype=np.float64)),np.array(intensity,dtype=np.float64),index_array(window),index_array(channel),counts,dirty))
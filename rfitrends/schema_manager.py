@@ -0,0 +1,380 @@
+"""
+.. module:: schema_manager.py
+    :synopsis: Creates, and brings up to date, every table the tool uses, with secondary indexes and the main table range-partitioned by mjd
+.. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
+Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
+"""
+
+import numpy as np
+import datetime
+import argparse
+import rfitrends.connection_manager
+import rfitrends.GBT_receiver_specs
+
+# The columns of the main and dirty tables, as filled by connection_manager.add_main_values. Header values that headerless files
+# Fill with "NaN" (or that are missing from some headers, giving "None") are kept as text, as they always have been.
+main_table_columns = [
+    ("mjd","Decimal(8,3) NOT NULL"),
+    ("Frequency_MHz","Decimal(12,6) NOT NULL"),
+    ("Intensity_Jy","DOUBLE"),
+    ("Counts","INT"),
+    ("feed","VARCHAR(32)"),
+    ("frontend","VARCHAR(64)"),
+    ("azimuth_deg","DOUBLE"),
+    ("elevation_deg","DOUBLE"),
+    ("projid","VARCHAR(64)"),
+    ("resolution_MHz","VARCHAR(32)"),
+    ("Window","VARCHAR(16)"),
+    ("Channel","VARCHAR(16)"),
+    ("exposure","VARCHAR(32)"),
+    ("utc_hrs","DOUBLE"),
+    ("date","VARCHAR(32)"),
+    ("number_IF_Windows","VARCHAR(16)"),
+    ("backend","VARCHAR(64)"),
+    ("lst","DOUBLE"),
+    ("filename","VARCHAR(255)"),
+    ("polarization","VARCHAR(16)"),
+    ("source","VARCHAR(64)"),
+    ("tsys","VARCHAR(32)"),
+    ("frequency_type","VARCHAR(16)"),
+    ("units","VARCHAR(16)"),
+    ("scan_number","VARCHAR(32)")
+]
+main_table_primary_key = ["mjd","Frequency_MHz"]
+# The duplicate check in read_file looks files up by filename, and most analysis selects by frontend or projid
+main_table_indexes = {"idx_filename": ["filename"],"idx_frontend": ["frontend","mjd"],"idx_projid": ["projid"]}
+
+duplicate_data_catalog_columns = [
+    ("id","BIGINT NOT NULL AUTO_INCREMENT"),
+    ("Frequency_MHz","Decimal(12,6)"),
+    ("Intensity_Jy","DOUBLE"),
+    ("filename","VARCHAR(255)")
+]
+
+# A file goes into Bad_files once per upload, so filename is indexed but not unique
+bad_files_columns = [
+    ("id","BIGINT NOT NULL AUTO_INCREMENT"),
+    ("filename","VARCHAR(255)")
+]
+
+latest_projects_columns = [
+    ("frontend","VARCHAR(64) NOT NULL"),
+    ("projid","VARCHAR(64)"),
+    ("mjd","Decimal(8,3)")
+]
+
+receiver_table_columns = [
+    ("Frequency_MHz","Decimal(12,6) NOT NULL"),
+    ("mjd","Decimal(8,3) NOT NULL")
+]
+
+avgs_table_columns = [("Frequency","Decimal(12,6) NOT NULL")]+[(column,"DOUBLE") for column in ["mean_intensity","max_intensity","min_intensity","median_intensity","low_percentile_intensity","high_percentile_intensity"]]
+
+# The layouts the main and dirty tables can be stored in. "wide" is the original single table with the header repeated on every channel row.
+# "normalized" keeps one row per scan file in <main_table>_scans holding its header, and channel rows holding only what changes per channel
+# in <main_table>_spectra. "packed" keeps the scans rows too, but each scan's channels as binary arrays in one <main_table>_spectrum_blobs row
+# (see scan_store.py). For "normalized", the main and dirty table names become views presenting the wide shape. Packed channels can't be
+# shown by a view, so a packed main table is only read through scan_store.read_scan, and its names are kept free of any table or view.
+layouts = ["wide","normalized","packed"]
+
+channel_columns = ["Frequency_MHz","Intensity_Jy","Counts","Window","Channel"]
+scans_table_columns = [("scan_id","BIGINT NOT NULL AUTO_INCREMENT"),("n_channels","INT")]+[column for column in main_table_columns if column[0] not in channel_columns]
+scans_table_indexes = {"idx_filename": ["filename"],"idx_mjd": ["mjd"],"idx_frontend": ["frontend","mjd"],"idx_projid": ["projid"]}
+
+# Window and Channel are numbers here, NULL where the wide table has "NaN", and dirty channels are flagged rather than kept in another table
+spectra_table_columns = [
+    ("scan_id","BIGINT NOT NULL"),
+    ("Frequency_MHz","Decimal(12,6) NOT NULL"),
+    ("Intensity_Jy","DOUBLE"),
+    ("Counts","INT"),
+    ("Window","INT"),
+    ("Channel","INT"),
+    ("dirty","TINYINT NOT NULL")
+]
+spectra_table_indexes = {"idx_frequency": ["Frequency_MHz"]}
+
+spectrum_blob_columns = [("scan_id","BIGINT NOT NULL"),("n_channels","INT")]+[(name,"LONGBLOB") for name in ["frequency_keys","intensity","counts","window","channel","dirty"]]
+
+# The main table gets one partition per year of mjd from this year on, with everything earlier in one partition
+first_partition_year = 2002
+
+
+def receiver_tables():
+    """
+    returns receivers: the names of the per-receiver caching tables filled by update_caching_tables (from GBT_receiver_input_values)
+    """
+    return(sorted(set(rfitrends.GBT_receiver_specs.GBT_receiver_input_values.values())-{'Unknown'}))
+
+
+def year_start_mjd(year):
+    """
+    returns mjd: the (whole) mjd of January 1st of a year
+    """
+    return(int((np.datetime64(str(year)+'-01-01')-np.datetime64('1858-11-17')).astype(int)))
+
+
+def partition_name(year):
+    return("p"+str(year))
+
+
+def mjd_partition_clause(first_year=first_partition_year,last_year=None):
+    """
+    Builds the PARTITION BY RANGE clause giving a partition to every year of mjd, so a query on an mjd range only reads those years
+
+    param first_year: the first year with its own partition, everything before it goes in p_old
+    param last_year: the last year with its own partition, next year by default. Later mjds go in p_future until extend_mjd_partitions splits it
+    returns clause: the partition clause
+    """
+    if last_year is None:
+        last_year = datetime.datetime.now(datetime.timezone.utc).year+1
+    partitions = ["PARTITION p_old VALUES LESS THAN ("+str(year_start_mjd(first_year))+")"]
+    for year in range(first_year,last_year+1):
+        partitions.append("PARTITION "+partition_name(year)+" VALUES LESS THAN ("+str(year_start_mjd(year+1))+")")
+    partitions.append("PARTITION p_future VALUES LESS THAN MAXVALUE")
+    return("PARTITION BY RANGE (FLOOR(mjd)) ("+", ".join(partitions)+")")
+
+
+def normalized_table_names(main_table):
+    """
+    returns tables: dictionary of the scans, spectra and blobs tables holding a main table stored in a normalized layout
+    """
+    return({"scans": str(main_table)+"_scans","spectra": str(main_table)+"_spectra","blobs": str(main_table)+"_spectrum_blobs"})
+
+
+def table_exists(connection_manager,table):
+    result = connection_manager.execute_command("SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = \'"+str(table)+"\'")
+    return(result[0][0] > 0)
+
+
+def table_type(connection_manager,table):
+    """
+    returns type: "BASE TABLE" or "VIEW", or None if there is no such table
+    """
+    result = connection_manager.execute_command("SELECT table_type FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = \'"+str(table)+"\'")
+    return(result[0][0] if result else None)
+
+
+def existing_columns(connection_manager,table):
+    result = connection_manager.execute_command("SELECT column_name FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = \'"+str(table)+"\'")
+    return(set(row[0].lower() for row in result))
+
+
+def existing_indexes(connection_manager,table):
+    """
+    returns indexes: dictionary of index name to the tuple of (lower case) columns it covers, in order
+    """
+    result = connection_manager.execute_command("SELECT index_name,column_name FROM information_schema.statistics WHERE table_schema = DATABASE() AND table_name = \'"+str(table)+"\' ORDER BY index_name,seq_in_index")
+    indexes = {}
+    for index_name,column_name in result:
+        indexes[index_name] = indexes.get(index_name,())+(column_name.lower(),)
+    return(indexes)
+
+
+def existing_partitions(connection_manager,table):
+    result = connection_manager.execute_command("SELECT partition_name FROM information_schema.partitions WHERE table_schema = DATABASE() AND table_name = \'"+str(table)+"\' AND partition_name IS NOT NULL")
+    return([row[0] for row in result])
+
+
+def create_or_migrate_table(connection_manager,table,columns,primary_key,indexes=None,partition_clause=None):
+    """
+    Creates a table if it doesn't exist. If it does, adds any columns and indexes it is missing; existing columns are never changed or dropped.
+
+    param connection_manager: An object that connects to the database for the user
+    param table: the table name
+    param columns: list of (column name, SQL type) pairs
+    param primary_key: list of the primary key columns
+    param indexes: dictionary of index name to the list of columns it covers
+    param partition_clause: optionally, how to partition the table when it is created
+    returns changes: list of what was done, for printing
+    """
+    if indexes is None:
+        indexes = {}
+    if not table_exists(connection_manager,table):
+        definitions = ["`"+name+"` "+definition for name,definition in columns]
+        definitions.append("PRIMARY KEY ("+",".join("`"+column+"`" for column in primary_key)+")")
+        definitions += ["INDEX "+name+" ("+",".join("`"+column+"`" for column in index_columns)+")" for name,index_columns in indexes.items()]
+        query = "CREATE TABLE "+str(table)+" ("+", ".join(definitions)+")"
+        if partition_clause is not None:
+            query += " "+partition_clause
+        connection_manager.execute_command(query+";")
+        return(["created "+str(table)])
+    changes = []
+    # Everything missing is added in one ALTER TABLE, so a big table is only rebuilt once
+    alterations = []
+    present = existing_columns(connection_manager,table)
+    for name,definition in columns:
+        # A surrogate id column is only needed by tables this module made, and can't be added without becoming the key
+        if name.lower() not in present and "AUTO_INCREMENT" not in definition:
+            # Added columns can't be NOT NULL without a default, since the table already has rows
+            alterations.append("ADD COLUMN `"+name+"` "+definition.replace(" NOT NULL",""))
+            changes.append("added column "+name+" to "+str(table))
+    present = existing_indexes(connection_manager,table)
+    for name,index_columns in indexes.items():
+        # An index made by hand under another name still counts, as long as it starts with the same columns
+        covered = any(columns_present[:len(index_columns)] == tuple(column.lower() for column in index_columns) for columns_present in present.values())
+        if name not in present and not covered:
+            alterations.append("ADD INDEX "+name+" ("+",".join("`"+column+"`" for column in index_columns)+")")
+            changes.append("added index "+name+" to "+str(table))
+    if alterations:
+        connection_manager.execute_command("ALTER TABLE "+str(table)+" "+", ".join(alterations)+";")
+    return(changes)
+
+
+def partition_existing_table(connection_manager,table,first_year=first_partition_year,last_year=None):
+    """
+    Partitions an existing, unpartitioned table by mjd. This rewrites the whole table, so it is only done when asked for.
+    """
+    if existing_partitions(connection_manager,table):
+        return([])
+    connection_manager.execute_command("ALTER TABLE "+str(table)+" "+mjd_partition_clause(first_year,last_year)+";")
+    return(["partitioned "+str(table)+" by mjd"])
+
+
+def extend_mjd_partitions(connection_manager,table,last_year=None):
+    """
+    Splits yearly partitions off the front of p_future up to last_year, so new data doesn't all pile into p_future.
+    Only p_future is rewritten, and it should hold no rows as long as this is run before each new year.
+
+    param connection_manager: An object that connects to the database for the user
+    param table: the partitioned table
+    param last_year: the last year to have its own partition, next year by default
+    returns changes: list of what was done, for printing
+    """
+    if last_year is None:
+        last_year = datetime.datetime.now(datetime.timezone.utc).year+1
+    partitions = existing_partitions(connection_manager,table)
+    if "p_future" not in partitions:
+        return([])
+    years = [int(name[1:]) for name in partitions if name[1:].isdigit()]
+    first_new_year = max(years)+1 if years else first_partition_year
+    if first_new_year > last_year:
+        return([])
+    new_partitions = ["PARTITION "+partition_name(year)+" VALUES LESS THAN ("+str(year_start_mjd(year+1))+")" for year in range(first_new_year,last_year+1)]
+    new_partitions.append("PARTITION p_future VALUES LESS THAN MAXVALUE")
+    connection_manager.execute_command("ALTER TABLE "+str(table)+" REORGANIZE PARTITION p_future INTO ("+", ".join(new_partitions)+");")
+    return(["added partitions for "+str(first_new_year)+" to "+str(last_year)+" to "+str(table)])
+
+
+def compatibility_view_query(main_table,dirty=False):
+    """
+    Builds the SELECT presenting a normalized main table in the shape of the wide table, with the same columns in the same order
+
+    param main_table: the main table the normalized tables belong to
+    param dirty: whether the view shows the dirty channels instead of the clean ones
+    returns query: the SELECT statement
+    """
+    tables = normalized_table_names(main_table)
+    selected = []
+    for name,_ in main_table_columns:
+        if name in ["Window","Channel"]:
+            # Missing window and channel numbers read as "NaN", as in the wide table
+            selected.append("COALESCE(CAST(spectra.`"+name+"` AS CHAR),'NaN') AS `"+name+"`")
+        elif name in channel_columns:
+            selected.append("spectra.`"+name+"`")
+        else:
+            selected.append("scans.`"+name+"`")
+    query = "SELECT "+", ".join(selected)+" FROM "+tables["spectra"]+" AS spectra JOIN "+tables["scans"]+" AS scans ON spectra.scan_id = scans.scan_id"
+    query += " WHERE spectra.dirty = "+("1" if dirty else "0")
+    return(query)
+
+
+def create_compatibility_view(connection_manager,view,main_table,dirty=False):
+    """
+    Creates (or replaces) a view presenting a normalized main table in the wide shape, so the scripts reading the main and dirty tables work unchanged.
+    Only channels stored as rows are shown, which is why the packed layout has no views.
+    """
+    if table_type(connection_manager,view) == "BASE TABLE":
+        raise ValueError(str(view)+" is already a table in the wide layout. Use the wide layout for it, or choose another table name for the normalized layout.")
+    connection_manager.execute_command("CREATE OR REPLACE VIEW "+str(view)+" AS "+compatibility_view_query(main_table,dirty)+";")
+    return(["made "+str(view)+" a view of the normalized tables of "+str(main_table)])
+
+
+def check_packed_names(connection_manager,main_table,dirty_table):
+    """
+    Raises ValueError if the main or dirty table name of a packed layout is a table or view, as the other scripts would read it without
+    ever seeing the packed scans
+    """
+    for table in [main_table,dirty_table]:
+        if table_type(connection_manager,table) is not None:
+            raise ValueError(str(table)+" is a table or view the other scripts read, but scans in the packed layout never show up in it. Use the normalized layout for it, or choose a main table name with no table or view of its own for the packed layout.")
+
+
+def ensure_normalized_tables(connection_manager,main_table,dirty_table,packed=False):
+    """
+    Creates or migrates the scans, spectra and spectrum blob tables of a normalized main table, and the views standing in for the main and dirty tables.
+    In the packed layout there are no views, as they would always be empty.
+    """
+    if packed:
+        check_packed_names(connection_manager,main_table,dirty_table)
+    tables = normalized_table_names(main_table)
+    changes = []
+    changes += create_or_migrate_table(connection_manager,tables["scans"],scans_table_columns,["scan_id"],scans_table_indexes)
+    changes += create_or_migrate_table(connection_manager,tables["spectra"],spectra_table_columns,["scan_id","Frequency_MHz"],spectra_table_indexes)
+    changes += create_or_migrate_table(connection_manager,tables["blobs"],spectrum_blob_columns,["scan_id"])
+    if not packed:
+        changes += create_compatibility_view(connection_manager,main_table,main_table)
+        changes += create_compatibility_view(connection_manager,dirty_table,main_table,dirty=True)
+    return(changes)
+
+
+def ensure_schema(connection_manager,main_table,dirty_table,avgs_table=None,partition_main=True,partition_existing=False,layout="wide"):
+    """
+    Creates or migrates every table the tool uses: the main and dirty tables, duplicate_data_catalog, Bad_files, latest_projects
+    (with a row for every receiver, as update_caching_tables expects), the per-receiver caching tables and, optionally, an avgs table
+
+    param connection_manager: An object that connects to the database for the user
+    param main_table: the table for clean RFI data
+    param dirty_table: the table for flagged RFI data
+    param avgs_table: optionally, an avgs table to make for RFI_avgs_loader.py
+    param partition_main: whether a newly made main table is partitioned by mjd
+    param partition_existing: whether an existing, unpartitioned main table is partitioned by mjd (which rewrites it)
+    param layout: one of layouts. For "normalized", the main and dirty tables are views of the normalized tables. For "packed" there are no such views,
+    and ValueError is raised if the main or dirty table already exists
+    returns changes: list of everything that was done
+    """
+    changes = []
+    if layout == "wide":
+        partition_clause = mjd_partition_clause() if partition_main else None
+        changes += create_or_migrate_table(connection_manager,main_table,main_table_columns,main_table_primary_key,main_table_indexes,partition_clause)
+        if partition_main:
+            if partition_existing:
+                changes += partition_existing_table(connection_manager,main_table)
+            changes += extend_mjd_partitions(connection_manager,main_table)
+        changes += create_or_migrate_table(connection_manager,dirty_table,main_table_columns,main_table_primary_key,main_table_indexes)
+    else:
+        changes += ensure_normalized_tables(connection_manager,main_table,dirty_table,packed=layout == "packed")
+    changes += create_or_migrate_table(connection_manager,"duplicate_data_catalog",duplicate_data_catalog_columns,["id"],{"idx_filename": ["filename"],"idx_frequency": ["Frequency_MHz"]})
+    changes += create_or_migrate_table(connection_manager,"Bad_files",bad_files_columns,["id"],{"idx_filename": ["filename"]})
+    changes += create_or_migrate_table(connection_manager,"latest_projects",latest_projects_columns,["frontend"])
+    present = set(row[0] for row in connection_manager.execute_command("SELECT frontend FROM latest_projects"))
+    missing = [[receiver,"None",0] for receiver in receiver_tables() if receiver not in present]
+    if missing:
+        connection_manager.insert_rows("latest_projects",["frontend","projid","mjd"],missing)
+        changes.append("added "+", ".join(row[0] for row in missing)+" to latest_projects")
+    for receiver in receiver_tables():
+        changes += create_or_migrate_table(connection_manager,receiver,receiver_table_columns,["Frequency_MHz","mjd"])
+    if avgs_table is not None:
+        changes += create_or_migrate_table(connection_manager,avgs_table,avgs_table_columns,["Frequency"])
+    return(changes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Creates, or brings up to date, the tables used by the GBT RFI Analysis Tool")
+    parser.add_argument("main_table",help="The table for clean RFI data")
+    parser.add_argument("dirty_table",help="The table for flagged or bad RFI data")
+    parser.add_argument("IP_address",nargs='?',default= '192.33.116.22',help="The IP address to find the SQL database. Default is the GBO development server address. This would only work for employees.")
+    parser.add_argument("database",nargs='?',default='jskipper',help="The name of the SQL database. Default is jskipper, which would only work for employees.")
+    parser.add_argument("--avgs_table",default=None,help="Also make this avgs table for RFI_avgs_loader.py")
+    parser.add_argument("--no_partitioning",action='store_true',help="Don't partition a new main table by mjd")
+    parser.add_argument("--partition_existing",action='store_true',help="Partition an existing main table by mjd. This rewrites the whole table and can take a long time")
+    parser.add_argument("--layout",choices=layouts,default="wide",help="How the main and dirty tables are stored: wide (the header on every row), normalized (a scans table and a spectra table, with the main and dirty tables as views of them) or packed (a scans table and one binary spectrum per scan, read only with scan_store.read_scan)")
+    args = parser.parse_args()
+    connection_manager = rfitrends.connection_manager.connection_manager(args.IP_address,args.database)
+    changes = ensure_schema(connection_manager,args.main_table,args.dirty_table,args.avgs_table,not args.no_partitioning,args.partition_existing,args.layout)
+    for change in changes:
+        print(change)
+    print("Schema is up to date ("+str(len(changes))+" changes).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+"""
+.. module:: time_cube.py
+    :synopsis: Aggregates the main RFI table into a frequency-bin x time-bin cube (calendar month, mjd range or LST hour) stored as memory-mapped NumPy arrays
+.. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
+Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
+"""
+
+import numpy as np
+import os
+import json
+import argparse
+import rfitrends.connection_manager
+import rfitrends.data_stream
+
+# The mjd of the unix epoch (1970-01-01), used to turn mjd into calendar months
+mjd_unix_epoch = 40587.0
+
+# The time axes a cube can be binned on
+time_axes = ["month","mjd","lst"]
+
+# Percentiles in a cube are read from a histogram of asinh(intensity) kept for every cell. asinh behaves like a log for
+# large intensities but still copes with the zero and negative intensities that come out of calibration.
+default_percentiles = [2.75, 50.0, 97.5]
+default_histogram_bins = 128
+histogram_limits = (np.arcsinh(-1.0e6),np.arcsinh(1.0e6))
+
+
+def mjd_to_month(mjd):
+    """
+    Gives the calendar month each mjd falls in, counted in months since January 1970
+
+    param mjd: array of mjd values
+    returns months: integer array of months since 1970-01
+    """
+    seconds = np.round((np.asarray(mjd,dtype=np.float64)-mjd_unix_epoch)*86400.0).astype(np.int64)
+    months = seconds.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+    return(months)
+
+
+def month_to_mjd(months):
+    """
+    Gives the mjd at the start of each month, for months counted since January 1970
+    """
+    days = np.asarray(months,dtype=np.int64).astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+    return(days+mjd_unix_epoch)
+
+
+def histogram_percentiles(histogram,percentiles,edges):
+    """
+    Estimates percentiles from histograms, interpolating linearly inside the bin where each percentile falls
+
+    param histogram: array of counts whose last axis is the histogram
+    param percentiles: list of percentiles (0-100)
+    param edges: the histogram bin edges (in asinh(intensity))
+    returns values: array with the histogram axis replaced by one intensity per percentile (NaN where there are no counts)
+    """
+    cumulative = np.cumsum(histogram,axis=-1,dtype=np.float64)
+    total = cumulative[...,-1:]
+    values = []
+    for percentile in percentiles:
+        target = total*(percentile/100.0)
+        # First bin in which the running count reaches the target
+        index = np.minimum(np.sum(cumulative < target,axis=-1,keepdims=True),histogram.shape[-1]-1)
+        below = np.where(index > 0,np.take_along_axis(cumulative,np.maximum(index-1,0),axis=-1),0.0)
+        in_bin = np.take_along_axis(histogram,index,axis=-1).astype(np.float64)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            fraction = np.clip(np.where(in_bin > 0,(target-below)/in_bin,0.0),0.0,1.0)
+        position = edges[index]+fraction*(edges[1]-edges[0])
+        value = np.where(total > 0,np.sinh(position),np.nan)
+        values.append(value[...,0])
+    return(np.stack(values,axis=-1))
+
+
+def time_edges_for_axis(connection_manager,main_table,time_axis,mjd_bin_width,lst_bin_width,where):
+    """
+    Works out the time bin edges of a cube, reading the mjd range of the table for the month and mjd axes
+
+    returns edges: the bin edges (mjd for month and mjd axes, hours for lst)
+    returns labels: a label for each bin
+    raises ValueError: for the month and mjd axes, if no rows of the table match where
+    """
+    if time_axis == "lst":
+        edges = np.arange(0.0,24.0+lst_bin_width/2.0,lst_bin_width)
+        labels = [f"{edge:g}h" for edge in edges[:-1]]
+        return(edges,labels)
+    query = "SELECT MIN(mjd),MAX(mjd) FROM "+str(main_table)
+    if where:
+        query += " WHERE "+where
+    result = connection_manager.execute_command(query)
+    # MIN and MAX are NULL when no rows match, and there is no time range to bin
+    if not result or result[0][0] is None:
+        raise ValueError("There are no rows in "+str(main_table)+(" matching "+where if where else "")+" to make the time bins of the cube from.")
+    mjd_min,mjd_max = [float(value) for value in result[0]]
+    if time_axis == "month":
+        months = np.arange(mjd_to_month(mjd_min),mjd_to_month(mjd_max)+2)
+        edges = month_to_mjd(months)
+        labels = [str(month) for month in months[:-1].astype('datetime64[M]')]
+    else:
+        edges = np.arange(np.floor(mjd_min),mjd_max+mjd_bin_width,mjd_bin_width)
+        if len(edges) < 2:
+            edges = np.array([np.floor(mjd_min),np.floor(mjd_min)+mjd_bin_width])
+        labels = [f"{edge:g}" for edge in edges[:-1]]
+    return(edges,labels)
+
+
+def frequency_edges_for_table(connection_manager,main_table,freq_min,freq_max,freq_bin_width,where):
+    """
+    Works out the frequency bin edges of a cube, covering only the part of freq_min to freq_max that the table has rows in.
+    The edges stay on the grid freq_min + n*freq_bin_width, so cubes of different tables line up.
+
+    returns edges: the frequency bin edges in MHz
+    returns condition: the SQL condition (without the WHERE) picking the rows of the table that fall inside the edges
+    raises ValueError: if no rows of the table match where inside freq_min to freq_max
+    """
+    requested_edges = np.arange(freq_min,freq_max+freq_bin_width/2.0,freq_bin_width)
+    frequency_condition = "Frequency_MHz >= "+repr(float(requested_edges[0]))+" AND Frequency_MHz < "+repr(float(requested_edges[-1]))
+    condition = frequency_condition if not where else "("+where+") AND "+frequency_condition
+    result = connection_manager.execute_command("SELECT MIN(Frequency_MHz),MAX(Frequency_MHz) FROM "+str(main_table)+" WHERE "+condition)
+    if not result or result[0][0] is None:
+        raise ValueError("There are no rows in "+str(main_table)+(" matching "+where if where else "")+" between "+str(freq_min)+" and "+str(freq_max)+" MHz to make the cube from.")
+    lowest,highest = [float(value) for value in result[0]]
+    first_bin = max(int(np.floor((lowest-freq_min)/freq_bin_width)),0)
+    last_bin = min(int(np.floor((highest-freq_min)/freq_bin_width)),len(requested_edges)-2)
+    edges = requested_edges[first_bin:last_bin+2]
+    return(edges,condition)
+
+
+def build_time_cube(connection_manager,main_table,output_directory,time_axis="month",freq_min=290.0,freq_max=115300.0,freq_bin_width=10.0,
+                    mjd_bin_width=30.0,lst_bin_width=1.0,where=None,percentiles=default_percentiles,histogram_bins=default_histogram_bins):
+    """
+    Streams the main table once and aggregates it into a frequency x time cube written to output_directory
+
+    param connection_manager: An object that connects to the database for the user
+    param main_table: the table containing all RFI data
+    param output_directory: the directory to hold the cube's arrays and axes.json
+    param time_axis: "month" for calendar months, "mjd" for fixed mjd ranges, or "lst" for LST hours
+    param freq_min: the lowest frequency of the cube in MHz, raised to the lowest frequency in the table
+    param freq_max: the highest frequency of the cube in MHz, lowered to the highest frequency in the table
+    param freq_bin_width: the width of each frequency bin in MHz
+    param mjd_bin_width: the width of each time bin in days, for the mjd axis
+    param lst_bin_width: the width of each time bin in hours, for the lst axis
+    param where: optional SQL condition to build the cube from a subset of the table
+    param percentiles: the percentiles to store for every cell
+    param histogram_bins: the number of histogram bins kept per cell to estimate percentiles
+    returns cube: the finished time_cube
+    """
+    if time_axis not in time_axes:
+        raise ValueError("time_axis must be one of "+str(time_axes))
+    os.makedirs(output_directory,exist_ok=True)
+    # The histogram takes n_frequency x n_time x histogram_bins cells, 0.7 GB over the whole GBT range for ten years of months,
+    # so the frequency axis only covers the frequencies the table (or the subset picked by where) actually has
+    frequency_edges,condition = frequency_edges_for_table(connection_manager,main_table,freq_min,freq_max,freq_bin_width,where)
+    time_edges,time_labels = time_edges_for_axis(connection_manager,main_table,time_axis,mjd_bin_width,lst_bin_width,where)
+    histogram_edges = np.linspace(histogram_limits[0],histogram_limits[1],histogram_bins+1)
+    n_frequency = len(frequency_edges)-1
+    n_time = len(time_edges)-1
+
+    def open_array(name,dtype,shape,fill):
+        array = np.lib.format.open_memmap(os.path.join(output_directory,name+".npy"),mode='w+',dtype=dtype,shape=shape)
+        # A new memory-mapped file already reads as zeros, and writing them anyway would touch every page of it
+        if fill != 0:
+            array[...] = fill
+        return(array)
+    count = open_array("count",np.int64,(n_frequency,n_time),0)
+    total = open_array("sum",np.float64,(n_frequency,n_time),0.0)
+    maximum = open_array("max",np.float64,(n_frequency,n_time),-np.inf)
+    histogram = open_array("histogram",np.uint32,(n_frequency,n_time,histogram_bins),0)
+
+    time_column = "lst" if time_axis == "lst" else "mjd"
+    chunks = rfitrends.data_stream.stream_main_table(connection_manager,main_table,columns=("Frequency_MHz","Intensity_Jy",time_column),order_by=None,where=condition)
+    rows_read = 0
+    for chunk in chunks:
+        rows_read += len(chunk["Frequency_MHz"])
+        intensity = chunk["Intensity_Jy"]
+        frequency_index = np.floor((chunk["Frequency_MHz"]-frequency_edges[0])/freq_bin_width).astype(np.int64)
+        time_index = np.searchsorted(time_edges,chunk[time_column],side='right')-1
+        keep = (frequency_index >= 0) & (frequency_index < n_frequency) & (time_index >= 0) & (time_index < n_time) & np.isfinite(intensity)
+        cell = frequency_index[keep]*n_time+time_index[keep]
+        intensity = intensity[keep]
+        # Collapsing the chunk onto the cells it touches keeps the writes to the memory-mapped arrays down to one per cell
+        cells,inverse = np.unique(cell,return_inverse=True)
+        count.reshape(-1)[cells] += np.bincount(inverse,minlength=len(cells))
+        total.reshape(-1)[cells] += np.bincount(inverse,weights=intensity,minlength=len(cells))
+        np.maximum.at(maximum.reshape(-1),cell,intensity)
+        histogram_index = np.clip(np.searchsorted(histogram_edges,np.arcsinh(intensity),side='right')-1,0,histogram_bins-1)
+        histogram_cells,histogram_counts = np.unique(cell*histogram_bins+histogram_index,return_counts=True)
+        histogram.reshape(-1)[histogram_cells] += histogram_counts.astype(np.uint32)
+        print("progress: "+str(rows_read)+" rows binned")
+
+    maximum[count == 0] = np.nan
+    percentile_values = open_array("percentiles",np.float64,(n_frequency,n_time,len(percentiles)),np.nan)
+    # Done one frequency bin at a time so the cumulative sums never need the whole histogram in memory
+    for frequency_bin in range(n_frequency):
+        percentile_values[frequency_bin] = histogram_percentiles(histogram[frequency_bin],percentiles,histogram_edges)
+    for array in (count,total,maximum,histogram,percentile_values):
+        array.flush()
+
+    axes = {
+        "main_table": str(main_table),
+        "where": where,
+        "time_axis": time_axis,
+        "frequency_edges": frequency_edges.tolist(),
+        "time_edges": np.asarray(time_edges).tolist(),
+        "time_labels": time_labels,
+        "percentiles": list(percentiles),
+        "histogram_edges": histogram_edges.tolist()
+    }
+    with open(os.path.join(output_directory,"axes.json"),'w') as f:
+        json.dump(axes,f,indent=1)
+    return(time_cube(output_directory))
+
+
+class time_cube():
+    """
+    A cube made by build_time_cube, opened read-only and memory-mapped so that slicing it only reads the cells asked for
+    """
+    def __init__(self,directory):
+        self.directory = directory
+        with open(os.path.join(directory,"axes.json")) as f:
+            self.axes = json.load(f)
+        self.time_axis = self.axes["time_axis"]
+        self.frequency_edges = np.array(self.axes["frequency_edges"])
+        self.time_edges = np.array(self.axes["time_edges"])
+        self.time_labels = self.axes["time_labels"]
+        self.percentile_levels = self.axes["percentiles"]
+        self.histogram_edges = np.array(self.axes["histogram_edges"])
+        self.count = np.load(os.path.join(directory,"count.npy"),mmap_mode='r')
+        self.sum = np.load(os.path.join(directory,"sum.npy"),mmap_mode='r')
+        self.max = np.load(os.path.join(directory,"max.npy"),mmap_mode='r')
+        self.histogram = np.load(os.path.join(directory,"histogram.npy"),mmap_mode='r')
+        self.percentiles = np.load(os.path.join(directory,"percentiles.npy"),mmap_mode='r')
+
+    def frequency_bins(self,freq_min=None,freq_max=None):
+        """
+        returns bins: a slice of the frequency bins that overlap freq_min to freq_max (MHz)
+        """
+        return(edges_to_slice(self.frequency_edges,freq_min,freq_max))
+
+    def time_bins(self,time_min=None,time_max=None):
+        """
+        returns bins: a slice of the time bins that overlap time_min to time_max (mjd for month and mjd cubes, hours for lst cubes)
+        """
+        return(edges_to_slice(self.time_edges,time_min,time_max))
+
+    def slice(self,freq_min=None,freq_max=None,time_min=None,time_max=None):
+        """
+        Reads the cells of a frequency and time range
+
+        returns cells: dictionary with count, mean, max and percentiles arrays (frequency x time [x percentile]) and the edges of both axes
+        """
+        frequency_bins = self.frequency_bins(freq_min,freq_max)
+        time_bins = self.time_bins(time_min,time_max)
+        count = np.array(self.count[frequency_bins,time_bins])
+        with np.errstate(invalid='ignore',divide='ignore'):
+            mean = np.where(count > 0,self.sum[frequency_bins,time_bins]/count,np.nan)
+        cells = {
+            "count": count,
+            "mean": mean,
+            "max": np.array(self.max[frequency_bins,time_bins]),
+            "percentiles": np.array(self.percentiles[frequency_bins,time_bins]),
+            "frequency_edges": self.frequency_edges[frequency_bins.start:frequency_bins.stop+1],
+            "time_edges": self.time_edges[time_bins.start:time_bins.stop+1],
+            "time_labels": self.time_labels[time_bins]
+        }
+        return(cells)
+
+    def spectrum(self,time_min=None,time_max=None,freq_min=None,freq_max=None):
+        """
+        Collapses a time range into one spectrum. Counts and histograms add up exactly, so the percentiles are those of all the
+        rows in the range rather than an average of each bin's percentiles.
+
+        returns spectrum: dictionary with count, mean, max and percentiles per frequency bin, and the frequency edges
+        """
+        return(self.collapse(1,freq_min,freq_max,time_min,time_max))
+
+    def light_curve(self,freq_min=None,freq_max=None,time_min=None,time_max=None):
+        """
+        Collapses a frequency range into one value per time bin
+
+        returns light_curve: dictionary with count, mean, max and percentiles per time bin, and the time edges and labels
+        """
+        return(self.collapse(0,freq_min,freq_max,time_min,time_max))
+
+    def collapse(self,axis,freq_min,freq_max,time_min,time_max):
+        frequency_bins = self.frequency_bins(freq_min,freq_max)
+        time_bins = self.time_bins(time_min,time_max)
+        count = np.sum(self.count[frequency_bins,time_bins],axis=axis)
+        total = np.sum(self.sum[frequency_bins,time_bins],axis=axis)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            mean = np.where(count > 0,total/count,np.nan)
+        maximum = np.array(self.max[frequency_bins,time_bins])
+        maximum = np.where(count > 0,np.max(np.where(np.isnan(maximum),-np.inf,maximum),axis=axis,initial=-np.inf),np.nan)
+        histogram = np.sum(self.histogram[frequency_bins,time_bins],axis=axis,dtype=np.int64)
+        collapsed = {
+            "count": count,
+            "mean": mean,
+            "max": maximum,
+            "percentiles": histogram_percentiles(histogram,self.percentile_levels,self.histogram_edges)
+        }
+        if axis == 1:
+            collapsed["frequency_edges"] = self.frequency_edges[frequency_bins.start:frequency_bins.stop+1]
+        else:
+            collapsed["time_edges"] = self.time_edges[time_bins.start:time_bins.stop+1]
+            collapsed["time_labels"] = self.time_labels[time_bins]
+        return(collapsed)
+
+
+def edges_to_slice(edges,low=None,high=None):
+    """
+    Turns a value range into the slice of the bins (given by their edges) that overlap it
+    """
+    start = 0 if low is None else max(int(np.searchsorted(edges,low,side='right'))-1,0)
+    stop = len(edges)-1 if high is None else min(int(np.searchsorted(edges,high,side='left')),len(edges)-1)
+    return(slice(start,max(stop,start)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregates an RFI table into a frequency x time cube of statistics")
+    parser.add_argument("main_table",help="The table containing all RFI data (likely main_table from RFI_input_for_SQL.py)")
+    parser.add_argument("output_directory",help="The directory in which to write the cube")
+    parser.add_argument("IP_address",nargs='?',default= '192.33.116.22',help="The IP address to find the SQL database. Default is the GBO development server address. This would only work for employees.")
+    parser.add_argument("database",nargs='?',default='jskipper',help="The name of the SQL database. Default is jskipper, which would only work for employees.")
+    parser.add_argument("--time_axis",choices=time_axes,default="month",help="Bin time by calendar month, by fixed mjd ranges, or by LST hour. Default is month")
+    parser.add_argument("--freq_min",type=float,default=290.0,help="The lowest frequency of the cube in MHz")
+    parser.add_argument("--freq_max",type=float,default=115300.0,help="The highest frequency of the cube in MHz")
+    parser.add_argument("--freq_bin_width",type=float,default=10.0,help="The width of each frequency bin in MHz. Default is 10")
+    parser.add_argument("--mjd_bin_width",type=float,default=30.0,help="The width of each time bin in days for the mjd axis. Default is 30")
+    parser.add_argument("--lst_bin_width",type=float,default=1.0,help="The width of each time bin in hours for the lst axis. Default is 1")
+    parser.add_argument("--where",default=None,help="An SQL condition to build the cube from a subset of the table, e.g. \"mjd BETWEEN 58484 AND 58848\"")
+    args = parser.parse_args()
+    connection_manager = rfitrends.connection_manager.connection_manager(args.IP_address,args.database)
+    build_time_cube(connection_manager,args.main_table,args.output_directory,args.time_axis,args.freq_min,args.freq_max,args.freq_bin_width,
+                    args.mjd_bin_width,args.lst_bin_width,args.where)
+
+
+if __name__ == "__main__":
+    main()
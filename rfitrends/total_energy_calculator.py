@@ -1,66 +1,246 @@
 """
 .. module:: total_energy_calculator.py
-    :synopsis: Calculates the total energy of the entire frequency range for an RFI mySQL database
+    :synopsis: Calculates the total energy of the entire frequency range for an RFI mySQL database, or for .csv exports of its tables
 .. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
 Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
 """
- 
+
 import numpy as np
-import math
-import pymysql
-import random
+import os
 import csv
-import sys
+import time
+import argparse
+import itertools
+import rfitrends.connection_manager
+import rfitrends.data_stream
+import rfitrends.GBT_receiver_specs
 
 # Note: Assumes GBT aperture efficiency (70%) and area of GBT (7853.98 m**2)
+aperture_efficiency = 0.70
+GBT_area = 7853.98
+# 1 Jy = 1e-26 W m**-2 Hz**-1
+jansky = 1.0e-26
+# multiplying flux times delta nu (in Jy Hz) by this gives energy per second
+energy_factor = aperture_efficiency*GBT_area*jansky
+
+# How often, in seconds, progress is printed
+progress_interval = 10.0
+
+
+def energy_bands(windows=()):
+    """
+    Lists the frequency bands to break the energy down into: each receiver in GBT_receiver_ranges, then any extra windows
+
+    param windows: (freq_min, freq_max) pairs in MHz
+    returns bands: list of (name, freq_min, freq_max) with frequencies in MHz
+    """
+    bands = [(receiver,receiver_range['freq_min'],receiver_range['freq_max']) for receiver,receiver_range in rfitrends.GBT_receiver_specs.GBT_receiver_ranges.items()]
+    bands += [(f"{freq_min:g}-{freq_max:g} MHz",freq_min,freq_max) for freq_min,freq_max in windows]
+    return(bands)
+
+
+class energy_integrator():
+    """
+    Sums flux times delta nu over a spectrum that arrives in chunks. The last row of each chunk is carried over so that the
+    interval between it and the first row of the next chunk is counted, just as if np.diff had seen the whole spectrum at once.
+    If segments are given (i.e. the mjd of each row), an interval between two rows of different segments is not counted,
+    since those rows come from different scans and the step between them is not a bandwidth.
+    """
+    def __init__(self,bands=()):
+        self.bands = list(bands)
+        self.band_min = np.array([band[1] for band in self.bands],dtype=np.float64)
+        self.band_max = np.array([band[2] for band in self.bands],dtype=np.float64)
+        self.total = 0.0
+        self.band_totals = np.zeros(len(self.bands))
+        self.rows = 0
+        self.carry = None
+
+    def intervals(self,frequency,intensity,segment=None):
+        """
+        Joins a chunk onto the row carried from the last one and works out the flux times delta nu of each interval
+
+        param frequency: array of frequencies in MHz, ordered within each segment
+        param intensity: array of intensities in Jy
+        param segment: optional array of segment ids for each row
+        returns start_frequency: the frequency (MHz) at the start of each interval
+        returns flux_times_delta_nu: flux times delta nu (Jy Hz) of each interval
+        returns start_segment: the segment of each interval (None if no segments were given)
+        """
+        if segment is None:
+            segment = np.zeros(len(frequency))
+            has_segments = False
+        else:
+            has_segments = True
+        if len(frequency) == 0:
+            return(np.array([]),np.array([]),np.array([]) if has_segments else None)
+        if self.carry is not None:
+            frequency = np.concatenate(([self.carry[0]],frequency))
+            intensity = np.concatenate(([self.carry[1]],intensity))
+            segment = np.concatenate(([self.carry[2]],segment))
+        self.carry = (frequency[-1],intensity[-1],segment[-1])
+        # MHz to Hz
+        delta_nu = np.diff(frequency)*1.0e6
+        same_segment = segment[1:] == segment[:-1]
+        flux_times_delta_nu = np.where(same_segment,intensity[:-1]*delta_nu,0.0)
+        flux_times_delta_nu[~np.isfinite(flux_times_delta_nu)] = 0.0
+        return(frequency[:-1],flux_times_delta_nu,segment[:-1] if has_segments else None)
+
+    def add(self,frequency,intensity,segment=None):
+        """
+        Adds a chunk of the spectrum to the total and to every band whose range contains the start of each interval
+        """
+        start_frequency,flux_times_delta_nu,_ = self.intervals(frequency,intensity,segment)
+        self.rows += len(frequency)
+        self.total += flux_times_delta_nu.sum()
+        if len(self.bands) > 0 and len(start_frequency) > 0:
+            in_band = (start_frequency[None,:] >= self.band_min[:,None]) & (start_frequency[None,:] <= self.band_max[:,None])
+            self.band_totals += in_band @ flux_times_delta_nu
+
+    def energy(self):
+        """
+        returns total_energy: the total energy
+        returns band_energy: dictionary of band name to energy
+        """
+        band_energy = {band[0]: self.band_totals[index]*energy_factor for index,band in enumerate(self.bands)}
+        return(self.total*energy_factor,band_energy)
+
+
+def integrate_stream(chunks,frequency_column,intensity_column,bands,segment_column=None,label=""):
+    """
+    Runs a stream of chunks through an energy_integrator, printing progress at most every progress_interval seconds
+
+    returns total_energy: the total energy
+    returns band_energy: dictionary of band name to energy
+    """
+    integrator = energy_integrator(bands)
+    last_print = time.monotonic()
+    for chunk in chunks:
+        segment = chunk[segment_column] if segment_column is not None else None
+        integrator.add(chunk[frequency_column],chunk[intensity_column],segment)
+        if time.monotonic()-last_print >= progress_interval:
+            print("progress: "+str(integrator.rows)+" rows integrated from "+label)
+            last_print = time.monotonic()
+    print("done: "+str(integrator.rows)+" rows integrated from "+label)
+    return(integrator.energy())
 
-def total_NRG_calc(full_data_table,avgs_data_table):
-    total_intensity = []
-    total_frequency = []
-    mean_intensity = []
-    median_intensity = []
-    avg_frequency = []
 
-    with open(full_data_table) as f:
+# The columns of the .csv exports of the main and avgs tables the first version of this script read, and their place in each row
+full_data_csv_columns = {"mjd": 0,"Frequency_MHz": 1,"Intensity_Jy": 2}
+avgs_data_csv_columns = {"Frequency": 0,"mean_intensity": 1,"median_intensity": 4}
 
-        reader=csv.reader(f)
-        for index,row in enumerate(reader):
-            total_frequency.append(float(row[1])*1000.0) #converting to Hz
-            total_intensity.append(float(row[2]))	
-            print("progress: "+str((index*100.0)/14000000.0)+"%")
 
-        f.close()
+def stream_csv(path,columns,chunk_size=rfitrends.data_stream.default_chunk_size):
+    """
+    Streams columns of a .csv export of a table, chunk_size rows at a time, in the same chunks data_stream gives for a table
 
+    param path: the .csv file
+    param columns: dictionary of column name to its place in each row
+    param chunk_size: number of rows per yielded chunk
+    yields chunk: dictionary of column name to float64 array
+    """
+    with open(path,newline='') as f:
+        reader = csv.reader(f)
+        while True:
+            rows = list(itertools.islice(reader,chunk_size))
+            if not rows:
+                return
+            yield({column: np.array([row[index] for row in rows],dtype=np.float64) for column,index in columns.items()})
 
-    with open(avgs_data_table) as f:
 
-        reader=csv.reader(f)
-        for index,row in enumerate(reader):
-            avg_frequency.append(float(row[0])*1000.0) # Converting to Hz
-            mean_intensity.append(float(row[1]))	
-            median_intensity.append(float(row[4]))
-            print("progress: "+str((index*100.0)/780278.0)+"%")
+def total_NRG_calc(connection_manager,full_data_table,avgs_data_table,windows=()):
+    """
+    Calculates the total energy of the full data table (each scan's spectrum integrated on its own), and of the mean and median
+    spectra of the avgs table, broken down by receiver band and by any extra frequency windows. Each table is read in one pass.
 
-        f.close()
+    param connection_manager: An object that connects to the database for the user
+    param full_data_table: the table containing all RFI data
+    param avgs_data_table: the table containing the RFI statistics
+    param windows: extra (freq_min, freq_max) windows in MHz to report the energy of
+    returns energies: dictionary with "total", "mean" and "median" entries, each a (total energy, band energy dictionary) pair
+    """
+    # In the order of the main table's (mjd, Frequency_MHz) key, so each scan's spectrum arrives in order of frequency
+    full_chunks = rfitrends.data_stream.stream_main_table(connection_manager,full_data_table,columns=("mjd","Frequency_MHz","Intensity_Jy"),order_by=("mjd","Frequency_MHz"))
+    avgs_chunks = rfitrends.data_stream.stream_avgs_table(connection_manager,avgs_data_table,columns=["Frequency","mean_intensity","median_intensity"])
+    return(integrate_energies(full_chunks,avgs_chunks,windows,str(full_data_table),str(avgs_data_table)))
+
+
+def total_NRG_calc_csv(full_data_csv,avgs_data_csv,windows=()):
+    """
+    Calculates the same energies as total_NRG_calc from .csv exports of the tables, as the first version of this script did:
+    mjd, frequency and intensity in the first three columns of the full data, and the columns of the avgs table in order.
+    The full data must be in order of frequency within each scan.
+
+    param full_data_csv: the .csv file of all RFI data
+    param avgs_data_csv: the .csv file of the RFI statistics
+    param windows: extra (freq_min, freq_max) windows in MHz to report the energy of
+    returns energies: as from total_NRG_calc
+    """
+    return(integrate_energies(stream_csv(full_data_csv,full_data_csv_columns),stream_csv(avgs_data_csv,avgs_data_csv_columns),windows,str(full_data_csv),str(avgs_data_csv)))
+
+
+def integrate_energies(full_chunks,avgs_chunks,windows=(),full_label="",avgs_label=""):
+    """
+    Integrates the energies of a stream of full data chunks (mjd, Frequency_MHz and Intensity_Jy) and a stream of avgs chunks
+    (Frequency, mean_intensity and median_intensity), and prints them
+
+    returns energies: dictionary with "total", "mean" and "median" entries, each a (total energy, band energy dictionary) pair
+    """
+    bands = energy_bands(windows)
+    energies = {}
 
-    print("calculating mean flux times delta nu")
-    mean_flux_times_delta_nu = [a*b for a,b in zip(mean_intensity[:-1],np.diff(avg_frequency))]  
-    print("calculating median flux times delta nu")
-    median_flux_times_delta_nu = [a*b for a,b in zip(median_intensity[:-1],np.diff(avg_frequency))]  
     print("calculating total flux times delta nu")
-    total_flux_times_delta_nu = [a*b for a,b in zip(total_intensity[:-1],np.diff(total_frequency))]
- 
-    # multiplying mean flux times delta nu * aperture efficiency (70% for GBT) * area in meters squared for GBT (7842.90 m**2) * conversion constant
-    total_NRG_mean = sum(mean_flux_times_delta_nu)*0.70*7853.98*math.pow(10,-26)
-    total_NRG_median = sum(median_flux_times_delta_nu)*0.70*7853.98*math.pow(10,-26)
-    total_NRG = sum(total_flux_times_delta_nu)*0.70*7853.98*math.pow(10,-26)
-    print("total mean energy: "+str(total_NRG_mean))
-    print("total median energy: "+str(total_NRG_median))
-    print("total energy: "+str(total_NRG))
+    energies["total"] = integrate_stream(full_chunks,"Frequency_MHz","Intensity_Jy",bands,segment_column="mjd",label=full_label)
 
+    print("calculating mean and median flux times delta nu")
+    # Two integrators share one pass over the avgs table
+    mean_integrator = energy_integrator(bands)
+    median_integrator = energy_integrator(bands)
+    last_print = time.monotonic()
+    for chunk in avgs_chunks:
+        mean_integrator.add(chunk["Frequency"],chunk["mean_intensity"])
+        median_integrator.add(chunk["Frequency"],chunk["median_intensity"])
+        if time.monotonic()-last_print >= progress_interval:
+            print("progress: "+str(mean_integrator.rows)+" rows integrated from "+avgs_label)
+            last_print = time.monotonic()
+    energies["mean"] = mean_integrator.energy()
+    energies["median"] = median_integrator.energy()
 
-if __name__ == "__main__":
-    full_data_table = sys.argv[1]
-    avgs_data_table = sys.argv[2]
+    print("total mean energy: "+str(energies["mean"][0]))
+    print("total median energy: "+str(energies["median"][0]))
+    print("total energy: "+str(energies["total"][0]))
+    print_band_energies(energies,bands)
+    return(energies)
+
+
+def print_band_energies(energies,bands):
+    """
+    Prints a table of the energy in every band that has any
+    """
+    print(f"{'band':<24}{'total':>16}{'mean':>16}{'median':>16}")
+    for band in bands:
+        name = band[0]
+        values = [energies[kind][1][name] for kind in ("total","mean","median")]
+        if not any(values):
+            continue
+        print(f"{name:<24}{values[0]:>16.6e}{values[1]:>16.6e}{values[2]:>16.6e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calculates the total energy of the frequency range of an RFI table, or of .csv exports of the tables")
+    parser.add_argument("full_data_table",help="The table containing all RFI data (likely main_table from RFI_input_for_SQL.py), or a .csv export of it")
+    parser.add_argument("avgs_data_table",help="The table containing the RFI statistics (likely table_to_make from RFI_avgs_loader.py), or a .csv export of it")
+    parser.add_argument("IP_address",nargs='?',default= '192.33.116.22',help="The IP address to find the SQL database. Default is the GBO development server address. This would only work for employees.")
+    parser.add_argument("database",nargs='?',default='jskipper',help="The name of the SQL database. Default is jskipper, which would only work for employees.")
+    parser.add_argument("--windows",nargs='*',type=rfitrends.data_stream.parse_window,default=[],help="Extra frequency windows to report the energy of, as freq_min:freq_max in MHz")
+    args = parser.parse_args()
     print("starting main function of total energy calculator")
-    total_NRG_calc(full_data_table,avgs_data_table)
\ No newline at end of file
+    # Two existing files are read as .csv exports, as this script always did, without connecting to the database
+    if os.path.isfile(args.full_data_table) and os.path.isfile(args.avgs_data_table):
+        total_NRG_calc_csv(args.full_data_table,args.avgs_data_table,args.windows)
+        return
+    connection_manager = rfitrends.connection_manager.connection_manager(args.IP_address,args.database)
+    total_NRG_calc(connection_manager,args.full_data_table,args.avgs_data_table,args.windows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+.. module:: waterfall.py
+    :synopsis: Bins the main RFI table into a fixed-size frequency x time image and draws it as a waterfall (dynamic spectrum) plot
+.. moduleauthor:: Joy Skipper <jskipper@nrao.edu>
+Code Origin: https://github.com/JoySkipper/GBT_RFI_Analysis_Tool
+"""
+
+import numpy as np
+import time
+import argparse
+import rfitrends.connection_manager
+import rfitrends.data_stream
+
+# How the rows that land in the same pixel are combined
+waterfall_statistics = ["max","mean"]
+
+# How often, in seconds, progress is printed
+progress_interval = 10.0
+
+
+class waterfall_image():
+    """
+    A frequency x time image filled in chunk by chunk, so any number of rows can be binned in a fixed amount of memory
+    """
+    def __init__(self,freq_min,freq_max,time_min,time_max,n_frequency=1024,n_time=512,statistic="max"):
+        if statistic not in waterfall_statistics:
+            raise ValueError("statistic must be one of "+str(waterfall_statistics))
+        self.freq_min = freq_min
+        self.freq_max = freq_max
+        self.time_min = time_min
+        self.time_max = time_max
+        self.n_frequency = n_frequency
+        self.n_time = n_time
+        self.statistic = statistic
+        self.rows = 0
+        if statistic == "max":
+            self.values = np.full(n_time*n_frequency,-np.inf)
+        else:
+            self.values = np.zeros(n_time*n_frequency)
+        self.counts = np.zeros(n_time*n_frequency,dtype=np.int64)
+
+    def add(self,frequency,time,intensity):
+        """
+        Bins a chunk of rows into the image
+
+        param frequency: array of frequencies in MHz
+        param time: array of times (mjd or lst) for each row
+        param intensity: array of intensities
+        """
+        frequency_pixel = np.floor((frequency-self.freq_min)/(self.freq_max-self.freq_min)*self.n_frequency).astype(np.int64)
+        time_pixel = np.floor((time-self.time_min)/(self.time_max-self.time_min)*self.n_time).astype(np.int64)
+        # Rows exactly on the upper edge belong in the last pixel
+        frequency_pixel[frequency == self.freq_max] = self.n_frequency-1
+        time_pixel[time == self.time_max] = self.n_time-1
+        keep = (frequency_pixel >= 0) & (frequency_pixel < self.n_frequency) & (time_pixel >= 0) & (time_pixel < self.n_time) & np.isfinite(intensity)
+        pixel = time_pixel[keep]*self.n_frequency+frequency_pixel[keep]
+        intensity = intensity[keep]
+        if self.statistic == "max":
+            np.maximum.at(self.values,pixel,intensity)
+        else:
+            self.values += np.bincount(pixel,weights=intensity,minlength=len(self.values))
+        self.counts += np.bincount(pixel,minlength=len(self.counts))
+        self.rows += len(pixel)
+
+    def image(self):
+        """
+        returns image: the n_time x n_frequency image, NaN where no rows landed
+        """
+        with np.errstate(invalid='ignore',divide='ignore'):
+            if self.statistic == "max":
+                values = self.values.copy()
+            else:
+                values = self.values/self.counts
+        values[self.counts == 0] = np.nan
+        return(values.reshape(self.n_time,self.n_frequency))
+
+    def extent(self):
+        """
+        returns extent: the (left, right, bottom, top) extent of the image for imshow
+        """
+        return((self.freq_min,self.freq_max,self.time_min,self.time_max))
+
+
+def build_waterfall(connection_manager,main_table,freq_min,freq_max,time_min,time_max,time_column="mjd",n_frequency=1024,n_time=512,statistic="max",where=None):
+    """
+    Streams the rows of a frequency and time range from the main table into a waterfall_image, printing progress at most every progress_interval seconds
+
+    param connection_manager: An object that connects to the database for the user
+    param main_table: the table containing all RFI data
+    param freq_min: the lowest frequency in MHz
+    param freq_max: the highest frequency in MHz
+    param time_min: the earliest time (mjd, or LST hours if time_column is lst)
+    param time_max: the latest time
+    param time_column: "mjd" or "lst"
+    param n_frequency: the width of the image in pixels
+    param n_time: the height of the image in pixels
+    param statistic: "max" or "mean" of the rows in each pixel
+    param where: optional extra SQL condition, such as "frontend = 'Rcvr1_2'"
+    returns waterfall: the filled waterfall_image
+    """
+    waterfall = waterfall_image(freq_min,freq_max,time_min,time_max,n_frequency,n_time,statistic)
+    condition = "Frequency_MHz BETWEEN "+repr(float(freq_min))+" AND "+repr(float(freq_max))+" AND "+time_column+" BETWEEN "+repr(float(time_min))+" AND "+repr(float(time_max))
+    if where:
+        condition = "("+where+") AND "+condition
+    chunks = rfitrends.data_stream.stream_main_table(connection_manager,main_table,columns=("Frequency_MHz",time_column,"Intensity_Jy"),order_by=None,where=condition)
+    last_print = time.monotonic()
+    for chunk in chunks:
+        waterfall.add(chunk["Frequency_MHz"],chunk[time_column],chunk["Intensity_Jy"])
+        if time.monotonic()-last_print >= progress_interval:
+            print("progress: "+str(waterfall.rows)+" rows binned")
+            last_print = time.monotonic()
+    print("done: "+str(waterfall.rows)+" rows binned")
+    return(waterfall)
+
+
+def draw_waterfall(waterfall,ax=None,log_scale=True,time_label="MJD",title=None):
+    """
+    Draws a waterfall_image with imshow, frequency along x and time along y
+
+    param waterfall: the waterfall_image to draw
+    param ax: the matplotlib Axes to draw on, the current Axes by default
+    param log_scale: whether to color the intensity on a log scale
+    param time_label: the label of the time axis
+    param title: the title of the plot
+    returns ax: the Axes drawn on
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LogNorm
+    if ax is None:
+        ax = plt.gca()
+    image = waterfall.image()
+    norm = None
+    if log_scale:
+        positive = image[np.isfinite(image) & (image > 0)]
+        if len(positive) > 0:
+            norm = LogNorm(vmin=positive.min(),vmax=positive.max())
+            image = np.where(image > 0,image,np.nan)
+    shown = ax.imshow(image,origin='lower',aspect='auto',extent=waterfall.extent(),interpolation='nearest',norm=norm)
+    ax.figure.colorbar(shown,ax=ax,label=waterfall.statistic+" Intensity (Jy)")
+    ax.set_xlabel("Frequency (MHz)")
+    ax.set_ylabel(time_label)
+    if title is None:
+        title = "Waterfall ("+waterfall.statistic+" per pixel)"
+    ax.set_title(title)
+    return(ax)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Draws a frequency x time waterfall plot of an RFI table")
+    parser.add_argument("main_table",help="The table containing all RFI data (likely main_table from RFI_input_for_SQL.py)")
+    parser.add_argument("freq_min",type=float,help="The lowest frequency in MHz")
+    parser.add_argument("freq_max",type=float,help="The highest frequency in MHz")
+    parser.add_argument("time_min",type=float,help="The earliest mjd (or LST hour with --time_column lst)")
+    parser.add_argument("time_max",type=float,help="The latest mjd (or LST hour with --time_column lst)")
+    parser.add_argument("IP_address",nargs='?',default= '192.33.116.22',help="The IP address to find the SQL database. Default is the GBO development server address. This would only work for employees.")
+    parser.add_argument("database",nargs='?',default='jskipper',help="The name of the SQL database. Default is jskipper, which would only work for employees.")
+    parser.add_argument("--time_column",choices=["mjd","lst"],default="mjd",help="Put mjd or LST on the time axis. Default is mjd")
+    parser.add_argument("--statistic",choices=waterfall_statistics,default="max",help="Combine the rows in each pixel by max or mean. Default is max")
+    parser.add_argument("--size",nargs=2,type=int,default=[1024,512],help="The image size in pixels, frequency then time. Default is 1024 512")
+    parser.add_argument("--where",default=None,help="An extra SQL condition, e.g. \"frontend = 'Rcvr1_2'\"")
+    parser.add_argument("--output",default=None,help="Save the plot to this image file instead of showing it")
+    args = parser.parse_args()
+    if args.output is not None:
+        import matplotlib
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    connection_manager = rfitrends.connection_manager.connection_manager(args.IP_address,args.database)
+    waterfall = build_waterfall(connection_manager,args.main_table,args.freq_min,args.freq_max,args.time_min,args.time_max,args.time_column,args.size[0],args.size[1],args.statistic,args.where)
+    fig,ax = plt.subplots(figsize=(16,9))
+    draw_waterfall(waterfall,ax,time_label="MJD" if args.time_column == "mjd" else "LST (hrs)")
+    if args.output is not None:
+        fig.savefig(args.output)
+    else:
+        plt.show()
+
+
+if __name__ == "__main__":
+    main()
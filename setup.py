@@ -22,7 +22,7 @@ VERSION = None
 
 # What packages are required for this module to be executed?
 REQUIRED = [
-    'numpy', 'matplotlib', 'julian', 'mysql-connector-python','tqdm',
+    'numpy', 'matplotlib', 'mysql-connector-python','tqdm',
 ]
 
 # What packages are optional?
@@ -110,6 +110,7 @@ setup(
     entry_points={
         "console_scripts":[
             "gbtrfiupload = rfitrends.RFI_input_for_SQL:main",
+            "rfitrends = rfitrends.cli:main",
         ]
     },
     install_requires=REQUIRED,
@@ -0,0 +1,74 @@
+"""
+Shared fixtures for the tests: a fake connection_manager for a database that never connects or asks for a password
+"""
+
+import pytest
+import rfitrends.connection_manager
+
+# The header of a scan file, as written for the GBT RFI archive
+scan_header_lines = ["projid: TRFI_052819_L1","date: 2019-05-28 12:00:00","utc (hrs): 12.0","mjd: 58631.5","lst (hrs): 3.2","scan_number: 0","frontend: Rcvr1_2",
+    "feed: 1","polarization: XX","backend: VEGAS","exposure (sec): 1.0","tsys (K): 20","frequency_type: TOPO","frequency_resolution (MHz): 0.01",
+    "source: rfiscan","azimuth (deg): 357","elevation (deg): 45","units: Jy"]
+
+
+class empty_connection_manager(rfitrends.connection_manager.connection_manager):
+    """
+    A connection_manager for a database with no rows in any table. respond optionally gives the rows of a command
+    (or None for the empty answer), so a test can fill in only the queries it cares about. Every command is kept in commands.
+    """
+    def __init__(self,host,database,respond=None):
+        self.host = host
+        self.database = database
+        self.respond = respond
+        self.commands = []
+
+    def execute_command(self,command):
+        self.commands.append(command)
+        if self.respond is not None:
+            rows = self.respond(command)
+            if rows is not None:
+                return(rows)
+        # Counting an empty table still gives a row
+        if command.startswith("SELECT COUNT(*)"):
+            return([(0,)])
+        return([])
+
+    def stream_query(self,query,chunk_size=100000):
+        self.commands.append(query)
+        return(iter([]))
+
+    def insert_rows(self,table,columns,rows,batch_size=5000):
+        self.commands.append("INSERT INTO "+str(table))
+
+
+@pytest.fixture
+def fake_connection():
+    """
+    returns make: a function taking an optional respond function and giving an empty_connection_manager
+    """
+    def make(respond=None):
+        return(empty_connection_manager("host","database",respond))
+    return(make)
+
+
+@pytest.fixture
+def empty_database(monkeypatch):
+    """
+    Makes every script's connection_manager an empty_connection_manager
+    """
+    monkeypatch.setattr(rfitrends.connection_manager,"connection_manager",empty_connection_manager)
+
+
+@pytest.fixture
+def scan_file(tmp_path):
+    """
+    returns write: a function writing a scan file with a header from data lines ("window channel frequency intensity") and returning its path.
+    mjd optionally replaces the mjd of the header.
+    """
+    def write(data_lines,mjd=None,filename="TRFI_052819_L1_rfiscan1_s0000_f001_Linr_az357_el045.txt"):
+        header = [line if mjd is None or not line.startswith("mjd:") else "mjd: "+str(mjd) for line in scan_header_lines]
+        lines = ["################ HEADER #################"]+["# "+line for line in header]+["################# DATA ##################","# Window Channel Frequency(MHz) Intensity(Jy)"]
+        filepath = tmp_path/filename
+        filepath.write_text("\n".join(lines+list(data_lines))+"\n")
+        return(str(filepath))
+    return(write)
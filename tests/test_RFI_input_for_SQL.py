@@ -0,0 +1,70 @@
+"""
+Tests for parsing the scan files uploaded by RFI_input_for_SQL.py
+"""
+
+import sys
+import datetime
+from decimal import Decimal, ROUND_DOWN
+import numpy as np
+import pytest
+import rfitrends.connection_manager
+import rfitrends.GBT_receiver_specs
+import rfitrends.RFI_input_for_SQL
+import rfitrends.parsed_scan
+
+
+def test_choose_frontend_infers_names_without_a_range():
+    # Verified names that aren't in GBT_receiver_ranges are checked by inferring from the frequencies instead
+    frequencies = np.linspace(1200.0,1600.0,100)
+    for frontend in ['RcvrPF_2','Rcvr75_115']:
+        assert rfitrends.GBT_receiver_specs.choose_frontend(frontend,frequencies,from_filename=True) == rfitrends.GBT_receiver_specs.infer_frontend(frequencies)
+
+
+def test_parse_task_keeps_the_error_of_a_file_that_fails(monkeypatch,tmp_path):
+    def parse_file(filepath):
+        raise UnicodeDecodeError("utf-8",b"\xff",0,1,"invalid start byte")
+    monkeypatch.setattr(rfitrends.RFI_input_for_SQL,"parse_file",parse_file)
+    filepath = str(tmp_path/"TRFI_052819_L1_rfiscan1_s0000_f001_Linr_az357_el045.txt")
+    [(result_filepath,scan,error)] = rfitrends.RFI_input_for_SQL.parse_task([filepath])
+    assert (result_filepath,scan) == (filepath,None)
+    assert isinstance(error,UnicodeDecodeError)
+
+
+def test_headerless_mjd_matches_the_mjd_files_were_stored_with():
+    # Headerless files were stored with the MJD julian.to_jd gave, so a rerun must give the very same value to find them as duplicates
+    assert str(rfitrends.RFI_input_for_SQL.headerless_mjd(datetime.datetime(2007,8,28,14,38,24))) == "54341.109"
+    julian = pytest.importorskip("julian")
+    generator = np.random.default_rng(0)
+    for timestamp in generator.uniform(0,2e9,20000):
+        date = datetime.datetime.utcfromtimestamp(timestamp)
+        stored = Decimal(julian.to_jd(date+datetime.timedelta(hours=12),fmt='jd')-2400000.5).quantize(Decimal('0.001'),rounding=ROUND_DOWN)
+        assert rfitrends.RFI_input_for_SQL.headerless_mjd(date) == stored
+
+
+def test_parsed_scan_counts_the_nan_lines_it_drops(scan_file):
+    filepath = scan_file(["0 0 1400.0000 6.0","0 1 1400.0100 NaN","0 2 1400.0200 5.0","0 3 1400.0300 nan"])
+    scan = rfitrends.RFI_input_for_SQL.parse_file(filepath)
+    assert (len(scan),scan.nan_lines) == (2,2)
+
+
+class refused_connection_manager():
+    def __init__(self,host,database):
+        raise AssertionError("connected before checking the arguments")
+
+
+@pytest.mark.parametrize("arguments",[["--compare_latest"],["--compare_latest","--avgs_table","avgs","--layout","packed"],["--occurrence_index","index"]])
+def test_upload_checks_its_arguments_before_connecting(monkeypatch,tmp_path,arguments):
+    monkeypatch.setattr(rfitrends.connection_manager,"connection_manager",refused_connection_manager)
+    monkeypatch.setattr(sys,"argv",["RFI_input_for_SQL.py","main","dirty",str(tmp_path)]+arguments)
+    with pytest.raises(SystemExit) as exit:
+        rfitrends.RFI_input_for_SQL.main()
+    assert exit.value.code == 2
+
+
+@pytest.mark.parametrize("text",["1.4714568","1.4568","32.6842","38.119834","44.697857","8.1234567","23.69","1.0001","0.3401","49.99995","1471.4568","1420.40575177","3000.0001"])
+def test_frequency_keys_match_the_decimal_truncation_of_the_stored_frequency(text):
+    # Frequencies below 245 are GHz and are multiplied up to MHz as floats before their string is truncated
+    value = float(text)*1000.0 if float(text) < 245.0 else float(text)
+    stored = Decimal(str(value) if float(text) < 245.0 else text).quantize(Decimal('0.0001'),rounding=ROUND_DOWN)
+    key = rfitrends.parsed_scan.frequency_keys(np.array([value]))[0]
+    assert rfitrends.parsed_scan.frequency_key_string(key) == str(stored)
@@ -0,0 +1,20 @@
+"""
+Tests for the statistics RFI_avgs_loader.py calculates for each group of repeated frequencies
+"""
+
+import numpy as np
+import rfitrends.RFI_avgs_loader
+import rfitrends.data_stream
+
+
+def test_statistics_match_numpy_when_nearly_equal_frequencies_are_merged():
+    # Ordered by (Frequency_MHz, Intensity_Jy), as the database returns them, so the merged group isn't sorted by intensity
+    frequency = np.array([100.0,100.0,100.0000001,100.0000001,200.0,200.0,200.0])
+    intensity = np.array([5.0,9.0,1.0,2.0,3.0,7.0,8.0])
+    starts = rfitrends.data_stream.group_starts(frequency,rel_tol=1e-6)
+    statistics = rfitrends.RFI_avgs_loader.frequency_group_statistics(frequency,intensity,starts)
+    for group,values in enumerate([intensity[:4],intensity[4:]]):
+        assert statistics["median_intensity"][group] == np.median(values)
+        assert np.isclose(statistics["low_percentile_intensity"][group],np.percentile(values,rfitrends.RFI_avgs_loader.low_percentile))
+        assert np.isclose(statistics["high_percentile_intensity"][group],np.percentile(values,rfitrends.RFI_avgs_loader.high_percentile))
+        assert statistics["mean_intensity"][group] == np.mean(values)
@@ -0,0 +1,61 @@
+"""
+Smoke tests for the rfitrends subcommands: every script imports, parses --help, and gets through main() against a database
+connection that holds nothing, so a main() that can't even start is caught before it is released.
+"""
+
+import sys
+import types
+import inspect
+import importlib
+import pytest
+import rfitrends.cli
+
+
+def code_objects(code):
+    yield code
+    for constant in code.co_consts:
+        if isinstance(constant,types.CodeType):
+            yield from code_objects(constant)
+
+
+def run_command(monkeypatch,arguments):
+    # cli.main replaces sys.argv for the script it runs
+    monkeypatch.setattr(sys,"argv",list(sys.argv))
+    return(rfitrends.cli.main(arguments))
+
+
+@pytest.mark.parametrize("command",list(rfitrends.cli.commands))
+def test_no_function_shadows_the_package(command):
+    # A function-local "import rfitrends.x" makes rfitrends a local name in the whole function, so any use of rfitrends before it fails
+    module = importlib.import_module(rfitrends.cli.commands[command][0])
+    code = compile(inspect.getsource(module),module.__file__,"exec")
+    for function in code_objects(code):
+        assert "rfitrends" not in function.co_varnames+function.co_cellvars,function.co_name+" in "+module.__name__+" binds rfitrends locally"
+
+
+@pytest.mark.parametrize("command",list(rfitrends.cli.commands))
+def test_help(monkeypatch,command):
+    with pytest.raises(SystemExit) as exit:
+        run_command(monkeypatch,[command,"--help"])
+    assert exit.value.code == 0
+
+
+def test_upload(monkeypatch,empty_database,tmp_path,capsys):
+    scans = tmp_path/"scans"
+    scans.mkdir()
+    run_command(monkeypatch,["upload","main","dirty",str(scans),"--avgs_table","avgs","--occurrence_index",str(tmp_path/"index"),
+        "--regrid_cube",str(tmp_path/"cube"),"--quicklook",str(tmp_path/"quicklook"),"--compare_latest"])
+    assert "All files uploaded." in capsys.readouterr().out
+
+
+def test_graph(monkeypatch,empty_database,tmp_path):
+    run_command(monkeypatch,["graph","avgs","--no_cache","--output_directory",str(tmp_path)])
+
+
+def test_lines(monkeypatch,empty_database,tmp_path,capsys):
+    run_command(monkeypatch,["lines","files",str(tmp_path),"--workers","1"])
+    assert "0 emitters in 0 scans" in capsys.readouterr().out
+
+
+def test_compare(monkeypatch,empty_database):
+    run_command(monkeypatch,["compare","main","avgs"])
@@ -0,0 +1,17 @@
+"""
+Tests for the helpers data_stream.py shares between the scripts
+"""
+
+import numpy as np
+import rfitrends.data_stream
+
+
+def test_nearest_frequency():
+    sorted_frequency = np.array([100.0,101.0,105.0])
+    nearest = rfitrends.data_stream.nearest_frequency(sorted_frequency,[99.8,100.4,100.6,103.2,105.4,106.0],0.5)
+    assert nearest.tolist() == [0,0,1,-1,2,-1]
+    assert rfitrends.data_stream.nearest_frequency(np.array([]),[100.0],0.5).tolist() == [-1]
+
+
+def test_parse_window():
+    assert rfitrends.data_stream.parse_window("600:700.5") == (600.0,700.5)
@@ -0,0 +1,21 @@
+"""
+Tests for reading frequency ranges from the levels frequency_pyramid.py builds
+"""
+
+import rfitrends.frequency_pyramid
+
+
+def test_range_keeps_bins_overlapping_the_edges(fake_connection):
+    def respond(command):
+        if command.startswith("SELECT bin_width_MHz,level_table FROM avgs_pyramid"):
+            return([(10.0,"avgs_bin_10MHz")])
+    connection_manager = fake_connection(respond)
+    data,bin_width = rfitrends.frequency_pyramid.query_pyramid(connection_manager,"avgs",1003.0,1097.0,10.0)
+    assert bin_width == 10.0
+    # The bins 1000-1010 and 1090-1100, centred on 1005 and 1095, hold frequencies inside the range and must be read
+    query = connection_manager.commands[-1]
+    assert "FROM avgs_bin_10MHz WHERE Frequency > 998.0 AND Frequency <= 1102.0" in query
+
+
+def test_avgs_table_range_is_unchanged():
+    assert rfitrends.frequency_pyramid.range_condition(1000.0,1100.0) == "Frequency BETWEEN 1000.0 AND 1100.0"
@@ -0,0 +1,34 @@
+"""
+Tests for the table versions query.py keys its cached results with
+"""
+
+from decimal import Decimal
+import rfitrends.query
+import rfitrends.RFI_input_for_SQL
+
+
+def test_backfilled_scan_gives_a_new_version(fake_connection,scan_file):
+    # A wide main table whose times MySQL hasn't updated, and whose newest scan is newer than the one uploaded
+    generations = {}
+    def respond(command):
+        if command.startswith("SELECT table_type,CREATE_TIME,UPDATE_TIME") and "\'main\'" in command:
+            return([("BASE TABLE","2026-01-01 00:00:00",None)])
+        if "table_name = \'table_generations\'" in command:
+            return([(1 if generations else 0,)])
+        if command.startswith("INSERT INTO table_generations"):
+            table = command.split("\'")[1]
+            generations[table] = generations.get(table,0)+1
+        if command.startswith("SELECT generation FROM table_generations"):
+            table = command.split("\'")[1]
+            return([(generations[table],)] if table in generations else [])
+        if "key_column_usage" in command:
+            return([("mjd",)])
+        if command.startswith("SELECT MAX(`mjd`)"):
+            return([(Decimal("60000.000"),)])
+        if command.startswith("SELECT projid,mjd from latest_projects"):
+            return([("None",Decimal("60000.000"))])
+    connection_manager = fake_connection(respond)
+    before = rfitrends.query.table_version(connection_manager,"main")
+    filepath = scan_file(["0 0 1400.0000 6.0","0 1 1400.0100 5.0"],mjd=50000.5)
+    rfitrends.RFI_input_for_SQL.upload_files([filepath],connection_manager,"main","dirty")
+    assert rfitrends.query.table_version(connection_manager,"main") != before
@@ -0,0 +1,15 @@
+"""
+Tests for the receivers receiver_partitions.py makes partitions for
+"""
+
+import rfitrends.receiver_partitions
+
+
+def test_standard_receivers_include_every_frontend_in_the_table(fake_connection):
+    def respond(command):
+        if command.startswith("SELECT DISTINCT frontend FROM main"):
+            return([("Rcvr1_2",),("Kband All",),("RcvrMBA1_2",),(None,)])
+    receivers = rfitrends.receiver_partitions.standard_receivers(fake_connection(respond),"main")
+    assert {"Rcvr1_2","Kband All","RcvrMBA1_2"} <= set(receivers)
+    assert set(rfitrends.receiver_partitions.standard_receivers()) <= set(receivers)
+    assert None not in receivers
@@ -0,0 +1,21 @@
+"""
+Tests for the tables and views schema_manager.py makes for each layout of the main table
+"""
+
+import pytest
+import rfitrends.schema_manager
+
+
+def test_packed_layout_makes_no_views(fake_connection):
+    connection_manager = fake_connection()
+    rfitrends.schema_manager.ensure_schema(connection_manager,"main","dirty",layout="packed")
+    assert not any("VIEW" in command for command in connection_manager.commands)
+
+
+def test_packed_layout_refuses_a_table_the_scripts_read(fake_connection):
+    # A database holding only a view named main, as the normalized layout makes
+    def respond(command):
+        if command.startswith("SELECT table_type") and "\'main\'" in command:
+            return([("VIEW",)])
+    with pytest.raises(ValueError):
+        rfitrends.schema_manager.ensure_schema(fake_connection(respond),"main","dirty",layout="packed")
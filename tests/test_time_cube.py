@@ -0,0 +1,34 @@
+"""
+Tests for the time bins time_cube.py makes its cubes with
+"""
+
+import pytest
+import rfitrends.time_cube
+
+
+@pytest.mark.parametrize("time_axis",["month","mjd"])
+def test_time_edges_of_a_table_without_rows(fake_connection,time_axis):
+    # MIN and MAX of no rows are NULL
+    def respond(command):
+        if command.startswith("SELECT MIN(mjd),MAX(mjd)"):
+            return([(None,None)])
+    with pytest.raises(ValueError,match="no rows"):
+        rfitrends.time_cube.time_edges_for_axis(fake_connection(respond),"main",time_axis,30.0,1.0,"frontend = 'Rcvr1_2'")
+
+
+def test_frequency_edges_cover_only_the_frequencies_in_the_table(fake_connection):
+    def respond(command):
+        if command.startswith("SELECT MIN(Frequency_MHz),MAX(Frequency_MHz)"):
+            return([(1105.3,1734.9)])
+    edges,condition = rfitrends.time_cube.frequency_edges_for_table(fake_connection(respond),"main",290.0,115300.0,10.0,"frontend = 'Rcvr1_2'")
+    assert edges[0] == 1100.0 and edges[-1] == 1740.0
+    assert len(edges) == 65
+    assert condition.startswith("(frontend = 'Rcvr1_2') AND ")
+
+
+def test_frequency_edges_of_a_table_without_rows(fake_connection):
+    def respond(command):
+        if command.startswith("SELECT MIN(Frequency_MHz),MAX(Frequency_MHz)"):
+            return([(None,None)])
+    with pytest.raises(ValueError,match="no rows"):
+        rfitrends.time_cube.frequency_edges_for_table(fake_connection(respond),"main",290.0,115300.0,10.0,None)
@@ -0,0 +1,30 @@
+"""
+Tests for total_energy_calculator.py reading .csv exports of the tables
+"""
+
+import sys
+import numpy as np
+import rfitrends.connection_manager
+import rfitrends.total_energy_calculator
+
+
+def write_csv(path,rows):
+    path.write_text("".join(",".join(str(value) for value in row)+"\n" for row in rows))
+    return(str(path))
+
+
+def test_csv_exports_give_the_energy_of_each_scan(monkeypatch,tmp_path):
+    # Two scans, so the step from the end of the first to the start of the second isn't bandwidth
+    full_data = write_csv(tmp_path/"full.csv",[(58000.1,1000.0,2.0),(58000.1,1000.5,4.0),(58000.1,1001.0,6.0),(58000.2,1000.0,1.0),(58000.2,1002.0,3.0)])
+    avgs_data = write_csv(tmp_path/"avgs.csv",[(1000.0,2.0,9.0,0.0,1.0,0.0,9.0),(1001.0,4.0,9.0,0.0,3.0,0.0,9.0),(1003.0,5.0,9.0,0.0,5.0,0.0,9.0)])
+    energies = rfitrends.total_energy_calculator.total_NRG_calc_csv(full_data,avgs_data)
+    factor = rfitrends.total_energy_calculator.energy_factor
+    assert np.isclose(energies["total"][0],(2.0*0.5e6+4.0*0.5e6+1.0*2.0e6)*factor)
+    assert np.isclose(energies["mean"][0],(2.0*1.0e6+4.0*2.0e6)*factor)
+    assert np.isclose(energies["median"][0],(1.0*1.0e6+3.0*2.0e6)*factor)
+    # Given two files, the script reads them without connecting to the database
+    def refuse(host,database):
+        raise AssertionError("connected to read .csv files")
+    monkeypatch.setattr(rfitrends.connection_manager,"connection_manager",refuse)
+    monkeypatch.setattr(sys,"argv",["total_energy_calculator.py",full_data,avgs_data])
+    rfitrends.total_energy_calculator.main()